@@ -0,0 +1,122 @@
+"""Compares saving a user's responses with one batch submission against saving
+them with one PUT each, on SQLite.
+
+Run from the root of the project:
+```
+python bench/batch.py [--sizes N,N,...] [--rounds N]
+```
+Seeds a temporary SQLite database (a file, so that commits are synced to disk
+like in a real deployment) with users and questions. For each size, times
+submitting that many new responses for a user, and then changing all of
+them, both as one `POST /users/<id>/responses:batch` and as one
+`PUT /users/<id>/responses/<question_id>` per response. Each round uses a new
+user. Prints the median times and the number of SQL statements (read from the
+`Server-Timing` header) as JSON.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prophet  # noqa: E402
+from prophet import db  # noqa: E402
+from prophet.models import Question, QuestionStats, User  # noqa: E402
+
+_sql_count_re = re.compile(r'sql;dur=[\d.]+;desc="(\d+) ')
+
+
+def statements(response):
+    match = _sql_count_re.search(response.headers.get('Server-Timing', ''))
+    return int(match[1]) if match else 0
+
+
+def submit_batch(client, user_id, question_ids, answer):
+    response = client.post(
+        f'/users/{user_id}/responses:batch',
+        json=[{'question_id': id, 'response': answer} for id in question_ids])
+    assert response.status_code == 200, response.json
+    return statements(response)
+
+
+def submit_puts(client, user_id, question_ids, answer):
+    count = 0
+    for id in question_ids:
+        response = client.put(
+            f'/users/{user_id}/responses/{id}', json={'response': answer})
+        assert response.status_code == 200, response.json
+        count += statements(response)
+    return count
+
+
+def measure(client, submit, user_ids, question_ids):
+    """Times creating and then changing the responses of each user, and
+    returns the medians and the statement counts.
+    """
+    samples = {'create': [], 'change': []}
+    counts = {}
+    for user_id in user_ids:
+        for name, answer in (('create', True), ('change', False)):
+            start = time.perf_counter()
+            counts[name] = submit(client, user_id, question_ids, answer)
+            samples[name].append(time.perf_counter() - start)
+
+    result = {
+        f'{name}_seconds': statistics.median(s) for name, s in samples.items()
+    }
+    result.update({f'{name}_statements': c for name, c in counts.items()})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default='1,10,20,50,100',
+        help="Comma-separated numbers of responses per submission")
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        app = prophet.create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        })
+        with app.app_context():
+            db.create_all()
+            # A new user for every round of every size and way of submitting
+            db.session.execute(User.__table__.insert(), [
+                {'subject_identifier': f'user-{i}'}
+                for i in range(len(sizes) * args.rounds * 2)
+            ])
+            for i in range(max(sizes)):
+                db.session.add(
+                    Question(prompt=f"Question {i}", correct_answer=True,
+                             stats=QuestionStats()))
+            db.session.commit()
+
+        client = app.test_client()
+        user_ids = iter(range(1, len(sizes) * args.rounds * 2 + 1))
+        result = []
+        for size in sizes:
+            question_ids = list(range(1, size + 1))
+            entry = {'responses': size}
+            for name, submit in (
+                    ('batch', submit_batch), ('puts', submit_puts)):
+                users = [next(user_ids) for _ in range(args.rounds)]
+                entry[name] = measure(client, submit, users, question_ids)
+            entry['speedup'] = entry['puts']['create_seconds'] \
+                / entry['batch']['create_seconds']
+            result.append(entry)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
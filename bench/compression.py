@@ -0,0 +1,117 @@
+"""Measures the CPU cost of compressing responses against the bytes it saves,
+for question list pages of several sizes.
+
+Run from the root of the project:
+```
+python bench/compression.py [--sizes N,N,...] [--rounds N]
+```
+Uses an in-memory database, so no environment variables are needed. For each
+page size, prints the uncompressed size and, for each encoding and level, the
+compressed size, the median time to compress the page and the bytes saved per
+millisecond of CPU time. It also times requests for the page with each
+encoding, which are served from the cached compressed copy after the first
+one. Brotli is only measured if the `brotli` package is installed.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import zlib
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prophet  # noqa: E402
+from prophet import db  # noqa: E402
+from prophet.compression import ENCODINGS, brotli  # noqa: E402
+from prophet.models import Question, QuestionStats  # noqa: E402
+
+QUESTION_COUNT = 1000
+
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_QUALITIES = (1, 5, 11)
+
+
+def gzip_compress(body, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def median_time(function, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def measure(body, compress, rounds):
+    compressed = compress(body)
+    seconds = median_time(lambda: compress(body), rounds)
+    saved = len(body) - len(compressed)
+    return {
+        'size': len(compressed),
+        'ratio': len(compressed) / len(body),
+        'seconds': seconds,
+        'saved_bytes_per_ms': saved / (seconds * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default='1,10,100,1000',
+        help="Comma-separated numbers of questions per page")
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    app = prophet.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        for i in range(QUESTION_COUNT):
+            db.session.add(Question(
+                prompt=f"Will question {i} be answered correctly?",
+                more_info_link=f'https://example.com/questions/{i}',
+                stats=QuestionStats()))
+        db.session.commit()
+
+        client = app.test_client()
+        result = []
+        for size in (int(s) for s in args.sizes.split(',')):
+            path = f'/questions?limit={size}'
+            body = client.get(path).get_data()
+
+            encodings = {
+                f'gzip-{level}': measure(
+                    body, lambda b: gzip_compress(b, level), args.rounds)
+                for level in GZIP_LEVELS
+            }
+            if brotli is not None:
+                encodings.update({
+                    f'br-{quality}': measure(
+                        body, lambda b: brotli.compress(b, quality=quality),
+                        args.rounds)
+                    for quality in BROTLI_QUALITIES
+                })
+
+            requests = {}
+            for encoding in ('identity',) + ENCODINGS:
+                headers = {'Accept-Encoding': encoding}
+                requests[encoding] = median_time(
+                    lambda: client.get(path, headers=headers), args.rounds)
+
+            result.append({
+                'questions': size,
+                'size': len(body),
+                'encodings': encodings,
+                'cached_request_seconds': requests,
+            })
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Checks that deleting a question takes the same amount of Python memory no
+matter how many responses it has, since they're deleted with one statement.
+
+Run from the root of the project:
+```
+python bench/delete.py [--steps N,N,...]
+```
+For each step, seeds a temporary SQLite database with a question answered by
+that many users (with their scores), then deletes it through the API while
+tracing memory allocations. Prints the peak memory and time of each delete as
+JSON, and exits with an error if the largest peak is more than the allowed
+factor above the smallest one, or if any responses or scores were left wrong.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prophet  # noqa: E402
+from prophet import db  # noqa: E402
+from prophet.models import (  # noqa: E402
+    Question, QuestionStats, Response, User, UserScore, UserScoreCount)
+
+# Maximum ratio between the largest and smallest peak memory
+FLATNESS_TARGET = 1.5
+
+INSERT_CHUNK_SIZE = 10000
+
+
+def seed(count):
+    now = datetime.utcnow()
+    db.session.add(Question(
+        prompt="Popular", correct_answer=True,
+        stats=QuestionStats(true_count=count)))
+    db.session.flush()
+    for start in range(0, count, INSERT_CHUNK_SIZE):
+        ids = range(start + 1, min(start + INSERT_CHUNK_SIZE, count) + 1)
+        db.session.execute(User.__table__.insert(), [
+            {'id': id, 'subject_identifier': f'user-{id}'} for id in ids
+        ])
+        db.session.execute(Response.__table__.insert(), [
+            {
+                'user_id': id,
+                'question_id': 1,
+                'response': True,
+                'answered_at': now,
+                'updated_at': now,
+            }
+            for id in ids
+        ])
+        db.session.execute(UserScore.__table__.insert(), [
+            {'user_id': id, 'correct_count': 1, 'answered_count': 1}
+            for id in ids
+        ])
+    db.session.add(UserScoreCount(correct_count=1, user_count=count))
+    db.session.commit()
+
+
+def run(count):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        app = prophet.create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+            'METRICS_ENABLED': False,
+        })
+        with app.app_context():
+            db.create_all()
+            seed(count)
+            db.session.remove()
+
+        client = app.test_client()
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.delete('/questions/1')
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert response.status_code == 200, response.json
+
+        with app.app_context():
+            left = db.session.query(Response).count()
+            scored = db.session.query(UserScore) \
+                .filter(UserScore.correct_count != 0) \
+                .count()
+
+    return {
+        'responses': count,
+        'peak_bytes': peak,
+        'seconds': elapsed,
+        'responses_left': left,
+        'scores_left': scored,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--steps', default='1000,10000,100000',
+        help="Comma-separated response counts to measure at")
+    args = parser.parse_args()
+
+    # The first request also allocates things which are only set up once
+    run(10)
+    result = [run(int(s)) for s in args.steps.split(',')]
+    peaks = [r['peak_bytes'] for r in result]
+    growth = max(peaks) / min(peaks)
+    print(json.dumps({
+        'steps': result,
+        'growth': growth,
+        'target': FLATNESS_TARGET,
+    }, indent=2))
+
+    if growth > FLATNESS_TARGET or \
+            any(r['responses_left'] or r['scores_left'] for r in result):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
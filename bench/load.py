@@ -0,0 +1,473 @@
+"""Runs concurrent load against every API route and reports throughput,
+latency percentiles and SQL statements per request.
+
+Run from the root of the project:
+```
+python bench/load.py [--responses N] [--threads N] [--output FILE]
+python bench/load.py --database postgresql://localhost/prophet_bench
+```
+Seeds a temporary SQLite database (or the empty database given with
+`--database`) with users, questions and `--responses` random responses, then
+sends `--requests` requests to each route from `--threads` threads. Access
+tokens are signed locally and their keys are served from a local JWKS server,
+so authentication runs its real code path without the network. Tokens are
+sent to every route but `/metrics` and verified like `requires_auth()` does,
+as they will be once the routes require them. The deletes remove users and
+questions (with their responses) which are seeded just before they run. The
+live stream is timed until its first event. A few microbenchmarks of the hot
+paths (token verification and serialization) are measured as well.
+
+Prints the results as JSON with sorted keys, so that the output of two commits
+can be compared with `diff`. The SQL statement counts are read from the
+`Server-Timing` header added by `prophet.metrics`, so for the streamed export
+and live stream they only include the statements made before the body starts.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.keys import JwksServer, SigningKey  # noqa: E402
+
+TENANT_ID = 'bench-tenant'
+AUDIENCE = 'api://bench'
+ISSUER_BASE_URL = 'https://issuer.invalid'
+KEY_ID = 'bench-key'
+EXPORT_SCOPE = 'Responses.Export'
+
+INSERT_CHUNK_SIZE = 10000
+PAGE_SIZE = 100
+# Responses of each user or question seeded for the delete scenarios
+DELETED_RESPONSES = 10
+
+# Scenarios which remove what they act on, with the kind of rows seeded for
+# them right before they run
+DELETE_SCENARIOS = {
+    'DELETE /users/<id>': 'users',
+    'DELETE /questions/<id>': 'questions',
+}
+
+_sql_count_re = re.compile(r'sql;dur=[\d.]+;desc="(\d+) ')
+
+
+def seed(db, users, questions, responses):
+    """Adds the users, questions and random responses to an empty database.
+    Returns the `(user_id, question_id)` of the responses.
+    """
+    from prophet.models import Question, Response, User
+
+    now = datetime.utcnow()
+    db.session.execute(User.__table__.insert(), [
+        {'subject_identifier': f'user-{i}'} for i in range(users)
+    ])
+    rows = []
+    for i in range(questions):
+        kind = i % 10
+        rows.append({
+            'prompt': f"Question {i}",
+            # A tenth are scheduled for later and a tenth have expired
+            'available_at': now + timedelta(days=1 if kind == 0 else -30),
+            'expires_at': now - timedelta(days=1) if kind == 1 else None,
+            'correct_answer': None if kind == 2 else i % 2 == 0,
+        })
+    db.session.execute(Question.__table__.insert(), rows)
+    db.session.commit()
+
+    # Distinct (user, question) pairs, numbered row by row
+    pairs = [
+        (pair // questions + 1, pair % questions + 1)
+        for pair in random.sample(range(users * questions), responses)
+    ]
+    table = Response.__table__
+    for start in range(0, responses, INSERT_CHUNK_SIZE):
+        rows = []
+        for user_id, question_id in pairs[start:start + INSERT_CHUNK_SIZE]:
+            answered_at = now - timedelta(
+                seconds=random.randint(0, 30 * 86400))
+            rows.append({
+                'user_id': user_id,
+                'question_id': question_id,
+                'response': random.choice((True, False, True, False, None)),
+                'answered_at': answered_at,
+                'updated_at': answered_at,
+            })
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+
+    return pairs
+
+
+def rebuild_derived(app):
+    """Computes the stats and scores of the seeded responses.
+    """
+    runner = app.test_cli_runner()
+    for command in ('rebuild-stats', 'rebuild-scores'):
+        runner.invoke(args=[command])
+
+
+def seed_deletable(app, db, kind, count, users, questions):
+    """Adds `count` users or questions (depending on `kind`) for a delete
+    scenario to remove, each with `DELETED_RESPONSES` responses to the seeded
+    questions or from the seeded users. Returns their IDs.
+    """
+    from prophet.models import Question, Response, User
+
+    if kind == 'users':
+        db.session.execute(User.__table__.insert(), [
+            {'subject_identifier': f'deletable-{i}'} for i in range(count)
+        ])
+        ids = [
+            id for id, in db.session.query(User.id)
+            .filter(User.subject_identifier.like('deletable-%'))
+        ]
+        rows = [
+            {'user_id': id, 'question_id': other}
+            for id in ids
+            for other in random.sample(
+                range(1, questions + 1), DELETED_RESPONSES)
+        ]
+    else:
+        db.session.execute(Question.__table__.insert(), [
+            {'prompt': f"Deletable {i}", 'correct_answer': i % 2 == 0}
+            for i in range(count)
+        ])
+        ids = [
+            id for id, in db.session.query(Question.id)
+            .filter(Question.prompt.like('Deletable %'))
+        ]
+        rows = [
+            {'user_id': other, 'question_id': id}
+            for id in ids
+            for other in random.sample(range(1, users + 1), DELETED_RESPONSES)
+        ]
+
+    for row in rows:
+        row['response'] = random.choice((True, False, None))
+    db.session.execute(Response.__table__.insert(), rows)
+    db.session.commit()
+    rebuild_derived(app)
+    return ids
+
+
+def scenarios(users, questions, pairs, deletable):
+    """Returns the requests to make for each route, as a mapping from scenario
+    name to a function which builds `(method, path, json, needs_token)` from a
+    random number generator. Single responses are read from the seeded
+    `pairs`, so that they exist. The delete scenarios take the IDs to remove
+    from the iterators in `deletable` (keyed by the kinds in
+    `DELETE_SCENARIOS`), which are filled in before they run.
+    """
+    def user(rng):
+        return rng.randint(1, users)
+
+    def question(rng):
+        return rng.randint(1, questions)
+
+    def response_body(rng):
+        return {'response': rng.choice((True, False, None))}
+
+    return {
+        'GET /questions': lambda rng: (
+            'GET', '/questions', None, True),
+        'GET /questions/<id>': lambda rng: (
+            'GET', f'/questions/{question(rng)}', None, True),
+        'GET /questions/active': lambda rng: (
+            'GET', '/questions/active', None, True),
+        'GET /questions/stats': lambda rng: (
+            'GET',
+            '/questions/stats?ids='
+            + ','.join(str(question(rng)) for _ in range(20)),
+            None, True),
+        'GET /questions/<id>/stats': lambda rng: (
+            'GET', f'/questions/{question(rng)}/stats', None, True),
+        'GET /questions/<id>/live': lambda rng: (
+            'GET', f'/questions/{question(rng)}/live', None, True),
+        'GET /questions/<id>/responses': lambda rng: (
+            'GET', f'/questions/{question(rng)}/responses', None, True),
+        'GET /questions/<id>/responses/<user_id>': lambda rng: (
+            'GET', '/questions/{1}/responses/{0}'.format(*rng.choice(pairs)),
+            None, True),
+        'GET /users': lambda rng: (
+            'GET', '/users', None, True),
+        'GET /users/<id>': lambda rng: (
+            'GET', f'/users/{user(rng)}', None, True),
+        'GET /users/me': lambda rng: (
+            'GET', '/users/me', None, True),
+        'GET /users/<id>/questions': lambda rng: (
+            'GET', f'/users/{user(rng)}/questions?unanswered=true',
+            None, True),
+        'GET /users/<id>/responses': lambda rng: (
+            'GET', f'/users/{user(rng)}/responses', None, True),
+        'GET /users/me/responses': lambda rng: (
+            'GET', '/users/me/responses', None, True),
+        'GET /users/<id>/responses/<question_id>': lambda rng: (
+            'GET', '/users/{0}/responses/{1}'.format(*rng.choice(pairs)),
+            None, True),
+        'GET /leaderboard': lambda rng: (
+            'GET', '/leaderboard', None, True),
+        'GET /responses/export': lambda rng: (
+            'GET', f'/responses/export?question_id={question(rng)}',
+            None, True),
+        'GET /teapot': lambda rng: (
+            'GET', '/teapot', None, True),
+        # Scraped by Prometheus, which doesn't have a token
+        'GET /metrics': lambda rng: (
+            'GET', '/metrics', None, False),
+        'PUT /users/<id>/responses/<question_id>': lambda rng: (
+            'PUT', f'/users/{user(rng)}/responses/{question(rng)}',
+            response_body(rng), True),
+        'PUT /users/me/responses/<question_id>': lambda rng: (
+            'PUT', f'/users/me/responses/{question(rng)}',
+            response_body(rng), True),
+        'POST /users/<id>/responses:batch': lambda rng: (
+            'POST', f'/users/{user(rng)}/responses:batch',
+            [
+                dict(response_body(rng), question_id=id)
+                for id in rng.sample(range(1, questions + 1), 10)
+            ],
+            True),
+        'PUT /questions/<id>': lambda rng: (
+            'PUT', f'/questions/{question(rng)}',
+            {'more_info_link': f'https://example.com/{rng.random()}'}, True),
+        'POST /questions': lambda rng: (
+            'POST', '/questions', {'prompt': "New question"}, True),
+        'POST /users': lambda rng: (
+            'POST', '/users',
+            {'subject_identifier': f'new-{rng.getrandbits(64)}'}, True),
+        'DELETE /users/<id>': lambda rng: (
+            'DELETE', f'/users/{next(deletable["users"])}', None, True),
+        'DELETE /questions/<id>': lambda rng: (
+            'DELETE', f'/questions/{next(deletable["questions"])}', None,
+            True),
+    }
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run_scenario(app, build, tokens, requests, thread_count, warmup):
+    latencies = []
+    sql_counts = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def send(client, rng):
+        method, path, body, needs_token = build(rng)
+        headers = {}
+        if needs_token:
+            headers['Authorization'] = f'Bearer {rng.choice(tokens)}'
+        start = time.perf_counter()
+        response = client.open(
+            path, method=method, json=body, headers=headers, buffered=False)
+        if response.mimetype == 'text/event-stream':
+            # Never ends, so only wait for the first event
+            for chunk in response.response:
+                if chunk.startswith(b'event:'):
+                    break
+        else:
+            # Streamed responses aren't finished until they're read
+            response.get_data()
+        response.close()
+        elapsed = time.perf_counter() - start
+        match = _sql_count_re.search(response.headers.get('Server-Timing', ''))
+        return elapsed, response.status_code, match
+
+    def worker(index, count):
+        rng = random.Random(index)
+        client = app.test_client()
+        for _ in range(count):
+            elapsed, status, match = send(client, rng)
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if match:
+                    sql_counts.append(int(match[1]))
+
+    # Fill caches and connection pools first
+    warmup_client = app.test_client()
+    warmup_rng = random.Random(-1)
+    for _ in range(warmup):
+        send(warmup_client, warmup_rng)
+
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(i, requests // thread_count
+                  + (i < requests % thread_count)))
+        for i in range(thread_count)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'statuses': statuses,
+        'requests_per_second': len(latencies) / elapsed,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+        'sql_per_request': statistics.mean(sql_counts) if sql_counts else None,
+    }
+
+
+def time_call(function, rounds=5, number=200):
+    """Median time of one call to `function`, in seconds.
+    """
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    return statistics.median(samples)
+
+
+def microbenchmarks(key):
+    from prophet.auth import verify_token
+    from prophet.models import Question
+    from prophet.schemas import questions_schema
+    from prophet.serializers import question_serializer
+
+    token = key.token('micro')
+    questions = Question.query.order_by(Question.id).limit(PAGE_SIZE).all()
+    rows = question_serializer.query().limit(PAGE_SIZE).all()
+    return {
+        'verify_token': time_call(lambda: verify_token(token)),
+        'questions_schema_dump_page': time_call(
+            lambda: questions_schema.dump(questions), number=20),
+        'question_serializer_dump_page': time_call(
+            lambda: question_serializer.dump(rows), number=20),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--database',
+        help="URI of an empty database to use instead of a temporary SQLite "
+             "file. It is left seeded afterwards.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--responses', type=int, default=10000)
+    parser.add_argument(
+        '--requests', type=int, default=1000,
+        help="Number of requests for each route")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--tokens', type=int, default=100,
+                        help="Number of different access tokens to use")
+    parser.add_argument(
+        '--only', help="Only run scenarios whose names contain this")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON to this file")
+    args = parser.parse_args()
+
+    if args.responses > args.users * args.questions:
+        parser.error("--responses can't be more than --users * --questions")
+    random.seed(args.seed)
+
+    # The authentication settings are read when `prophet` is imported, so it
+    # can only be imported after they point at the local JWKS server
+    key = SigningKey(KEY_ID, AUDIENCE, f'{ISSUER_BASE_URL}/{TENANT_ID}/')
+    os.environ.update({
+        'TENANT_ID': TENANT_ID,
+        'CLIENT_ID': 'bench-client',
+        'CLIENT_SECRET': '',
+        'API_AUDIENCE': AUDIENCE,
+        'AUTHORITY_BASE_URL': JwksServer([key]).url,
+        'ISSUER_BASE_URL': ISSUER_BASE_URL,
+    })
+    import prophet
+    from flask import request
+    from prophet import auth, db
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database or \
+            f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        app = prophet.create_app({'SQLALCHEMY_DATABASE_URI': database})
+
+        # Most routes don't require a token yet, so verify one when it's
+        # given, like `requires_auth()` would, which also lets "me" be used
+        @app.before_request
+        def sign_in():
+            if 'Authorization' in request.headers:
+                auth.requires_auth(lambda: None)()
+
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            pairs = seed(db, args.users, args.questions, args.responses)
+            rebuild_derived(app)
+            seed_seconds = time.perf_counter() - start
+            micro = microbenchmarks(key)
+            dialect = db.engine.dialect.name
+
+        tokens = [
+            key.token(f'user-{i}', [EXPORT_SCOPE]) for i in range(args.tokens)
+        ]
+        results = {}
+        deletable = {}
+        routes = scenarios(args.users, args.questions, pairs, deletable)
+        for name, build in routes.items():
+            if args.only and args.only not in name:
+                continue
+            kind = DELETE_SCENARIOS.get(name)
+            if kind is not None:
+                # Every request (including the warmup) removes another one
+                with app.app_context():
+                    deletable[kind] = iter(seed_deletable(
+                        app, db, kind, args.requests + args.warmup,
+                        args.users, args.questions))
+            results[name] = run_scenario(
+                app, build, tokens, args.requests, args.threads, args.warmup)
+            print(f"{name}: {results[name]['requests_per_second']:.0f}/s",
+                  file=sys.stderr)
+
+    output = json.dumps({
+        'commit': git_commit(),
+        'database': dialect,
+        'users': args.users,
+        'questions': args.questions,
+        'responses': args.responses,
+        'threads': args.threads,
+        'requests': args.requests,
+        'seed_seconds': seed_seconds,
+        'microbenchmarks': micro,
+        'scenarios': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Measures the overhead of the per-request instrumentation (`prophet.metrics`)
+by timing the same requests with it enabled and disabled.
+
+Run from the root of the project:
+```
+python bench/metrics_overhead.py [--requests N] [--rounds N]
+```
+Uses an in-memory database, so no environment variables are needed. Prints
+the results as JSON and exits with an error if the overhead is over the target.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prophet  # noqa: E402
+from prophet import db  # noqa: E402
+from prophet.models import Question, QuestionStats  # noqa: E402
+
+# Maximum increase of the median request time with instrumentation enabled
+OVERHEAD_TARGET = 0.05
+
+QUESTION_COUNT = 100
+
+PATHS = ('/questions', '/questions/1', '/questions/1/stats')
+
+
+def time_requests(client, path, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(path)
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=7)
+    args = parser.parse_args()
+
+    app = prophet.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        db.create_all()
+        for i in range(QUESTION_COUNT):
+            db.session.add(Question(prompt=f"Question {i}", stats=QuestionStats()))
+        db.session.commit()
+
+        client = app.test_client()
+        result = {}
+        for path in PATHS:
+            samples = {True: [], False: []}
+            # Warm up caches, then alternate so that drift affects both equally
+            time_requests(client, path, args.requests)
+            for _ in range(args.rounds):
+                for enabled in (False, True):
+                    app.config['METRICS_ENABLED'] = enabled
+                    samples[enabled].append(
+                        time_requests(client, path, args.requests))
+
+            disabled = statistics.median(samples[False])
+            enabled = statistics.median(samples[True])
+            result[path] = {
+                'disabled': disabled,
+                'enabled': enabled,
+                'overhead': enabled / disabled - 1,
+            }
+
+    overhead = statistics.median(r['overhead'] for r in result.values())
+    print(json.dumps({
+        'paths': result,
+        'overhead': overhead,
+        'target': OVERHEAD_TARGET,
+    }, indent=2))
+
+    if overhead > OVERHEAD_TARGET:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Compares the generated serializers with dumping ORM objects through the
+marshmallow schemas, for large lists of questions and responses.
+
+Run from the root of the project:
+```
+python bench/serializers.py [--sizes N,N,...] [--rounds N]
+```
+Seeds an in-memory SQLite database with that many questions and responses,
+and times loading and serializing all of them, both by hydrating the models
+and calling `schema.dump()` (like the code before the serializers did) and
+with `serializer.query()` and `serializer.dump()`. Checks that both produce
+the same output, and prints the median times as JSON.
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prophet  # noqa: E402
+from prophet import db  # noqa: E402
+from prophet.models import Question, Response, User  # noqa: E402
+from prophet.schemas import questions_schema, responses_schema  # noqa: E402
+from prophet.serializers import (  # noqa: E402
+    question_serializer, response_serializer)
+
+SUBJECTS = (
+    ('questions', Question, questions_schema, question_serializer),
+    ('responses', Response, responses_schema, response_serializer),
+)
+
+
+def seed(size):
+    """Adds `size` questions, and `size` responses spread over enough users
+    to answer each question at most once.
+    """
+    now = datetime.datetime(2020, 1, 1)
+    db.session.execute(Question.__table__.insert(), [
+        {
+            'prompt': f"Question {i}",
+            'correct_answer': i % 2 == 0,
+            'more_info_link': f'https://example.com/{i}',
+            'available_at': now,
+            'expires_at': now + datetime.timedelta(days=i % 30),
+        }
+        for i in range(size)
+    ])
+    users = -(-size // 1000)
+    db.session.execute(User.__table__.insert(), [
+        {'subject_identifier': f'user-{i}'} for i in range(users)
+    ])
+    db.session.execute(Response.__table__.insert(), [
+        {
+            'user_id': i % users + 1,
+            'question_id': i // users + 1,
+            'response': (True, False, None)[i % 3],
+            'view_time': datetime.time(0, 0, i % 60, i % 1000 * 1000),
+            'answered_at': now + datetime.timedelta(seconds=i),
+        }
+        for i in range(size)
+    ])
+    db.session.commit()
+
+
+def median_time(function, rounds):
+    samples = []
+    for _ in range(rounds):
+        # Don't let objects from the last round be reused
+        db.session.expunge_all()
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default='10000,100000',
+        help="Comma-separated numbers of rows to serialize")
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    result = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        app = prophet.create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'METRICS_ENABLED': False,
+        })
+        with app.app_context():
+            db.create_all()
+            seed(size)
+
+            entry = {'rows': size}
+            for name, model, schema, serializer in SUBJECTS:
+                def marshmallow():
+                    return schema.dump(model.query.all())
+
+                def generated():
+                    return serializer.dump(serializer.query().all())
+
+                assert marshmallow() == generated()
+                entry[name] = {
+                    'marshmallow_seconds': median_time(
+                        marshmallow, args.rounds),
+                    'serializer_seconds': median_time(generated, args.rounds),
+                }
+                entry[name]['speedup'] = \
+                    entry[name]['marshmallow_seconds'] \
+                    / entry[name]['serializer_seconds']
+            result.append(entry)
+
+            db.session.remove()
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Measures how long it takes to import the package and create the application
+in a fresh interpreter, like a server worker would.
+
+Run from the root of the project with the same environment variables as the
+server:
+```
+python bench/startup.py [--runs N]
+```
+Prints the results as JSON and exits with an error if the median is over the
+targets.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Targets for the median times, in seconds. Import time is almost entirely
+# spent importing libraries; creating the application should do close to no
+# work.
+IMPORT_TARGET = 1.5
+CREATE_APP_TARGET = 0.05
+
+# The interpreters run in the root of the project, so that it's on the path
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = '''
+import json, time
+start = time.perf_counter()
+import prophet
+imported = time.perf_counter()
+prophet.create_app()
+created = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, '-c', MEASURE], cwd=ROOT,
+            check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output))
+
+    result = {
+        name: {
+            'median': statistics.median(s[name] for s in samples),
+            'max': max(s[name] for s in samples),
+            'target': target,
+        }
+        for name, target in (
+            ('import', IMPORT_TARGET),
+            ('create_app', CREATE_APP_TARGET),
+        )
+    }
+    print(json.dumps(result, indent=2))
+
+    if any(r['median'] > r['target'] for r in result.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Measures the unanswered questions feed
+(`/users/<id>/questions?unanswered=true`) as the response table grows, to check
+that its time stays flat.
+
+Run from the root of the project:
+```
+python bench/unanswered.py [--users N] [--questions N] [--steps N,N,...]
+```
+Seeds a temporary SQLite database with the users and questions, then adds
+random responses until the table reaches each of the step sizes and times the
+first page of the feed for a sample of users at each one. Prints the results
+as JSON and exits with an error if the slowest step is more than the allowed
+factor slower than the first one.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prophet  # noqa: E402
+from prophet import db  # noqa: E402
+from prophet.models import Question, Response, User  # noqa: E402
+
+# Maximum ratio between the median times of the slowest and the first step
+FLATNESS_TARGET = 1.5
+
+SAMPLE_USERS = 50
+INSERT_CHUNK_SIZE = 10000
+
+
+def seed_responses(user_count, question_ids, count):
+    """Adds `count` random responses, skipping ones which already exist.
+    """
+    now = datetime.utcnow()
+    table = Response.__table__
+    added = 0
+    while added < count:
+        chunk = {
+            (random.randint(1, user_count), random.choice(question_ids))
+            for _ in range(min(INSERT_CHUNK_SIZE, count - added))
+        }
+        result = db.session.execute(
+            table.insert().prefix_with('OR IGNORE'),
+            [
+                {
+                    'user_id': user_id,
+                    'question_id': question_id,
+                    'response': True,
+                    'answered_at': now,
+                    'updated_at': now,
+                }
+                for user_id, question_id in chunk
+            ])
+        added += result.rowcount
+        db.session.commit()
+
+
+def time_feed(client, user_ids, rounds):
+    samples = []
+    for _ in range(rounds):
+        for user_id in user_ids:
+            start = time.perf_counter()
+            response = client.get(
+                f'/users/{user_id}/questions?unanswered=true')
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.json
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--questions', type=int, default=1000)
+    parser.add_argument(
+        '--steps', default='0,100000,1000000,5000000',
+        help="Comma-separated response counts to measure at")
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    steps = [int(s) for s in args.steps.split(',')]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        app = prophet.create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+            'METRICS_ENABLED': False,
+        })
+        with app.app_context():
+            db.create_all()
+            available_at = datetime.utcnow() - timedelta(days=1)
+            db.session.execute(User.__table__.insert(), [
+                {'subject_identifier': f'user-{i}'}
+                for i in range(args.users)
+            ])
+            db.session.execute(Question.__table__.insert(), [
+                {'prompt': f"Question {i}", 'available_at': available_at}
+                for i in range(args.questions)
+            ])
+            db.session.commit()
+            question_ids = [id for id, in db.session.query(Question.id)]
+
+            client = app.test_client()
+            user_ids = random.sample(
+                range(1, args.users + 1), min(SAMPLE_USERS, args.users))
+            result = []
+            count = 0
+            for step in steps:
+                seed_responses(args.users, question_ids, step - count)
+                count = step
+                db.session.execute('ANALYZE')
+                result.append({
+                    'responses': count,
+                    'median': time_feed(client, user_ids, args.rounds),
+                })
+
+    slowdown = max(r['median'] for r in result) / result[0]['median']
+    print(json.dumps({
+        'users': args.users,
+        'questions': args.questions,
+        'steps': result,
+        'slowdown': slowdown,
+        'target': FLATNESS_TARGET,
+    }, indent=2))
+
+    if slowdown > FLATNESS_TARGET:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Compares the cost of authenticating a request with a token seen for the
+first time (cold) and with one which was already verified (warm).
+
+Run from the root of the project:
+```
+python bench/verify.py [--number N] [--rounds N]
+```
+Tokens are signed with a locally generated key, which is put straight into the
+key cache, so no environment variables or network access are needed. Times
+the authentication of a new token (`verify_token()`, which checks the RS256
+signature with the cached key object), a repeated token (a hit in the
+verified token cache) and, for reference, `jwt.decode()` with the JWK dict,
+which builds the key object on every call like the code before the caches
+did. Also times a whole `requires_auth()` call with a request context for
+each of the first two. Prints the median time per token as JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from jose import jwk, jwt
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.keys import SigningKey  # noqa: E402
+
+TENANT_ID = 'bench-tenant'
+AUDIENCE = 'api://bench'
+ISSUER_BASE_URL = 'https://issuer.invalid'
+KEY_ID = 'bench-key'
+
+
+def median_time(function, tokens, rounds):
+    """Median time of one call to `function` over `rounds` passes over
+    `tokens`, in seconds.
+    """
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for token in tokens:
+            function(token)
+        samples.append((time.perf_counter() - start) / len(tokens))
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--number', type=int, default=200, help="Tokens per round")
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    # The authentication settings are read when `prophet` is imported
+    os.environ.update({
+        'TENANT_ID': TENANT_ID,
+        'API_AUDIENCE': AUDIENCE,
+        'ISSUER_BASE_URL': ISSUER_BASE_URL,
+    })
+    import prophet
+    from prophet import auth
+
+    key = SigningKey(KEY_ID, AUDIENCE, f'{ISSUER_BASE_URL}/{TENANT_ID}/')
+    public = key.public_jwk()
+    auth.jwks_cache.keys = {KEY_ID: jwk.construct(public, 'RS256')}
+    auth.jwks_cache.expires_at = float('inf')
+
+    app = prophet.create_app({'METRICS_ENABLED': False})
+    view = auth.requires_auth(lambda: None)
+
+    def request(token):
+        with app.test_request_context(
+                headers={'Authorization': f'Bearer {token}'}):
+            view()
+
+    def cold_request(token):
+        auth.token_cache.clear()
+        request(token)
+
+    def rebuilt_key(token):
+        jwt.decode(
+            token, {'keys': [public]}, algorithms=auth.ALGORITHMS,
+            audience=auth.API_AUDIENCE, issuer=auth.ISSUER)
+
+    tokens = [key.token(f'user-{i}') for i in range(args.number)]
+    # Every token is already cached for the warm requests
+    for token in tokens:
+        request(token)
+
+    result = {
+        'cold': median_time(auth.verify_token, tokens, args.rounds),
+        'warm': median_time(auth.token_cache.get, tokens, args.rounds),
+        'rebuilt_key': median_time(rebuilt_key, tokens, args.rounds),
+        'cold_request': median_time(cold_request, tokens, args.rounds),
+        'warm_request': median_time(request, tokens, args.rounds),
+    }
+    result['cold_to_warm'] = result['cold'] / result['warm']
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Compares response submission latency with and without the write-behind
+queue (`RESPONSE_WRITE_BEHIND`) during a burst of answers to one question.
+
+Run from the root of the project:
+```
+python bench/write_behind.py [--users N] [--threads N]
+```
+Uses a temporary SQLite database, like a single server would. Each mode gets
+a fresh database where every user answers the same question once, spread over
+the threads. Prints throughput and latency percentiles for both modes as JSON
+and checks that every response was saved.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Run as a script, so the root of the project isn't on the path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prophet  # noqa: E402
+from prophet import db  # noqa: E402
+from prophet.models import (  # noqa: E402
+    Question, QuestionStats, Response, User)
+from prophet.resources.response import response_queue  # noqa: E402
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(write_behind, users, thread_count):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        app = prophet.create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+            'METRICS_ENABLED': False,
+            'RESPONSE_WRITE_BEHIND': write_behind,
+        })
+        with app.app_context():
+            db.create_all()
+            db.session.execute(User.__table__.insert(), [
+                {'subject_identifier': f'user-{i}'} for i in range(users)
+            ])
+            db.session.add(Question(prompt="Live", stats=QuestionStats()))
+            db.session.commit()
+
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+
+        def submit(user_ids):
+            client = app.test_client()
+            for user_id in user_ids:
+                start = time.perf_counter()
+                response = client.put(
+                    f'/users/{user_id}/responses/1', json={'response': True})
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[response.status_code] = \
+                        statuses.get(response.status_code, 0) + 1
+
+        threads = [
+            threading.Thread(
+                target=submit,
+                args=(range(1 + i, users + 1, thread_count),))
+            for i in range(thread_count)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        accepted = time.perf_counter() - start
+
+        # Wait for the queue to be written out
+        while response_queue.stats()['pending']:
+            time.sleep(0.01)
+        saved = time.perf_counter() - start
+
+        with app.app_context():
+            count = db.session.query(Response).count()
+            stats = QuestionStats.query.get(1)
+            true_count = stats.true_count
+
+    return {
+        'statuses': statuses,
+        'accepted_seconds': accepted,
+        'saved_seconds': saved,
+        'requests_per_second': users / accepted,
+        'latency_p50': statistics.median(latencies),
+        'latency_p99': percentile(latencies, 0.99),
+        'latency_max': max(latencies),
+        'saved_responses': count,
+        'tally': true_count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    result = {
+        'synchronous': run(False, args.users, args.threads),
+        'write_behind': run(True, args.users, args.threads),
+    }
+    print(json.dumps(result, indent=2))
+
+    for mode in result.values():
+        if mode['saved_responses'] != mode['statuses'].get(200, 0) + \
+                mode['statuses'].get(202, 0) or \
+                mode['tally'] != mode['saved_responses']:
+            raise SystemExit("Saved responses don't match the accepted ones")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Initial schema
+
+Revision ID: 3f1c2a9d8e47
+Revises:
+Create Date: 2026-10-18 09:12:41.503127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8e47'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('question',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('prompt', sa.Text(), nullable=False),
+    sa.Column('more_info_link', sa.Text(), nullable=True),
+    sa.Column('correct_answer', sa.Boolean(), nullable=True),
+    sa.Column('available_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subject_identifier', sa.String(length=44), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('response',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('question_id', sa.Integer(), nullable=False),
+    sa.Column('response', sa.Boolean(), nullable=True),
+    sa.Column('view_time', sa.Time(), nullable=True),
+    sa.Column('answered_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'question_id')
+    )
+
+
+def downgrade():
+    op.drop_table('response')
+    op.drop_table('user')
+    op.drop_table('question')
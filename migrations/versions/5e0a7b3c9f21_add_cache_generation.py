@@ -0,0 +1,29 @@
+"""Add cache generation counters
+
+Revision ID: 5e0a7b3c9f21
+Revises: c7d2e91a4b60
+Create Date: 2026-10-18 11:40:12.662093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0a7b3c9f21'
+down_revision = 'c7d2e91a4b60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    cache_generation = op.create_table('cache_generation',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('value', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(cache_generation, [{'name': 'question', 'value': 0}])
+
+
+def downgrade():
+    op.drop_table('cache_generation')
@@ -0,0 +1,29 @@
+"""Add indexes for lookup paths
+
+Revision ID: 8b4e6d0f2c15
+Revises: 3f1c2a9d8e47
+Create Date: 2026-10-18 09:20:05.118264
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d0f2c15'
+down_revision = '3f1c2a9d8e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # This will fail if duplicate users were already created; they have to be
+    # merged by hand first
+    op.create_index(op.f('ix_user_subject_identifier'), 'user', ['subject_identifier'], unique=True)
+    op.create_index('ix_question_available_at_expires_at', 'question', ['available_at', 'expires_at'], unique=False)
+    op.create_index('ix_response_question_id_answered_at', 'response', ['question_id', 'answered_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_response_question_id_answered_at', table_name='response')
+    op.drop_index('ix_question_available_at_expires_at', table_name='question')
+    op.drop_index(op.f('ix_user_subject_identifier'), table_name='user')
@@ -0,0 +1,37 @@
+"""Add version stamps for ETags
+
+Revision ID: a91f4c6e2d38
+Revises: 5e0a7b3c9f21
+Create Date: 2026-10-18 12:31:54.207719
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91f4c6e2d38'
+down_revision = '5e0a7b3c9f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('question', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+    # SQLite can't add a column with a non-constant default, so add it as
+    # nullable, fill it in, and then change it (which recreates the table on
+    # SQLite)
+    op.add_column('response', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute('UPDATE response SET updated_at = answered_at')
+    with op.batch_alter_table('response') as batch_op:
+        batch_op.alter_column('updated_at',
+               existing_type=sa.DateTime(),
+               nullable=False,
+               server_default=sa.text('(CURRENT_TIMESTAMP)'))
+
+
+def downgrade():
+    with op.batch_alter_table('response') as batch_op:
+        batch_op.drop_column('updated_at')
+    op.drop_column('question', 'version')
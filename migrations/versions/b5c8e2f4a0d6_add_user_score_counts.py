@@ -0,0 +1,31 @@
+"""Add user score counts
+
+Revision ID: b5c8e2f4a0d6
+Revises: f3b7c52e0d19
+Create Date: 2026-10-18 18:04:37.215690
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5c8e2f4a0d6'
+down_revision = 'f3b7c52e0d19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_score_count',
+    sa.Column('correct_count', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_count', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('correct_count')
+    )
+    op.execute(
+        'INSERT INTO user_score_count (correct_count, user_count) '
+        'SELECT correct_count, COUNT(*) FROM user_score GROUP BY correct_count')
+
+
+def downgrade():
+    op.drop_table('user_score_count')
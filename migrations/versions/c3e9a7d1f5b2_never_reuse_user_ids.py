@@ -0,0 +1,42 @@
+"""Never reuse user IDs
+
+Revision ID: c3e9a7d1f5b2
+Revises: b5c8e2f4a0d6
+Create Date: 2026-10-18 19:42:13.508214
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e9a7d1f5b2'
+down_revision = 'b5c8e2f4a0d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Other databases never reuse generated IDs. SQLite only stops reusing
+    # them with AUTOINCREMENT, which can only be added by recreating the table
+    # (with foreign keys off, since other tables refer to it).
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('PRAGMA foreign_keys = OFF')
+    with op.batch_alter_table(
+            'user', recreate='always',
+            table_kwargs={'sqlite_autoincrement': True}):
+        pass
+    op.execute('PRAGMA foreign_keys = ON')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('PRAGMA foreign_keys = OFF')
+    with op.batch_alter_table(
+            'user', recreate='always',
+            table_kwargs={'sqlite_autoincrement': False}):
+        pass
+    op.execute('PRAGMA foreign_keys = ON')
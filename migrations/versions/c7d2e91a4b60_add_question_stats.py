@@ -0,0 +1,35 @@
+"""Add question answer tallies
+
+Revision ID: c7d2e91a4b60
+Revises: 8b4e6d0f2c15
+Create Date: 2026-10-18 10:02:37.840512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2e91a4b60'
+down_revision = '8b4e6d0f2c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Run `flask rebuild-stats` afterwards to fill in the tallies for existing
+    # questions
+    op.create_table('question_stats',
+    sa.Column('question_id', sa.Integer(), nullable=False),
+    sa.Column('true_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('false_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('skip_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('view_time_total', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('view_time_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+    sa.PrimaryKeyConstraint('question_id')
+    )
+
+
+def downgrade():
+    op.drop_table('question_stats')
@@ -0,0 +1,23 @@
+"""Add index for responses in question order
+
+Revision ID: d24b8f5a1e73
+Revises: a91f4c6e2d38
+Create Date: 2026-10-18 13:15:08.934410
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd24b8f5a1e73'
+down_revision = 'a91f4c6e2d38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_response_question_id_user_id', 'response', ['question_id', 'user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_response_question_id_user_id', table_name='response')
@@ -0,0 +1,23 @@
+"""Add index for question expiration times
+
+Revision ID: e6a3d9c1b845
+Revises: d24b8f5a1e73
+Create Date: 2026-10-18 14:02:41.517208
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a3d9c1b845'
+down_revision = 'd24b8f5a1e73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_question_expires_at', 'question', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_question_expires_at', table_name='question')
@@ -0,0 +1,34 @@
+"""Add user scores
+
+Revision ID: f3b7c52e0d19
+Revises: e6a3d9c1b845
+Create Date: 2026-10-18 15:21:09.402716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b7c52e0d19'
+down_revision = 'e6a3d9c1b845'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Run `flask rebuild-scores` afterwards to fill in the scores for existing
+    # users
+    op.create_table('user_score',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('correct_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('answered_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_user_score_correct_count_user_id', 'user_score', [sa.text('correct_count DESC'), 'user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_score_correct_count_user_id', table_name='user_score')
+    op.drop_table('user_score')
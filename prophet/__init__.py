@@ -1,22 +1,41 @@
+import json
 import os
+import sqlite3
 from http import HTTPStatus
 
-import msal
-
-from flask import Flask
+from flask import Blueprint, Flask
 from flask_cors import cross_origin
-from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
+from flask_migrate import Migrate
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from werkzeug.exceptions import HTTPException, NotFound
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_DATABASE_URI'] = \
-    os.environ.get('DATABASE_URI').format(instance_path=app.instance_path)
+from prophet.routing import RoutingSQLAlchemy
+
+# Extensions are bound to an application in `create_app()`
+db = RoutingSQLAlchemy()
+ma = Marshmallow()
+migrate = Migrate()
+
+# All of the routes, error handlers and commands are registered on this so that
+# they can be added to any application made by `create_app()`. CLI commands are
+# added at the top level (`flask rebuild-stats`, not `flask api ...`).
+api = Blueprint('api', __name__, cli_group=None)
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite doesn't enforce foreign keys unless they're turned on for each
+    connection.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
-db = SQLAlchemy(app)
-ma = Marshmallow(app)
 
 cross_origin_auth = cross_origin(headers=('Content-Type', 'Authorization'))
 
@@ -31,10 +50,10 @@ def class_route(rule, name=None, *class_args, **class_kwargs):
         #
         # if name is None:
         #     name = cls.__name__.lower()
-        # app.add_url_rule(
+        # api.add_url_rule(
         #     rule, view_func=cls.as_view(name, *class_args, **class_kwargs))
 
-        app.add_url_rule(
+        api.add_url_rule(
             rule,
             view_func=cls.as_view(
                 name if name else cls.__name__.lower(),
@@ -44,21 +63,81 @@ def class_route(rule, name=None, *class_args, **class_kwargs):
 
     return decorator
 
-# These have to be imported after `app`, `db`, etc. are defined so that
+
+def create_app(config=None):
+    """Creates and configures an instance of the application.
+
+    `config` is a mapping of settings which override the defaults and the
+    environment. Nothing here touches the network or the database: the
+    database schema is managed with migrations (see `migrations/`) and has to
+    be brought up to date with `flask db upgrade`, and the authentication
+    client and signing keys are loaded on first use.
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    database_uri = os.environ.get('DATABASE_URI')
+    if database_uri is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = \
+            database_uri.format(instance_path=app.instance_path)
+
+    # Read replicas (see `routing.py`), separated by whitespace
+    replica_uris = os.environ.get('DATABASE_REPLICA_URIS', '').split()
+    if replica_uris:
+        binds = {
+            f'replica{i}': uri.format(instance_path=app.instance_path)
+            for i, uri in enumerate(replica_uris, 1)
+        }
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.config['DATABASE_REPLICAS'] = list(binds)
+
+    stickiness = os.environ.get('DATABASE_STICKINESS')
+    if stickiness is not None:
+        app.config['DATABASE_STICKINESS'] = float(stickiness)
+
+    # Any of "1", "true", "yes" or "on" turns it on (see `writebehind.py`)
+    write_behind = os.environ.get('RESPONSE_WRITE_BEHIND')
+    if write_behind is not None:
+        app.config['RESPONSE_WRITE_BEHIND'] = \
+            write_behind.strip().lower() in ('1', 'true', 'yes', 'on')
+
+    # Engine options as JSON, such as '{"pool_size": 10, "pool_pre_ping": true}'
+    bind_options = {}
+    primary_options = os.environ.get('DATABASE_ENGINE_OPTIONS')
+    if primary_options is not None:
+        bind_options[None] = json.loads(primary_options)
+    replica_options = os.environ.get('DATABASE_REPLICA_ENGINE_OPTIONS')
+    if replica_options is not None:
+        for bind in app.config.get('DATABASE_REPLICAS', []):
+            bind_options[bind] = json.loads(replica_options)
+    app.config['SQLALCHEMY_BIND_ENGINE_OPTIONS'] = bind_options
+
+    if config is not None:
+        app.config.from_mapping(config)
+
+    db.init_app(app)
+    ma.init_app(app)
+    migrate.init_app(app, db)
+    app.register_blueprint(api)
+
+    return app
+
+# These have to be imported after `api`, `db`, etc. are defined so that
 # the circular imports resolve properly (this is the reccommended way to
-# organize the project according to the Flask documentation)
+# organize the project according to the Flask documentation). They are
+# imported here rather than in `create_app()` so that a server which loads the
+# application before forking workers only does this once.
 
+import prophet.metrics
+import prophet.compression
 from prophet.auth import requires_auth
 from prophet.models import User, Question, Response
 import prophet.resources
 
-# TODO Only run this in debug mode / when using a local database?
-db.create_all()
-
 
 # Set up generic error handlers
 
-@app.errorhandler(NotFound)
+@api.app_errorhandler(NotFound)
 def handle_not_found(e):
     return {
         'error': {
@@ -68,7 +147,7 @@ def handle_not_found(e):
     }, HTTPStatus.NOT_FOUND
 
 
-@app.errorhandler(HTTPException)
+@api.app_errorhandler(HTTPException)
 def handle_http_exception(e):
     """Handler for un-recognized errors.
     """
@@ -80,7 +159,7 @@ def handle_http_exception(e):
     }, HTTPStatus.INTERNAL_SERVER_ERROR
 
 
-@app.route('/teapot')
+@api.route('/teapot')
 @cross_origin_auth
 @requires_auth
 def im_a_teapot():
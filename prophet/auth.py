@@ -1,15 +1,22 @@
+import hashlib
+import logging
 import os
+import re
+import threading
+import time
 
-from functools import wraps
+from collections import OrderedDict
+from functools import lru_cache, wraps
 from http import HTTPStatus
 
-import msal
 import requests
 
-from jose import jwt
+from jose import jwk, jwt
+from jose.utils import base64url_decode
 from flask import g, request
 
-from prophet import app
+from prophet import api
+from prophet.metrics import registry, timed
 
 TENANT_ID = os.environ.get('TENANT_ID')
 CLIENT_ID = os.environ.get('CLIENT_ID')
@@ -23,8 +30,31 @@ ISSUER = f'{ISSUER_BASE_URL}/{TENANT_ID}/'
 
 ALGORITHMS = ('RS256',)
 
-msal_app = msal.ConfidentialClientApplication(
-    CLIENT_ID, CLIENT_SECRET, AUTHORITY)
+JWKS_URL = f'{AUTHORITY}/discovery/v2.0/keys'
+# Used if the key list response doesn't say how long it can be cached for
+JWKS_DEFAULT_MAX_AGE = int(os.environ.get('JWKS_DEFAULT_MAX_AGE', 3600))
+# Minimum time between refreshes caused by unknown key IDs, so that tokens with
+# made up `kid`s can't make every request go out to the authority server
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 60))
+JWKS_FETCH_TIMEOUT = 10
+
+# Maximum number of already verified tokens to remember
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 4096))
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_msal_app():
+    """Gets the MSAL client, creating it on first use since creating it may
+    make requests to the authority server.
+    """
+    # Imported here since it's slow to import and rarely needed
+    import msal
+
+    return msal.ConfidentialClientApplication(
+        CLIENT_ID, CLIENT_SECRET, AUTHORITY)
 
 
 class AuthError(Exception):
@@ -33,7 +63,7 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
-@app.errorhandler(AuthError)
+@api.app_errorhandler(AuthError)
 def handle_auth_error(e):
     return {
         'error': {
@@ -43,6 +73,214 @@ def handle_auth_error(e):
     }, e.status_code
 
 
+_max_age_re = re.compile(r'max-age=(\d+)')
+
+
+class JwksCache:
+    """Process-wide cache of the RSA signing keys from the authority server.
+
+    Keys are stored as key objects ready for verifying signatures, so they are
+    only built once per key ID. They are kept for as long as the `max-age` in
+    the response's Cache-Control header allows. Once they expire, the old keys
+    are still used while a background thread fetches the new list. A token with
+    a key ID that isn't in the cached list (which happens while keys are being
+    rotated) forces one immediate refresh, at most once every
+    `min_refresh_interval` seconds whether or not the last fetch succeeded, so
+    that made up key IDs can't make requests wait on an authority server which
+    is down. Concurrent fetches are collapsed into a single request.
+
+    The `hits`, `misses` and `refreshes` counters are only for monitoring and
+    aren't updated under a lock, so they may be slightly off under load.
+    """
+
+    def __init__(self, url, default_max_age=JWKS_DEFAULT_MAX_AGE,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+
+        # Mapping from key ID to the key object, or None if never fetched
+        self.keys = None
+        self.fetched_at = 0.0
+        self.expires_at = 0.0
+        # Time the last fetch finished, even if it failed
+        self.attempted_at = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+        # Held for the duration of a fetch
+        self._fetch_lock = threading.Lock()
+        # Protects `_refreshing`
+        self._state_lock = threading.Lock()
+        self._refreshing = False
+
+    def get_key(self, kid):
+        """Returns the key with the given key ID, or None if there isn't one.
+        """
+        # Read before the keys, which are set first
+        attempted_at = self.attempted_at
+        keys = self.keys
+        if keys is None:
+            self.misses += 1
+            keys = self._refresh(attempted_at)
+        elif kid not in keys:
+            self.misses += 1
+            if time.monotonic() - attempted_at >= self.min_refresh_interval:
+                keys = self._refresh(attempted_at)
+        else:
+            self.hits += 1
+            if time.monotonic() >= self.expires_at:
+                self._refresh_in_background()
+
+        return keys.get(kid)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+        }
+
+    def clear(self):
+        with self._fetch_lock:
+            self.keys = None
+            self.fetched_at = 0.0
+            self.expires_at = 0.0
+            self.attempted_at = 0.0
+
+    def _refresh(self, seen_attempted_at):
+        """Fetches the key list unless another thread already tried to since
+        `seen_attempted_at` was read, and returns the current keys.
+        """
+        with self._fetch_lock:
+            if self.attempted_at != seen_attempted_at:
+                # Someone else tried while this thread was waiting, so don't
+                # wait on the authority server again if that failed
+                if self.keys is None:
+                    raise AuthError(
+                        "Could not fetch token signing keys",
+                        HTTPStatus.SERVICE_UNAVAILABLE)
+                return self.keys
+
+            try:
+                resp = requests.get(self.url, timeout=JWKS_FETCH_TIMEOUT)
+                resp.raise_for_status()
+                jwks = resp.json()
+                # Copy over needed parts
+                keys = {
+                    key['kid']: jwk.construct(
+                        {k: key[k] for k in ('kty', 'kid', 'use', 'n', 'e')},
+                        ALGORITHMS[0])
+                    for key in jwks['keys']
+                }
+            except (requests.RequestException, ValueError, KeyError,
+                    jwk.JWKError) as e:
+                self.attempted_at = time.monotonic()
+                if self.keys is None:
+                    raise AuthError(
+                        "Could not fetch token signing keys",
+                        HTTPStatus.SERVICE_UNAVAILABLE) from e
+
+                # Keep using the old keys, but don't try again right away
+                logger.warning("Failed to refresh signing keys: %s", e)
+                self.expires_at = self.attempted_at + self.min_refresh_interval
+                return self.keys
+
+            match = _max_age_re.search(resp.headers.get('Cache-Control', ''))
+            max_age = int(match[1]) if match else self.default_max_age
+
+            now = time.monotonic()
+            self.keys = keys
+            self.fetched_at = now
+            self.expires_at = now + max_age
+            self.attempted_at = now
+            self.refreshes += 1
+            return keys
+
+    def _refresh_in_background(self):
+        with self._state_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        thread = threading.Thread(
+            target=self._background_refresh,
+            args=(self.attempted_at,),
+            daemon=True)
+        thread.start()
+
+    def _background_refresh(self, seen_attempted_at):
+        try:
+            self._refresh(seen_attempted_at)
+        finally:
+            with self._state_lock:
+                self._refreshing = False
+
+
+jwks_cache = JwksCache(JWKS_URL)
+registry.register_cache('jwks', jwks_cache)
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of access tokens which have already been verified.
+
+    Clients send the same token many times over its lifetime, so this lets
+    repeat requests skip the signature check. Entries are keyed by a hash of
+    the token so the tokens themselves aren't kept in memory, and are dropped
+    once the token's `exp` claim has passed.
+    """
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        # Mapping from token hash to (payload, expiration time)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        """Returns the verified payload of the token, or None if it isn't
+        cached or has expired.
+        """
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            payload, exp = entry
+            if exp <= time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return payload
+
+    def put(self, token, payload):
+        exp = payload.get('exp')
+        # Tokens without an expiration can't be safely cached
+        if exp is None or self.max_size <= 0:
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = VerifiedTokenCache()
+
+
 def get_token_auth_header():
     """Extract the auth token from the HTTP Authorization header.
     """
@@ -60,53 +298,62 @@ def get_token_auth_header():
     return token
 
 
+def verify_token(token):
+    """Verifies the signature and claims of an access token and returns its
+    payload.
+    """
+    unverified_header = jwt.get_unverified_header(token)
+    if unverified_header['alg'] not in ALGORITHMS:
+        raise AuthError(
+            f"{unverified_header['alg']} algorithm not suppored")
+
+    # Look for a matching RSA key in the keys from the AUTHORITY server
+    rsa_key = jwks_cache.get_key(unverified_header.get('kid'))
+    if rsa_key is None:
+        raise AuthError("Token key not found")
+
+    try:
+        # The signature is checked against the cached key object directly
+        # since `jwt.decode` would rebuild the key from a JWK dict every time
+        message, _, signature = token.rpartition('.')
+        if not rsa_key.verify(
+                message.encode(), base64url_decode(signature.encode())):
+            raise AuthError("Signature verification failed")
+
+        return jwt.decode(
+            token,
+            None,
+            algorithms=ALGORITHMS,
+            options={'verify_signature': False},
+            audience=API_AUDIENCE,
+            issuer=ISSUER)
+    except AuthError:
+        raise
+    except jwt.ExpiredSignatureError:
+        raise AuthError("JWT token expired")
+    except jwt.JWTClaimsError as e:
+        raise AuthError(str(e))
+    except Exception as e:
+        raise AuthError(str(e))
+
+
 def requires_auth(f):
     """Decorator for making a route require an access token.
     """
 
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = get_token_auth_header()
-        # Fetch a list of valid RSA keys from the AUTHORITY server
-        # TODO Cache this list (Cache-Control header on it is
-        # "private, max-age=86400")
-        jwks_resp = requests.get(f'{AUTHORITY}/discovery/v2.0/keys')
-        jwks = jwks_resp.json()
-
-        unverified_header = jwt.get_unverified_header(token)
-        if unverified_header['alg'] not in ALGORITHMS:
-            raise AuthError(
-                f"{unverified_header['alg']} algorithm not suppored")
-
-        # Look for a matching RSA key in the keys from the AUTHORITY server
-        rsa_key = None
-        for key in jwks['keys']:
-            if key['kid'] == unverified_header['kid']:
-                # Copy over needed parts
-                # TODO Can/should a full copy be made?
-                rsa_key = {k: key[k] for k in ('kty', 'kid', 'use', 'n', 'e')}
-                break
+        with timed('auth'):
+            token = get_token_auth_header()
 
-        if rsa_key:
-            try:
-                payload = jwt.decode(
-                    token,
-                    rsa_key,
-                    algorithms=ALGORITHMS,
-                    audience=API_AUDIENCE,
-                    issuer=ISSUER)
-            except jwt.ExpiredSignatureError:
-                raise AuthError("JWT token expired")
-            except jwt.JWTClaimsError as e:
-                raise AuthError(str(e))
-            except Exception as e:
-                raise AuthError(str(e))
-
-            g.user_access_token = token
-            g.current_user = payload
-            return f(*args, **kwargs)
-        else:
-            raise AuthError("Token key not found")
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_token(token)
+                token_cache.put(token, payload)
+
+        g.user_access_token = token
+        g.current_user = payload
+        return f(*args, **kwargs)
 
     return decorated
 
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+from prophet import db
+from prophet.metrics import registry
+from prophet.models import CacheGeneration
+
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', 10000))
+# Seconds before an entry has to be loaded again even if it wasn't invalidated
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))
+# Seconds between checks for invalidations made by other workers
+CACHE_GENERATION_CHECK_INTERVAL = float(
+    os.environ.get('CACHE_GENERATION_CHECK_INTERVAL', 1))
+
+
+class Cache:
+    """Interface for cache backends.
+
+    Values must be treated as immutable by callers since backends may hand out
+    the same object to every request. A backend shared between workers (such as
+    Redis) can implement this interface as well, in which case values have to
+    be serialized by the backend.
+    """
+
+    def get(self, key):
+        """Returns the cached value, or None if it isn't cached.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Caches a value. `ttl` overrides the default time to live in seconds.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns a dict of metrics about the cache.
+        """
+        raise NotImplementedError
+
+
+class LocalCache(Cache):
+    """In-process LRU cache where entries also expire after a time to live.
+    """
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Mapping from key to (value, expiration time)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class GenerationCounter:
+    """Counter shared by all workers through the database, which is included
+    in cache keys so that an invalidation in one worker reaches the others.
+
+    Bumping the counter makes every key built with the old value unreachable.
+    To avoid a database query on every cache lookup, the counter is only
+    re-read every `check_interval` seconds, so other workers may serve stale
+    entries for up to that long after a change.
+    """
+
+    def __init__(self, name, check_interval=CACHE_GENERATION_CHECK_INTERVAL):
+        self.name = name
+        self.check_interval = check_interval
+        self._value = None
+        self._checked_at = 0.0
+
+    def current(self):
+        now = time.monotonic()
+        if self._value is None or now - self._checked_at >= self.check_interval:
+            row = db.session.query(CacheGeneration.value) \
+                .filter_by(name=self.name) \
+                .first()
+            self._value = row.value if row is not None else 0
+            self._checked_at = now
+
+        return self._value
+
+    def bump(self):
+        """Increments the counter. This isn't committed, so that it happens in
+        the same transaction as the change which caused it.
+        """
+        updated = CacheGeneration.query \
+            .filter_by(name=self.name) \
+            .update(
+                {CacheGeneration.value: CacheGeneration.value + 1},
+                synchronize_session=False)
+        if updated == 0:
+            db.session.add(CacheGeneration(name=self.name, value=1))
+
+        # Re-read it on the next lookup
+        self._value = None
+
+
+cache = LocalCache()
+registry.register_cache('resources', cache)
@@ -0,0 +1,115 @@
+"""Compression of response bodies, negotiated with `Accept-Encoding`.
+
+JSON bodies of at least `COMPRESSION_MIN_SIZE` bytes are compressed with
+brotli (if the `brotli` package is installed) or gzip, whichever the client
+prefers. Streamed responses (the export and live stats) are left alone, since
+they have to reach the client as they're produced.
+
+Views which serve the same body many times, such as cached question pages, can
+keep a `CompressedBodies` in the cache next to the payload and pass it to
+`reuse_compressed()`, so that the body is only compressed once for each
+encoding instead of for every request.
+
+Compressed responses get the encoding added to their ETag (see
+`etag.encoded_etag()`), and conditional requests accept either form.
+"""
+import os
+import zlib
+
+from flask import current_app, g, request
+
+from prophet import api
+from prophet.etag import encoded_etag
+from prophet.metrics import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies aren't worth the CPU time (and may even grow)
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+# 1 (fastest) to 9 (smallest)
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+# 0 (fastest) to 11 (smallest)
+COMPRESSION_BROTLI_QUALITY = int(
+    os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+COMPRESSIBLE_MIMETYPES = frozenset(('application/json', 'text/plain'))
+
+# In order of preference when the client accepts both equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(encoding, body):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+
+    # The gzip format without a timestamp, so that the output only depends on
+    # the body
+    compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class CompressedBodies:
+    """Compressed copies of a body which is served many times, one for each
+    encoding.
+
+    The body is compared with the one which was compressed before the copy is
+    used (which is much cheaper than compressing it), so a stale copy is never
+    served if the body changes.
+    """
+
+    def __init__(self):
+        # Mapping from encoding to (body, compressed body)
+        self._bodies = {}
+
+    def get(self, encoding, body):
+        entry = self._bodies.get(encoding)
+        if entry is not None and entry[0] == body:
+            return entry[1]
+
+        compressed = compress(encoding, body)
+        self._bodies[encoding] = (body, compressed)
+        return compressed
+
+
+def reuse_compressed(bodies):
+    """Uses `bodies` for compressing the current request's response.
+    """
+    g.compressed_bodies = bodies
+
+
+@api.after_app_request
+def compress_response(response):
+    if not current_app.config.get('COMPRESSION_ENABLED', True) or \
+            response.is_streamed or \
+            response.mimetype not in COMPRESSIBLE_MIMETYPES or \
+            not 200 <= response.status_code < 300 or \
+            'Content-Encoding' in response.headers:
+        return response
+
+    # Caches have to keep the representations apart even when this one
+    # isn't compressed
+    response.vary.add('Accept-Encoding')
+
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    with timed('compress'):
+        bodies = g.pop('compressed_bodies', None)
+        if bodies is not None:
+            compressed = bodies.get(encoding, body)
+        else:
+            compressed = compress(encoding, body)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    return response
@@ -0,0 +1,79 @@
+import hashlib
+
+from http import HTTPStatus
+
+from flask import request
+from werkzeug.http import quote_etag
+
+from prophet import api
+
+# Content codings which `compression.py` may add to entity tags
+ENCODINGS = ('br', 'gzip')
+
+
+class PreconditionFailed(Exception):
+    def __init__(self, description):
+        self.description = description
+
+
+@api.app_errorhandler(PreconditionFailed)
+def handle_precondition_failed(e):
+    return {
+        'error': {
+            'code': 'precondition_failed',
+            'description': e.description,
+        },
+    }, HTTPStatus.PRECONDITION_FAILED
+
+
+def make_etag(*parts):
+    """Builds a strong entity tag from the parts of a version stamp, such as a
+    row version or a watermark. The parts have to change whenever the body
+    would, but computing them shouldn't require rendering the body.
+    """
+    key = '\0'.join(str(p) for p in parts)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def encoded_etag(etag, encoding):
+    """Gets the entity tag of a compressed representation (see
+    `compression.py`). Byte-for-byte different bodies can't share a strong
+    ETag, so the encoding is added to it.
+    """
+    return f'{etag}-{encoding}'
+
+
+def matching_etag(etags, etag):
+    """Gets whichever of `etag` and its encoded forms is in `etags` (one of the
+    request's conditional headers), or None if none are.
+    """
+    for candidate in (etag, *(encoded_etag(etag, e) for e in ENCODINGS)):
+        if etags.contains(candidate):
+            return candidate
+    return None
+
+
+def not_modified(etag):
+    """Returns a `304 Not Modified` response if the request's If-None-Match
+    header matches `etag` (in any encoding), otherwise None.
+    """
+    matched = matching_etag(request.if_none_match, etag)
+    if matched is not None:
+        # The tag the client has, since this response isn't compressed
+        return '', HTTPStatus.NOT_MODIFIED, {'ETag': quote_etag(matched)}
+    return None
+
+
+def with_etag(body, etag):
+    """Adds the ETag header to a response body returned by a view.
+    """
+    return body, {'ETag': quote_etag(etag)}
+
+
+def check_if_match(etag):
+    """Raises `PreconditionFailed` if the request has an If-Match header which
+    doesn't match `etag` in any encoding.
+    """
+    if request.if_match and matching_etag(request.if_match, etag) is None:
+        raise PreconditionFailed(
+            "The resource has been modified since it was retrieved")
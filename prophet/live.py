@@ -0,0 +1,148 @@
+"""Shared polling for live updates (such as Server-Sent Events).
+
+Instead of every connection querying the database, each process has one
+poller per `Broadcaster` which loads the current values of everything that
+has subscribers, all at once, every `interval` seconds. Subscribers wait for
+the value to change, so changes made between two polls are coalesced into one
+update. Keys are dropped as soon as their last subscriber leaves, and the
+poller stops when there are none left.
+
+Subscribers of each key block on their own condition variable, which is only
+notified when that key's value changes, so a poll doesn't wake subscribers of
+values which stayed the same. With a cooperative server (such as
+`gunicorn -k gevent`, which patches `threading`) each connection is a
+lightweight greenlet instead of an OS thread.
+"""
+import logging
+import os
+import threading
+
+LIVE_INTERVAL = float(os.environ.get('LIVE_INTERVAL', 1))
+
+logger = logging.getLogger(__name__)
+
+
+class _Topic:
+    """Subscribers of one key and its latest value.
+    """
+
+    def __init__(self, lock):
+        self.subscribers = 0
+        # Notified only when this key's value changes, so a poll only wakes
+        # the subscribers whose value actually changed
+        self.changed = threading.Condition(lock)
+        # (version, value), or None until the key is loaded
+        self.entry = None
+
+
+class Broadcaster:
+    """Fans out values loaded by `load(keys)`, which returns a mapping from
+    keys to values (leaving out keys which no longer exist). It runs in the
+    poller thread within an application context.
+    """
+
+    def __init__(self, load, interval=LIVE_INTERVAL):
+        self.load = load
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        # Wakes the poller when there are new keys or none are left
+        self._keys_changed = threading.Condition(self._lock)
+        # Mapping from key to `_Topic`
+        self._topics = {}
+        # Versions are unique across keys and increase whenever a value
+        # changes
+        self._version = 0
+        self._thread = None
+        self._app = None
+
+        self.polls = 0
+        self.updates = 0
+
+    def subscribe(self, app, key):
+        with self._lock:
+            topic = self._topics.get(key)
+            if topic is None:
+                topic = self._topics[key] = _Topic(self._lock)
+            topic.subscribers += 1
+
+            if self._thread is None:
+                self._app = app
+                self._thread = threading.Thread(
+                    target=self._run, name='live-poller', daemon=True)
+                self._thread.start()
+            elif topic.entry is None:
+                # Load the new key without waiting for the next poll
+                self._keys_changed.notify()
+
+    def unsubscribe(self, key):
+        with self._lock:
+            topic = self._topics[key]
+            topic.subscribers -= 1
+            if topic.subscribers == 0:
+                del self._topics[key]
+                if not self._topics:
+                    self._keys_changed.notify()
+
+    def wait(self, key, version, timeout):
+        """Waits up to `timeout` seconds for the value of a subscribed key to
+        be different from `version` (None for any value).
+
+        Returns the latest `(version, value)`, where the value is None if the
+        key doesn't exist anymore, or None if nothing was loaded yet.
+        """
+        with self._lock:
+            topic = self._topics[key]
+            topic.changed.wait_for(
+                lambda: topic.entry is not None and topic.entry[0] != version,
+                timeout)
+            return topic.entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': len(self._topics),
+                'subscribers': sum(
+                    t.subscribers for t in self._topics.values()),
+                'polls': self.polls,
+                'updates': self.updates,
+            }
+
+    def _waiting(self):
+        return not self._topics or \
+            any(t.entry is None for t in self._topics.values())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._topics:
+                    self._thread = None
+                    return
+                keys = list(self._topics)
+
+            try:
+                with self._app.app_context():
+                    values = self.load(keys)
+            except Exception:
+                logger.exception("Failed to load live values")
+                values = None
+
+            with self._lock:
+                self.polls += 1
+                if values is not None:
+                    for key in keys:
+                        topic = self._topics.get(key)
+                        if topic is None:
+                            continue
+                        value = values.get(key)
+                        if topic.entry is None or topic.entry[1] != value:
+                            self._version += 1
+                            topic.entry = (self._version, value)
+                            self.updates += 1
+                            topic.changed.notify_all()
+
+                    # Wait for the next poll, unless there are new keys to
+                    # load or nothing left to load
+                    self._keys_changed.wait_for(self._waiting, self.interval)
+                else:
+                    self._keys_changed.wait(self.interval)
@@ -0,0 +1,252 @@
+"""Per-request performance instrumentation.
+
+Every request records its total time, the number of SQL statements and the time
+spent on them, the time spent authenticating and the time spent serializing.
+These are added to the response's `Server-Timing` header and aggregated per
+route for the Prometheus `/metrics` endpoint, along with the stats of the
+registered caches. Metrics are kept per process, so with several workers each
+one reports its own.
+"""
+import threading
+import time
+
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from prophet import api
+
+# Upper bounds of the request duration histogram buckets, in seconds
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Parts of a request which are timed separately, and their descriptions
+TIMED_PARTS = {
+    'sql': "SQL statements",
+    'auth': "authentication",
+    'dump': "serialization",
+    'compress': "compression",
+}
+
+
+class RequestMetrics:
+    """Measurements for a single request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.times = dict.fromkeys(TIMED_PARTS, 0.0)
+
+
+class RouteMetrics:
+    """Aggregated measurements for one route and method.
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.duration_total = 0.0
+        self.sql_count = 0
+        self.times = dict.fromkeys(TIMED_PARTS, 0.0)
+        # Mapping from status code to number of responses
+        self.statuses = {}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        # Mapping from (endpoint, method) to `RouteMetrics`
+        self.routes = {}
+        # Mapping from name to caches whose `stats()` are reported as gauges
+        self.caches = {}
+        self._lock = threading.Lock()
+
+    def register_cache(self, name, cache):
+        """Reports the values from `cache.stats()` (such as its hits, misses
+        and evictions) on `/metrics`.
+        """
+        with self._lock:
+            self.caches[name] = cache
+
+    def record(self, endpoint, method, status, duration, request_metrics):
+        with self._lock:
+            route = self.routes.get((endpoint, method))
+            if route is None:
+                route = self.routes[(endpoint, method)] = RouteMetrics()
+
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    route.bucket_counts[i] += 1
+                    break
+            route.count += 1
+            route.duration_total += duration
+            route.sql_count += request_metrics.sql_count
+            for part, value in request_metrics.times.items():
+                route.times[part] += value
+            route.statuses[status] = route.statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self.routes.clear()
+
+    def render(self):
+        """Renders the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            routes = sorted(self.routes.items())
+            lines = [
+                '# HELP prophet_request_duration_seconds Request duration.',
+                '# TYPE prophet_request_duration_seconds histogram',
+            ]
+            for (endpoint, method), route in routes:
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, route.bucket_counts):
+                    cumulative += count
+                    lines.append(
+                        f'prophet_request_duration_seconds_bucket'
+                        f'{{{labels},le="{bound}"}} {cumulative}')
+                lines += [
+                    f'prophet_request_duration_seconds_bucket'
+                    f'{{{labels},le="+Inf"}} {route.count}',
+                    f'prophet_request_duration_seconds_sum{{{labels}}} '
+                    f'{route.duration_total}',
+                    f'prophet_request_duration_seconds_count{{{labels}}} '
+                    f'{route.count}',
+                ]
+
+            lines += [
+                '# HELP prophet_requests_total Responses by status code.',
+                '# TYPE prophet_requests_total counter',
+            ]
+            for (endpoint, method), route in routes:
+                for status, count in sorted(route.statuses.items()):
+                    lines.append(
+                        f'prophet_requests_total{{endpoint="{endpoint}",'
+                        f'method="{method}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP prophet_sql_statements_total SQL statements executed.',
+                '# TYPE prophet_sql_statements_total counter',
+            ]
+            for (endpoint, method), route in routes:
+                lines.append(
+                    f'prophet_sql_statements_total{{endpoint="{endpoint}",'
+                    f'method="{method}"}} {route.sql_count}')
+
+            for part, description in TIMED_PARTS.items():
+                name = f'prophet_{part}_duration_seconds_total'
+                lines += [
+                    f'# HELP {name} Time spent on {description}.',
+                    f'# TYPE {name} counter',
+                ]
+                for (endpoint, method), route in routes:
+                    lines.append(
+                        f'{name}{{endpoint="{endpoint}",method="{method}"}} '
+                        f'{route.times[part]}')
+
+            # Mapping from stat name to [(cache name, value)]
+            cache_stats = {}
+            for name, cache in sorted(self.caches.items()):
+                for stat, value in cache.stats().items():
+                    cache_stats.setdefault(stat, []).append((name, value))
+            for stat, values in sorted(cache_stats.items()):
+                metric = f'prophet_cache_{stat}'
+                lines += [
+                    f'# HELP {metric} Cache {stat.replace("_", " ")}.',
+                    f'# TYPE {metric} gauge',
+                ]
+                for name, value in values:
+                    lines.append(f'{metric}{{cache="{name}"}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _current():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+@contextmanager
+def timed(part):
+    """Adds the time spent in the block to one of the `TIMED_PARTS` of the
+    current request.
+    """
+    request_metrics = _current()
+    if request_metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics.times[part] += time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    start = conn.info['query_start'].pop()
+    request_metrics = _current()
+    if request_metrics is not None:
+        request_metrics.sql_count += 1
+        request_metrics.times['sql'] += time.perf_counter() - start
+
+
+@api.before_app_request
+def start_request_metrics():
+    if current_app.config.get('METRICS_ENABLED', True):
+        g.request_metrics = RequestMetrics()
+
+
+@api.after_app_request
+def finish_request_metrics(response):
+    request_metrics = g.pop('request_metrics', None)
+    if request_metrics is None:
+        return response
+
+    duration = time.perf_counter() - request_metrics.start
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    registry.record(
+        endpoint, request.method, response.status_code, duration,
+        request_metrics)
+
+    timings = [f'total;dur={duration * 1000:.2f}']
+    for part, description in TIMED_PARTS.items():
+        value = request_metrics.times[part]
+        if part == 'sql':
+            description = f'{request_metrics.sql_count} {description}'
+        timings.append(
+            f'{part};dur={value * 1000:.2f};desc="{description}"')
+    response.headers['Server-Timing'] = ', '.join(timings)
+
+    return response
+
+
+@api.route('/metrics')
+def metrics():
+    """Metrics for Prometheus.
+    """
+    if not current_app.config.get('METRICS_ENABLED', True):
+        return {
+            'error': {
+                'code': 'resource_not_found',
+                'description': "Metrics are disabled",
+            },
+        }, 404
+
+    return current_app.response_class(
+        registry.render(), mimetype='text/plain; version=0.0.4')
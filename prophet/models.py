@@ -12,14 +12,27 @@ class User(db.Model):
     new IDs?
     """
     __tablename__ = 'user'
+    # IDs of deleted users are never reused, so an ID cached for a deleted user
+    # can't point at someone else (see `UserIdCache`)
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True)
     # TODO Is the sub field length always 44, or should this be extended a bit?
-    subject_identifier = db.Column(db.String(44), nullable=False)
+    # Indexed since "me" is resolved by looking up the subject identifier, and
+    # unique so that concurrent first requests can't create duplicate users
+    subject_identifier = db.Column(
+        db.String(44), nullable=False, unique=True, index=True)
 
 
 class Question(db.Model):
     __tablename__ = 'question'
+    __table_args__ = (
+        # For finding questions which are currently available
+        db.Index('ix_question_available_at_expires_at',
+                 'available_at', 'expires_at'),
+        # For finding when the next available question expires
+        db.Index('ix_question_expires_at', 'expires_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     # TODO Have a length cap?
@@ -31,10 +44,26 @@ class Question(db.Model):
         db.DateTime, nullable=False, server_default=sql.func.now())
     # Null indicates no expiration
     expires_at = db.Column(db.DateTime)
+    # Incremented on every change, used for ETags and to detect concurrent
+    # changes
+    version = db.Column(
+        db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {
+        'version_id_col': version,
+    }
 
 
 class Response(db.Model):
     __tablename__ = 'response'
+    __table_args__ = (
+        # The primary key starts with the user ID, so it can't be used for
+        # finding all of the responses to a question
+        db.Index('ix_response_question_id_answered_at',
+                 'question_id', 'answered_at'),
+        # For listing and exporting responses in question order
+        db.Index('ix_response_question_id_user_id', 'question_id', 'user_id'),
+    )
 
     user_id = db.Column(
         db.Integer, db.ForeignKey('user.id'), primary_key=True)
@@ -47,6 +76,99 @@ class Response(db.Model):
     view_time = db.Column(db.Time)
     answered_at = db.Column(
         db.DateTime, nullable=False, server_default=sql.func.now())
+    # Time of the last change, used for ETags. This is set explicitly when
+    # saving since the server default only has a resolution of seconds on
+    # SQLite.
+    updated_at = db.Column(
+        db.DateTime, nullable=False, server_default=sql.func.now())
+
+    # Deleting a user or question doesn't load their responses. They have to
+    # be deleted beforehand with a bulk DELETE (see `UserDetail.delete()` and
+    # `QuestionDetail.delete()`), otherwise the foreign keys stop it.
+    user = db.relationship(
+        'User', backref=db.backref('response', lazy=True, passive_deletes=True))
+    question = db.relationship(
+        'Question',
+        backref=db.backref('response', lazy=True, passive_deletes=True))
+
+
+class QuestionStats(db.Model):
+    """Answer tallies for a question.
+
+    These are kept up to date whenever a response is created or changed so
+    that they don't have to be counted from the `response` table on every
+    request. `flask rebuild-stats` recomputes them from scratch.
+    """
+    __tablename__ = 'question_stats'
+
+    question_id = db.Column(
+        db.Integer, db.ForeignKey('question.id'), primary_key=True)
+
+    true_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    false_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    skip_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    # Sum of all of the non-null view times in microseconds
+    view_time_total = db.Column(
+        db.BigInteger, nullable=False, default=0, server_default='0')
+    view_time_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+
+    question = db.relationship(
+        'Question',
+        backref=db.backref(
+            'stats', uselist=False, lazy=True, cascade='all, delete-orphan'))
+
+
+class UserScore(db.Model):
+    """Number of questions a user answered correctly, for the leaderboard.
+
+    Like `QuestionStats`, this is kept up to date whenever a response or a
+    question's correct answer changes. `flask rebuild-scores` recomputes it
+    from scratch.
+    """
+    __tablename__ = 'user_score'
+    __table_args__ = (
+        # For the top of the leaderboard
+        db.Index('ix_user_score_correct_count_user_id',
+                 sql.desc('correct_count'), 'user_id'),
+    )
+
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+    # Responses matching the question's correct answer
+    correct_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    # Non-skipped responses to questions with a known correct answer
+    answered_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+
+
+class UserScoreCount(db.Model):
+    """Number of users with each score, so that a user's rank can be found by
+    adding up the counts of the scores above theirs, instead of counting every
+    user ranked above them.
+
+    This is kept up to date along with `UserScore`, and `flask rebuild-scores`
+    also recomputes it.
+    """
+    __tablename__ = 'user_score_count'
+
+    correct_count = db.Column(
+        db.Integer, primary_key=True, autoincrement=False)
+    user_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+
+
+class CacheGeneration(db.Model):
+    """Counters used to invalidate the caches of all workers (see
+    `prophet.cache.GenerationCounter`).
+    """
+    __tablename__ = 'cache_generation'
 
-    user = db.relationship('User', backref=db.backref('response', lazy=True))
-    question = db.relationship('Question', backref=db.backref('response', lazy=True))
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
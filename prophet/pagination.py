@@ -0,0 +1,118 @@
+import base64
+import binascii
+import json
+
+from http import HTTPStatus
+
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+from prophet import api
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class PaginationError(Exception):
+    def __init__(self, description):
+        self.description = description
+
+
+@api.app_errorhandler(PaginationError)
+def handle_pagination_error(e):
+    return {
+        'error': {
+            'code': 'invalid_pagination',
+            'description': e.description,
+        },
+    }, HTTPStatus.BAD_REQUEST
+
+
+def encode_cursor(values):
+    """Encodes the sort key of the last item of a page into an opaque string.
+    """
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Decodes a cursor made by `encode_cursor()` back into a list of values
+    for the sort key `columns`.
+
+    Each value has to have the Python type of its column, and only integer
+    and string columns are supported, so anything else a client puts in the
+    cursor is rejected instead of being bound into the query.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        raise PaginationError(f"Invalid cursor `{cursor}`")
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise PaginationError(f"Invalid cursor `{cursor}`")
+
+    for value, column in zip(values, columns):
+        python_type = column.type.python_type
+        # Not `isinstance()`, since booleans are integers too
+        if python_type not in (int, str) or type(value) is not python_type:
+            raise PaginationError(f"Invalid cursor `{cursor}`")
+
+    return values
+
+
+def get_limit():
+    """Gets the page size from the `limit` query parameter.
+    """
+    limit = request.args.get('limit', DEFAULT_LIMIT)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PaginationError(f"Invalid limit `{limit}`")
+
+    if not 1 <= limit <= MAX_LIMIT:
+        raise PaginationError(f"Limit must be between 1 and {MAX_LIMIT}")
+
+    return limit
+
+
+def paginate(query, columns, endpoint, **values):
+    """Gets one page of results from a query using keyset pagination.
+
+    Results are ordered by `columns`, which must uniquely identify a row (such
+    as the primary key). Instead of using an OFFSET, the page starts after the
+    sort key stored in the `cursor` query parameter, so later pages cost the
+    same as the first one as long as `columns` are indexed.
+
+    Returns the items on the page and the URL of the next page, or None if this
+    is the last page. `endpoint` and `values` are used to build the URL.
+    """
+    limit = get_limit()
+    cursor = request.args.get('cursor')
+
+    if cursor is not None:
+        after = decode_cursor(cursor, columns)
+        if len(columns) == 1:
+            query = query.filter(columns[0] > after[0])
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*after))
+
+    # Get one extra row to know if there is another page after this one
+    items = query.order_by(*columns).limit(limit + 1).all()
+
+    # Later pages have the same sparse fieldset
+    if 'fields' in request.args:
+        values.setdefault('fields', request.args['fields'])
+
+    next_url = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_url = url_for(
+            endpoint,
+            limit=limit,
+            cursor=encode_cursor([getattr(last, c.key) for c in columns]),
+            _external=True,
+            **values)
+
+    return items, next_url
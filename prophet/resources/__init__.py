@@ -2,21 +2,29 @@ from http import HTTPStatus
 
 from marshmallow import ValidationError
 
-from prophet import app
+from prophet import api
 
 # Import these so that the app routes are loaded
 import prophet.resources.question
 import prophet.resources.user
 import prophet.resources.response
+import prophet.resources.stats
+import prophet.resources.score
+import prophet.resources.export
 
 
-@app.errorhandler(ValidationError)
+@api.app_errorhandler(ValidationError)
 def handle_validation_error(e):
     # TODO Change error format to allow for multiple errors and show full
     # information
+    field_name = e.field_name
+    if field_name == '_schema' and isinstance(e.messages, dict):
+        # Errors from loading a whole schema are keyed by field
+        field_name = next(iter(e.messages), field_name)
+
     return {
         'error': {
             'code': 'invalid_field',
-            'description': f'Invalid value for `{e.field_name}`',
+            'description': f'Invalid value for `{field_name}`',
         }
     }, HTTPStatus.BAD_REQUEST
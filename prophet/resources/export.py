@@ -0,0 +1,105 @@
+import csv
+import io
+import json
+
+from flask import current_app, request, stream_with_context
+from flask.views import MethodView
+from sqlalchemy import tuple_
+
+from prophet import class_route, cross_origin_auth
+from prophet.auth import requires_auth, requires_scopes
+from prophet.models import Response
+from prophet.schemas import response_export_args_schema
+from prophet.serializers import response_serializer
+
+# Scope required for exporting every user's responses
+EXPORT_SCOPE = 'Responses.Export'
+
+# Number of rows fetched from the database and written to the client at once
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def format_ndjson(rows):
+    return ''.join(
+        json.dumps(response_serializer.dump_row(row), separators=(',', ':'))
+        + '\n'
+        for row in rows)
+
+
+def format_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        data = response_serializer.dump_row(row)
+        writer.writerow(data[name] for name in response_serializer.names)
+    return buffer.getvalue()
+
+
+def generate_export(query, format):
+    """Yields the formatted rows of the query in chunks.
+
+    Rows are read from the database in chunks as well (using a server-side
+    cursor where supported), so memory use doesn't depend on the number of
+    responses.
+    """
+    if format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(response_serializer.names)
+        yield buffer.getvalue()
+        format_rows = format_csv
+    else:
+        format_rows = format_ndjson
+
+    chunk = []
+    for row in query.yield_per(EXPORT_CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield format_rows(chunk)
+            chunk = []
+
+    if chunk:
+        yield format_rows(chunk)
+
+
+@class_route('/responses/export', 'response_export')
+class ResponseExport(MethodView):
+    """Streams all responses (optionally filtered) as newline-delimited JSON
+    or CSV, ordered by question and then user ID.
+
+    An interrupted export can be resumed by passing the question and user ID
+    of the last response received as `after`.
+    """
+    decorators = [
+        requires_scopes([EXPORT_SCOPE]),
+        requires_auth,
+        cross_origin_auth,
+    ]
+
+    def get(self):
+        args = response_export_args_schema.load(request.args)
+
+        key = (Response.question_id, Response.user_id)
+        query = response_serializer.query()
+        if 'question_id' in args:
+            query = query.filter(Response.question_id == args['question_id'])
+        if 'user_id' in args:
+            query = query.filter(Response.user_id == args['user_id'])
+        if 'answered_since' in args:
+            query = query.filter(Response.answered_at >= args['answered_since'])
+        if 'answered_before' in args:
+            query = query.filter(
+                Response.answered_at < args['answered_before'])
+        if 'after' in args:
+            after = [int(id) for id in args['after'].split(',')]
+            query = query.filter(tuple_(*key) > tuple_(*after))
+        query = query.order_by(*key)
+
+        format = args['format']
+        return current_app.response_class(
+            stream_with_context(generate_export(query, format)),
+            mimetype=EXPORT_MIMETYPES[format])
@@ -1,13 +1,27 @@
+import random
+import time
+
+from datetime import datetime
 from http import HTTPStatus
 
 from flask import request, url_for
 from flask.views import MethodView
 
-from marshmallow import Schema, fields
+from marshmallow import Schema, ValidationError, fields
+from sqlalchemy import and_, or_
+from sqlalchemy.orm.exc import StaleDataError
 
-from prophet import app, class_route, db
-from prophet.models import Question, Response
+from prophet import api, class_route, db
+from prophet.cache import CACHE_TTL, GenerationCounter, cache
+from prophet.compression import CompressedBodies, reuse_compressed
+from prophet.etag import (
+    PreconditionFailed, check_if_match, make_etag, not_modified, with_etag)
+from prophet.models import Question, QuestionStats, Response
+from prophet.pagination import paginate
+from prophet.resources import score as score_resource
 from prophet.schemas import question_schema, questions_schema, responses_schema
+from prophet.serializers import (
+    question_serializer, requested_fields, select_fields)
 
 
 class QuestionNotFound(Exception):
@@ -15,7 +29,7 @@ class QuestionNotFound(Exception):
         self.id = id
 
 
-@app.errorhandler(QuestionNotFound)
+@api.app_errorhandler(QuestionNotFound)
 def handle_question_not_found(e):
     return {
         'error': {
@@ -25,6 +39,56 @@ def handle_question_not_found(e):
     }, HTTPStatus.NOT_FOUND
 
 
+class QuestionConflict(Exception):
+    def __init__(self, id):
+        self.id = id
+
+
+@api.app_errorhandler(QuestionConflict)
+def handle_question_conflict(e):
+    return {
+        'error': {
+            'code': 'conflict',
+            'description':
+                f"Question `{e.id}` kept being modified by other requests",
+        },
+    }, HTTPStatus.CONFLICT
+
+
+# Maximum number of IDs in one multi-get (`?ids=`) request
+MAX_MULTI_GET_IDS = 100
+# Times a change without `If-Match` is tried while other requests keep
+# changing the question, waiting up to `UPDATE_RETRY_DELAY` seconds (times the
+# number of failed attempts) in between so that they don't collide again
+MAX_UPDATE_ATTEMPTS = 5
+UPDATE_RETRY_DELAY = 0.05
+
+# Bumped whenever any question changes, for the cached lists
+question_generation = GenerationCounter('question')
+
+
+def question_detail_cache_key(id, version):
+    """Key of a question's cached details. A change to a question gives it a
+    new version, so this only needs the question's own version, which is
+    checked on every lookup.
+    """
+    return f'question:detail:{id}:{version}'
+
+
+def question_list_cache_key(*parts):
+    return ':'.join(
+        ('question', str(question_generation.current())) + parts)
+
+
+def invalidate_question_lists():
+    """Removes cached lists of questions after a question is created, changed
+    or deleted. Must be called before the change is committed. The question's
+    own details are keyed by its version, so they don't need to be removed.
+    """
+    # Also drops every cached list in the other workers
+    question_generation.bump()
+
+
 def query_question(id):
     q = Question.query.get(id)
     if q is None:
@@ -33,13 +97,94 @@ def query_question(id):
     return q
 
 
-def question_with_links(q):
+def get_question_data(id):
+    """Gets the version and serialized data of a question, using the cache if
+    possible, along with the `CompressedBodies` of its details.
+
+    The version is always read, which is just a lookup by primary key, so a
+    change or deletion in another worker is seen right away.
+    """
+    try:
+        id = int(id)
+    except ValueError:
+        raise QuestionNotFound(id)
+
+    version = db.session.query(Question.version).filter_by(id=id).scalar()
+    if version is None:
+        raise QuestionNotFound(id)
+
+    key = question_detail_cache_key(id, version)
+    entry = cache.get(key)
+    if entry is None:
+        q = query_question(id)
+        entry = (q.version, question_schema.dump(q), CompressedBodies())
+        cache.set(question_detail_cache_key(id, q.version), entry)
+
+    return entry
+
+
+def parse_ids(value, max_count):
+    """Parses a comma-separated list of integer IDs from a query parameter.
+    """
+    if not value:
+        raise ValidationError("No IDs given", field_name='ids')
+
+    try:
+        ids = [int(id) for id in value.split(',')]
+    except ValueError:
+        raise ValidationError("IDs must be integers", field_name='ids')
+
+    if len(ids) > max_count:
+        raise ValidationError(
+            f"At most {max_count} IDs can be requested", field_name='ids')
+
+    return ids
+
+
+def get_questions_data(ids):
+    """Like `get_question_data()` for several questions, with one query for
+    their versions and one for all of the ones which aren't cached. Returns a
+    mapping from ID to the cache entry, leaving out questions which don't
+    exist.
+    """
+    versions = db.session.query(Question.id, Question.version) \
+        .filter(Question.id.in_(ids))
+
+    entries = {}
+    missing = []
+    for id, version in versions:
+        entry = cache.get(question_detail_cache_key(id, version))
+        if entry is not None:
+            entries[id] = entry
+        else:
+            missing.append(id)
+
+    if missing:
+        rows = question_serializer.query(Question.version) \
+            .filter(Question.id.in_(missing))
+        for row in rows:
+            entry = (
+                row.version, question_serializer.dump_row(row),
+                CompressedBodies())
+            cache.set(question_detail_cache_key(row.id, row.version), entry)
+            entries[row.id] = entry
+
+    return entries
+
+
+def question_etag(id, version):
+    return make_etag('question', id, version)
+
+
+def question_with_links(data):
+    """Adds links to a serialized question.
+    """
     return {
-        'data': question_schema.dump(q),
+        'data': data,
         'links': {
-            'self': url_for('question_detail', id=q.id, _external=True),
+            'self': url_for('.question_detail', id=data['id'], _external=True),
             'responses': url_for(
-                'question_responses', question_id=q.id, _external=True),
+                '.question_responses', question_id=data['id'], _external=True),
         },
     }
 
@@ -49,37 +194,219 @@ def question_with_links(q):
 @class_route('/questions/<id>', 'question_detail')
 class QuestionDetail(MethodView):
     def get(self, id):
-        q = query_question(id)
-        return question_with_links(q)
+        names = requested_fields(question_serializer.names)
+        version, data, bodies = get_question_data(id)
+        # The URL of a sparse fieldset is a different resource, so it can have
+        # the same ETag (which also keeps it usable for If-Match)
+        etag = question_etag(data['id'], version)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        result = question_with_links(data)
+        if names is None:
+            reuse_compressed(bodies)
+        else:
+            result['data'] = select_fields(data, names)
+        return with_etag(result, etag)
 
     def put(self, id):
-        q = query_question(id)
-        q = question_schema.load(request.get_json(), instance=q, partial=True)
-        db.session.add(q)
-        db.session.commit()
-        return question_with_links(q)
+        for attempt in range(1, MAX_UPDATE_ATTEMPTS + 1):
+            q = query_question(id)
+            # Allows clients to make sure they don't overwrite someone else's
+            # changes
+            check_if_match(question_etag(q.id, q.version))
+
+            old_correct_answer = q.correct_answer
+            q = question_schema.load(
+                request.get_json(), instance=q, partial=True)
+            db.session.add(q)
+            try:
+                # Scores of users who already responded depend on the answer
+                score_resource.update_scores_for_answer(
+                    q.id, old_correct_answer, q.correct_answer)
+                invalidate_question_lists()
+                # The update also checks the version, in case it was changed
+                # since it was loaded
+                db.session.commit()
+                break
+            except StaleDataError:
+                db.session.rollback()
+                # Clients which didn't send a precondition get the last
+                # change applied, so the question is loaded and changed again
+                # (a few times at most, in case it keeps being changed)
+                if request.if_match:
+                    raise PreconditionFailed(
+                        "The question was modified by another request")
+                if attempt == MAX_UPDATE_ATTEMPTS:
+                    raise QuestionConflict(id)
+                time.sleep(random.uniform(0, UPDATE_RETRY_DELAY * attempt))
+
+        return with_etag(
+            question_with_links(question_schema.dump(q)),
+            question_etag(q.id, q.version))
 
     def delete(self, id):
         q = query_question(id)
+        # Users who responded lose the question from their scores, as if it
+        # had no correct answer
+        score_resource.update_scores_for_answer(q.id, q.correct_answer, None)
+        # In one statement instead of loading every response into the session.
+        # The stats are deleted along with the question.
+        Response.query \
+            .filter_by(question_id=q.id) \
+            .delete(synchronize_session=False)
         db.session.delete(q)
+        invalidate_question_lists()
         db.session.commit()
         return {
             'data': {}
         }
 
 
+def is_active(now):
+    """Condition for questions which are available and haven't expired at
+    `now`.
+    """
+    return and_(
+        Question.available_at <= now,
+        or_(Question.expires_at.is_(None), Question.expires_at > now))
+
+
+def next_schedule_change(now):
+    """Gets the first time after `now` when a question becomes available or
+    expires, or None if no such changes are scheduled.
+    """
+    # Both are answered from an index
+    next_available = db.session.query(db.func.min(Question.available_at)) \
+        .filter(Question.available_at > now) \
+        .as_scalar()
+    next_expiration = db.session.query(db.func.min(Question.expires_at)) \
+        .filter(Question.expires_at > now) \
+        .as_scalar()
+    times = db.session.query(next_available, next_expiration).one()
+    times = [t for t in times if t is not None]
+    return min(times) if times else None
+
+
+@class_route('/questions/active', 'active_question_list')
+class ActiveQuestionList(MethodView):
+    """Questions which are currently available and haven't expired.
+
+    Which questions are active only changes when a question is modified or
+    when one of them becomes available or expires, so a cached page is kept
+    until the next of those scheduled times instead of for a fixed TTL.
+    """
+
+    def get(self):
+        serializer = question_serializer.requested()
+        # The full URL includes the host for the links, the page and the
+        # fields
+        key = question_list_cache_key('active', request.url)
+        page = cache.get(key)
+        if page is None:
+            now = datetime.utcnow()
+            valid_until = next_schedule_change(now)
+
+            questions, next_url = paginate(
+                serializer.query(Question.id).filter(is_active(now)),
+                (Question.id,),
+                '.active_question_list')
+            page = (
+                serializer.dump(questions), next_url, valid_until,
+                CompressedBodies())
+
+            ttl = None
+            if valid_until is not None:
+                ttl = min(CACHE_TTL, (valid_until - now).total_seconds())
+            cache.set(key, page, ttl)
+
+        data, next_url, valid_until, bodies = page
+        # Each window between scheduled changes has its own set of questions
+        etag = make_etag(
+            'active_questions', question_generation.current(), valid_until,
+            request.url)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        links = {
+            'self': url_for('.active_question_list', _external=True),
+        }
+        if next_url is not None:
+            links['next'] = next_url
+
+        reuse_compressed(bodies)
+        return with_etag({
+            'data': data,
+            'links': links,
+        }, etag)
+
+
 @class_route('/questions', 'question_list')
 class QuestionList(MethodView):
     def get(self):
+        if 'ids' in request.args:
+            return self.get_many()
+
+        serializer = question_serializer.requested()
+        # Any change to a question changes the generation
+        etag = make_etag(
+            'questions', question_generation.current(), request.url)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        # The full URL includes the host for the links, the page and the
+        # fields
+        key = question_list_cache_key('list', request.url)
+        page = cache.get(key)
+        if page is None:
+            questions, next_url = paginate(
+                serializer.query(Question.id), (Question.id,), '.question_list')
+            page = (serializer.dump(questions), next_url, CompressedBodies())
+            cache.set(key, page)
+
+        data, next_url, bodies = page
+        links = {
+            'self': url_for('.question_list', _external=True),
+        }
+        if next_url is not None:
+            links['next'] = next_url
+
+        reuse_compressed(bodies)
+        return with_etag({
+            'data': data,
+            'links': links,
+        }, etag)
+
+    def get_many(self):
+        """Gets the questions with the IDs in `ids`, in the same order, and
+        lists the ones which don't exist in `missing`.
+        """
+        ids = list(dict.fromkeys(
+            parse_ids(request.args.get('ids'), MAX_MULTI_GET_IDS)))
+        names = requested_fields(question_serializer.names)
+        entries = get_questions_data(ids)
+
         return {
-            'data': questions_schema.dump(Question.query.all()),
+            'data': [
+                select_fields(entries[id][1], names)
+                for id in ids if id in entries
+            ],
+            'missing': [id for id in ids if id not in entries],
             'links': {
-                'self': url_for('question_list', _external=True),
+                'self': url_for(
+                    '.question_list',
+                    ids=request.args.get('ids'),
+                    _external=True),
             },
         }
 
     def post(self):
         q = question_schema.load(request.get_json())
+        q.stats = QuestionStats()
         db.session.add(q)
+        invalidate_question_lists()
         db.session.commit()
-        return question_with_links(q)
+        return question_with_links(question_schema.dump(q))
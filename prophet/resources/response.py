@@ -1,16 +1,44 @@
+import logging
+
+from datetime import datetime
 from http import HTTPStatus
 
-from flask import g, request, url_for
+from flask import current_app, g, request, url_for
 from flask.views import MethodView
 
-from prophet import app, class_route, db
-from prophet.auth import msal_app, requires_auth
+from marshmallow import ValidationError
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from prophet import api, class_route, db
+from prophet.auth import get_msal_app, requires_auth
+from prophet.etag import make_etag, not_modified, with_etag
 from prophet.models import Question, Response, Response
+from prophet.pagination import paginate
 from prophet.resources import (
     question as question_resourse,
+    score as score_resource,
+    stats as stats_resource,
     user as user_resourse,
 )
-from prophet.schemas import ResponseSchema, responses_schema, response_schema
+from prophet.schemas import (
+    ResponseSchema,
+    responses_schema,
+    response_schema,
+    response_data_schema,
+    response_batch_item_schema,
+)
+from prophet.serializers import (
+    question_serializer, requested_fields, response_serializer, select_fields)
+from prophet.writebehind import WriteBehindQueue
+
+# Maximum number of responses in one batch submission
+MAX_BATCH_SIZE = 100
+# Maximum number of responses saved by one statement, which keeps the number
+# of parameters far below the databases' limits
+UPSERT_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
 
 
 class ResponseNotFound(Exception):
@@ -19,7 +47,7 @@ class ResponseNotFound(Exception):
         self.question_id = question_id
 
 
-@app.errorhandler(ResponseNotFound)
+@api.app_errorhandler(ResponseNotFound)
 def handle_response_not_found(e):
     return {
         'error': {
@@ -32,24 +60,276 @@ def handle_response_not_found(e):
 
 
 def query_response(user_id, question_id):
+    # Extract the real ID in case of "me"
+    user_id = user_resourse.resolve_user_id(user_id)
     response = Response.query.get((user_id, question_id))
     if response is None:
         raise ResponseNotFound(user_id, question_id)
     return response
 
 
+def unchanged_condition(old, name):
+    """Gets a condition for the existing row in an upsert which is true if it
+    still contains `old` (its `response` and `view_time`), along with the
+    parameters it needs. `name` is the name of the view time's parameter, so
+    that several conditions can be used in one statement.
+    """
+    condition = 'response.response IS ' + \
+        {True: 'TRUE', False: 'FALSE', None: 'NULL'}[old.response]
+    params = []
+    if old.view_time is None:
+        condition += ' AND response.view_time IS NULL'
+    else:
+        condition += f' AND response.view_time = :{name}'
+        params.append(bindparam(name, old.view_time, type_=db.Time))
+    return condition, params
+
+
+def upsert_response(user_id, question_id, new, old):
+    """Creates or updates a response with a single statement and returns the
+    resulting row.
+
+    `new` is the `(response, view_time)` to save. `old` is what the row
+    currently contains, or None if it is expected to not exist yet. If the
+    row turns out to be different from `old`, nothing is changed and None is
+    returned. This keeps the tallies correct when the same response is changed
+    concurrently.
+
+    Uses `INSERT ... ON CONFLICT DO UPDATE ... RETURNING`, which is supported
+    by PostgreSQL and SQLite 3.35+.
+    """
+    params = [
+        bindparam('view_time', type_=db.Time),
+        bindparam('updated_at', type_=db.DateTime),
+    ]
+    if old is None:
+        # Never update, so this only inserts
+        condition = '1 = 0'
+    else:
+        condition, old_params = unchanged_condition(old, 'old_view_time')
+        params += old_params
+
+    statement = text(f"""
+        INSERT INTO response
+            (user_id, question_id, response, view_time, updated_at)
+        VALUES (:user_id, :question_id, :response, :view_time, :updated_at)
+        ON CONFLICT (user_id, question_id) DO UPDATE
+        SET
+            response = excluded.response,
+            view_time = excluded.view_time,
+            updated_at = excluded.updated_at
+        WHERE {condition}
+        RETURNING
+            user_id, question_id, response, view_time, answered_at, updated_at
+    """).bindparams(*params).columns(*Response.__table__.columns)
+
+    return db.session.execute(statement, {
+        'user_id': user_id,
+        'question_id': question_id,
+        'response': new[0],
+        'view_time': new[1],
+        'updated_at': datetime.utcnow(),
+    }).first()
+
+
+def upsert_responses(rows, existing):
+    """Like `upsert_response()`, but for many responses with a single
+    multi-row statement.
+
+    `rows` are dicts with every column of the responses to save. `existing`
+    maps `(user_id, question_id)` to what the rows which are expected to exist
+    currently contain. Returns the rows which were saved, which leaves out the
+    ones which turned out to be different from `existing` (or to exist, for
+    new ones) and weren't changed.
+    """
+    values = []
+    conditions = []
+    params = []
+    bound = {}
+    for i, row in enumerate(rows):
+        values.append(
+            f'(:user_id_{i}, :question_id_{i}, :response_{i}, '
+            f':view_time_{i}, :answered_at_{i}, :updated_at_{i})')
+        params += [
+            bindparam(f'view_time_{i}', type_=db.Time),
+            bindparam(f'answered_at_{i}', type_=db.DateTime),
+            bindparam(f'updated_at_{i}', type_=db.DateTime),
+        ]
+        bound.update({f'{k}_{i}': v for k, v in row.items()})
+
+        old = existing.get((row['user_id'], row['question_id']))
+        if old is not None:
+            condition, old_params = unchanged_condition(
+                old, f'old_view_time_{i}')
+            conditions.append(
+                f'(response.user_id = :user_id_{i} AND '
+                f'response.question_id = :question_id_{i} AND {condition})')
+            params += old_params
+
+    statement = text(f"""
+        INSERT INTO response
+            (user_id, question_id, response, view_time, answered_at,
+             updated_at)
+        VALUES {', '.join(values)}
+        ON CONFLICT (user_id, question_id) DO UPDATE
+        SET
+            response = excluded.response,
+            view_time = excluded.view_time,
+            updated_at = excluded.updated_at
+        WHERE {' OR '.join(conditions) or '1 = 0'}
+        RETURNING
+            user_id, question_id, response, view_time, answered_at, updated_at
+    """).bindparams(*params).columns(*Response.__table__.columns)
+
+    return db.session.execute(statement, bound).fetchall()
+
+
+def save_responses(items):
+    """Creates or updates many responses, possibly of different users, without
+    committing.
+
+    `items` maps `(user_id, question_id)` to the new `response` and optionally
+    `view_time` (the old one is kept if it isn't given, like a partial update
+    with PUT) and `answered_at` (used for new responses). The users and
+    questions must exist. Returns a list of `(key, row)` with the saved
+    values.
+
+    Existing responses are read with a single query and all of the responses
+    are saved with a single multi-row upsert (see `upsert_responses()`),
+    which skips rows that changed since they were read. Those are read and
+    saved again, so the tallies and scores stay correct when the same
+    responses are saved concurrently. The tallies and the scores are then
+    updated with a statement each.
+    """
+    keys = list(items)
+    saved = []
+    # Summed for each question, since many responses are usually to the same
+    # few questions
+    stats_deltas = {}
+    score_changes = []
+    for start in range(0, len(keys), UPSERT_CHUNK_SIZE):
+        pending = {k: items[k] for k in keys[start:start + UPSERT_CHUNK_SIZE]}
+        while pending:
+            user_ids = {user_id for user_id, _ in pending}
+            question_ids = {question_id for _, question_id in pending}
+            # May include some other responses when there are several users,
+            # which are skipped below
+            existing = {
+                (r.user_id, r.question_id): r for r in db.session.query(
+                    Response.user_id, Response.question_id, Response.response,
+                    Response.view_time)
+                .filter(Response.user_id.in_(user_ids))
+                .filter(Response.question_id.in_(question_ids))
+                if (r.user_id, r.question_id) in pending
+            }
+
+            now = datetime.utcnow()
+            rows = []
+            for (user_id, question_id), item in pending.items():
+                old = existing.get((user_id, question_id))
+                rows.append({
+                    'user_id': user_id,
+                    'question_id': question_id,
+                    'response': item['response'],
+                    'view_time': item['view_time'] if 'view_time' in item
+                    else old.view_time if old is not None else None,
+                    # Only used for new responses
+                    'answered_at': item.get('answered_at', now),
+                    'updated_at': now,
+                })
+
+            for row in upsert_responses(rows, existing):
+                key = (row.user_id, row.question_id)
+                old = existing.get(key)
+                delta = stats_resource.stats_delta(
+                    (old.response, old.view_time) if old is not None
+                    else None,
+                    (row.response, row.view_time))
+                total = stats_deltas.setdefault(
+                    row.question_id,
+                    dict.fromkeys(stats_resource.COUNTERS, 0))
+                for k, v in delta.items():
+                    total[k] += v
+                score_changes.append((
+                    row.user_id,
+                    row.question_id,
+                    old.response if old is not None else None,
+                    row.response))
+                saved.append((key, row))
+                del pending[key]
+
+    stats_resource.apply_stats_deltas(stats_deltas)
+    score_resource.update_user_scores(score_changes)
+    return saved
+
+
+def flush_queued_responses(changes):
+    """Saves responses from `response_queue` in a single transaction. If that
+    fails (such as when a user or question was deleted after the response was
+    queued), they are saved one at a time so that only the bad ones are lost.
+    """
+    try:
+        save_responses(changes)
+        db.session.commit()
+        return
+    except SQLAlchemyError:
+        db.session.rollback()
+
+    for key, change in changes.items():
+        try:
+            save_responses({key: change})
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            logger.exception("Dropped queued response %s", key)
+
+
+def merge_queued_responses(old, new):
+    merged = dict(old)
+    merged.update(new)
+    # Keep the time of the first answer
+    merged['answered_at'] = old['answered_at']
+    return merged
+
+
+# Responses accepted with `202 Accepted` when `RESPONSE_WRITE_BEHIND` is on,
+# keyed by (user_id, question_id)
+response_queue = WriteBehindQueue(
+    flush_queued_responses, merge=merge_queued_responses)
+
+
+def with_queued_change(response, user_id, question_id, change):
+    """Builds the response as it will be once a queued change is saved.
+    `response` is the currently saved one, or None.
+    """
+    return Response(
+        user_id=user_id,
+        question_id=question_id,
+        response=change['response'],
+        view_time=change['view_time'] if 'view_time' in change
+        else response.view_time if response is not None else None,
+        answered_at=response.answered_at if response is not None
+        else change['answered_at'])
+
+
+def response_etag(response):
+    return make_etag(
+        'response', response.user_id, response.question_id,
+        response.updated_at.isoformat())
+
+
 def response_with_links(response):
     return {
         'data': response_schema.dump(response),
         'links': {
             'self': url_for(
-                'response_detail',
+                '.response_detail',
                 user_id=response.user_id,
                 question_id=response.question_id,
                 _external=True),
-            'user': url_for('user_detail', id=response.user_id, _external=True),
+            'user': url_for('.user_detail', id=response.user_id, _external=True),
             'question': url_for(
-                'question_detail',
+                '.question_detail',
                 id=response.question_id,
                 _external=True),
         },
@@ -62,74 +342,291 @@ def response_with_links(response):
     '/questions/<question_id>/responses/<user_id>', 'question_response_detail')
 class ResponseDetail(MethodView):
     def get(self, user_id, question_id):
+        # Show changes which were accepted by this worker but haven't been
+        # saved yet
+        try:
+            key = (user_resourse.resolve_user_id(user_id), int(question_id))
+        except ValueError:
+            raise ResponseNotFound(user_id, question_id)
+        names = requested_fields(response_serializer.names)
+        change = response_queue.get(key)
+        if change is not None:
+            response = Response.query.get(key)
+            result = response_with_links(
+                with_queued_change(response, *key, change))
+            result['data'] = select_fields(result['data'], names)
+            return result
+
         response = query_response(user_id, question_id)
-        return response_with_links(response)
+        etag = response_etag(response)
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+
+        result = response_with_links(response)
+        result['data'] = select_fields(result['data'], names)
+        return with_etag(result, etag)
 
     def put(self, user_id, question_id):
-        response = Response.query.get((user_id, question_id))
-        if response is None:
-            # Extract the real ID in case of "me"
-            user = user_resourse.query_user(user_id)
-            user_id = user.id
+        try:
+            question_id = int(question_id)
+        except ValueError:
+            raise question_resourse.QuestionNotFound(question_id)
 
-            # Make sure the question exists
-            question_resourse.query_question(question_id)
+        data = response_data_schema.load(request.get_json() or {})
+
+        # Partial updates need the saved response, so they're never queued
+        if current_app.config.get('RESPONSE_WRITE_BEHIND', False) and \
+                'response' in data:
+            return self.queue(user_id, question_id, data)
+
+        # Extract the real ID in case of "me"
+        user_id = user_resourse.resolve_user_id(user_id)
+
+        # Most responses are new, so try just inserting first, which only
+        # needs one statement. Updates need the previous values for the
+        # tallies, and are only applied if the row hasn't changed since it was
+        # read (otherwise the read and update are retried).
+        def query_old():
+            return db.session.execute(
+                select([Response.response, Response.view_time])
+                .where(Response.user_id == user_id)
+                .where(Response.question_id == question_id)
+            ).first()
+
+        # Partial updates can't create a response, so read it right away
+        old = query_old() if 'response' not in data else None
+        while True:
+            if old is None and 'response' not in data:
+                raise ValidationError(
+                    "Required when creating a response", field_name='response')
 
-            # TODO Validate incoming request data
-            # Create a new one for this question
-            data = request.get_json()
-            response = response_schema.load({
-                'user_id': user_id,
-                'question_id': question_id,
-                'response': data['response'],
-                # This is optional
-                'view_time': data.get('view_time'),
-            }, session=db.session)
-        else:
-            # Update the existing one
-            # TODO Disallow changing the IDs
-            response = response_schema.load(
-                request.get_json(), instance=response, partial=True)
-
-        db.session.add(response)
+            new = (
+                data['response'] if 'response' in data else old.response,
+                data['view_time'] if 'view_time' in data
+                else old.view_time if old is not None else None,
+            )
+            try:
+                row = upsert_response(user_id, question_id, new, old)
+            except IntegrityError:
+                db.session.rollback()
+                # A foreign key doesn't exist, so find out which one
+                question_resourse.query_question(question_id)
+                user_resourse.query_user(user_id)
+                raise
+
+            if row is not None:
+                break
+
+            old = query_old()
+
+        # Update the tallies and the score in the same transaction
+        stats_resource.update_question_stats(
+            question_id,
+            old,
+            (row.response, row.view_time))
+        score_resource.update_user_score(
+            user_id,
+            question_id,
+            old.response if old is not None else None,
+            row.response)
         db.session.commit()
-        return response_with_links(response)
+        # Not added to the session; only used for building the result
+        response = Response(**row)
+        return with_etag(response_with_links(response), response_etag(response))
 
+    def queue(self, user_id, question_id, data):
+        """Queues a response to be saved in the background (write-behind) and
+        returns `202 Accepted` without waiting for the database.
+        """
+        # Both are checked with lookups by primary key
+        user_id = user_resourse.query_user_id(user_id)
+        question_resourse.get_question_data(question_id)
 
-@class_route('/users/<user_id>/responses', 'user_responses')
-class UserResponses(MethodView):
-    def get(self, user_id):
-        # Get the user to check that the user ID is valid and to resolve
-        # references to "me" (but don't create users just to look at an empty
-        # list of responses).
-        user = user_resourse.query_user(user_id)
-        # Extract the real ID instead of "me"
-        id = user.id
-        responses = Response.query.filter_by(user_id=id).all()
+        change = dict(data, answered_at=datetime.utcnow())
+        response_queue.put(
+            current_app._get_current_object(), (user_id, question_id), change)
+
+        # Only has the submitted values, since the saved response isn't read
+        response = with_queued_change(None, user_id, question_id, change)
+        return response_with_links(response), HTTPStatus.ACCEPTED
+
+
+def batch_error(code, description):
+    return {
+        'error': {
+            'code': code,
+            'description': description,
+        },
+    }
+
+
+@class_route('/users/<user_id>/responses:batch', 'response_batch')
+class ResponseBatch(MethodView):
+    """Creates or updates many of a user's responses at once.
+
+    Every item is validated on its own and gets its own result, so invalid
+    items don't stop the rest of the batch from being saved. All of the valid
+    items are saved in a single transaction.
+    """
+
+    def post(self, user_id):
+        data = request.get_json()
+        if not isinstance(data, list):
+            raise ValidationError("Expected a list", field_name='responses')
+        if len(data) > MAX_BATCH_SIZE:
+            raise ValidationError(
+                f"At most {MAX_BATCH_SIZE} responses can be submitted at once",
+                field_name='responses')
+
+        # Extract the real ID in case of "me"
+        user_id = user_resourse.query_user_id(user_id)
+
+        results = [None] * len(data)
+        # Mapping from question ID to (index, item) for the valid items
+        items = {}
+        for i, item in enumerate(data):
+            try:
+                item = response_batch_item_schema.load(item)
+            except ValidationError as e:
+                field = next(iter(e.messages), None)
+                results[i] = batch_error(
+                    'invalid_field', f"Invalid value for `{field}`")
+                continue
+
+            if item['question_id'] in items:
+                results[i] = batch_error(
+                    'duplicate_response',
+                    f"Question `{item['question_id']}` appears more than once "
+                    f"in the batch")
+                continue
+
+            items[item['question_id']] = (i, item)
+
+        # Check that all of the questions exist with a single query
+        question_ids = {
+            id for id, in db.session.query(Question.id)
+            .filter(Question.id.in_(items))
+        }
+        valid = {}
+        for question_id, (i, item) in items.items():
+            if question_id not in question_ids:
+                results[i] = batch_error(
+                    'question_not_found',
+                    f"Question `{question_id}` does not exist")
+                continue
+            valid[(user_id, question_id)] = item
+
+        saved = [
+            (items[question_id][0], row)
+            for (_, question_id), row in save_responses(valid)
+        ]
+        db.session.commit()
+
+        for i, row in saved:
+            # Not added to the session; only used for building the result
+            results[i] = response_with_links(Response(**row))
 
         return {
-            'data': responses_schema.dump(responses),
+            'data': results,
             'links': {
-                'self': url_for('user_responses', user_id=id, _external=True),
-                'user': url_for('user_detail', id=id, _external=True),
+                'self': url_for(
+                    '.response_batch', user_id=user_id, _external=True),
+                'user': url_for('.user_detail', id=user_id, _external=True),
             },
         }
 
 
+@class_route('/users/<user_id>/responses', 'user_responses')
+class UserResponses(MethodView):
+    def get(self, user_id):
+        serializer = response_serializer.requested()
+        # Each response can include its question (`?include=question`)
+        include = request.args.get('include')
+        if include not in (None, 'question'):
+            raise ValidationError(
+                "Only `question` can be included", field_name='include')
+
+        # Check that the user ID is valid and resolve references to "me" (but
+        # don't create users just to look at an empty list of responses).
+        id = user_resourse.query_user_id(user_id)
+
+        # Changing or adding a response moves the latest update time and
+        # removing one changes the count. The URL covers the page. Included
+        # questions change with the question generation.
+        count, last_updated = db.session \
+            .query(func.count(), func.max(Response.updated_at)) \
+            .filter(Response.user_id == id) \
+            .one()
+        etag = make_etag(
+            'user_responses', id, count, last_updated, request.url,
+            question_resourse.question_generation.current() if include else '')
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+        query = serializer.query(Response.user_id, Response.question_id) \
+            .filter(Response.user_id == id)
+        url_args = {}
+        if include:
+            # Read in the same query, after the response's columns
+            query = query \
+                .join(Question, Question.id == Response.question_id) \
+                .add_columns(*question_serializer.columns)
+            url_args['include'] = include
+        responses, next_url = paginate(
+            query,
+            (Response.user_id, Response.question_id),
+            '.user_responses',
+            user_id=id,
+            **url_args)
+
+        links = {
+            'self': url_for('.user_responses', user_id=id, _external=True),
+            'user': url_for('.user_detail', id=id, _external=True),
+        }
+        if next_url is not None:
+            links['next'] = next_url
+
+        data = serializer.dump(responses)
+        if include:
+            size = len(question_serializer.columns)
+            questions = question_serializer.dump(
+                [row[-size:] for row in responses])
+            for item, question in zip(data, questions):
+                item['question'] = question
+
+        return with_etag({
+            'data': data,
+            'links': links,
+        }, etag)
+
+
 @class_route('/questions/<question_id>/responses', 'question_responses')
 class QuestionResponses(MethodView):
     def get(self, question_id):
-        responses = Response.query.filter_by(response_id=question_id).all()
+        serializer = response_serializer.requested()
+        responses, next_url = paginate(
+            serializer.query(Response.question_id, Response.user_id)
+            .filter(Response.question_id == question_id),
+            (Response.question_id, Response.user_id),
+            '.question_responses',
+            question_id=question_id)
         if len(responses) == 0:
             # Validate that the question ID is valid
             # (Just called for the exception if the question does not exist)
             question_resourse.query_question(question_id)
 
+        links = {
+            'self': url_for(
+                '.question_responses', question_id=question_id, _external=True),
+            'question': url_for(
+                '.question_detail', id=question_id, _external=True),
+        }
+        if next_url is not None:
+            links['next'] = next_url
+
         return {
-            'data': responses_schema.dump(responses),
-            'links': {
-                'self': url_for('question_responses', id=id, _external=True),
-                'question': url_for(
-                    'question_detail', id=question_id, _external=True),
-            },
+            'data': serializer.dump(responses),
+            'links': links,
         }
@@ -0,0 +1,351 @@
+import click
+
+from flask import request, url_for
+from flask.views import MethodView
+from sqlalchemy import case, func, text
+
+from prophet import api, class_route, db
+from prophet.models import (
+    Question, Response, User, UserScore, UserScoreCount)
+from prophet.schemas import leaderboard_args_schema, user_score_schema
+
+
+def matches(a, param):
+    """SQL which is 1 if `a` equals the parameter `param` and 0 otherwise
+    (including when either is null).
+    """
+    return f'CASE WHEN {a} = :{param} THEN 1 ELSE 0 END'
+
+
+def update_counts(changes):
+    """Moves users between the scores in `user_score_count` with a single
+    statement. `changes` are the `(old, new)` correct counts of users whose
+    scores changed, with None for a score which was created or deleted.
+    """
+    deltas = {}
+    for old, new in changes:
+        if old == new:
+            continue
+        if old is not None:
+            deltas[old] = deltas.get(old, 0) - 1
+        if new is not None:
+            deltas[new] = deltas.get(new, 0) + 1
+
+    # In a fixed order, so that concurrent updates lock the rows in the same
+    # order
+    deltas = sorted((k, v) for k, v in deltas.items() if v != 0)
+    if not deltas:
+        return
+
+    params = {}
+    for i, (correct_count, user_count) in enumerate(deltas):
+        params[f'correct_count_{i}'] = correct_count
+        params[f'user_count_{i}'] = user_count
+    values = ', '.join(
+        f'(:correct_count_{i}, :user_count_{i})' for i in range(len(deltas)))
+    db.session.execute(
+        text(
+            'INSERT INTO user_score_count (correct_count, user_count) '
+            f'VALUES {values} '
+            'ON CONFLICT (correct_count) DO UPDATE '
+            'SET user_count = user_score_count.user_count '
+            '+ excluded.user_count'),
+        params)
+
+
+def update_scores(users, params, correct, answered):
+    """Adds `correct` and `answered` (SQL expressions, which can refer to the
+    `user_score` row) to the scores of the users selected by `users` (a
+    subquery or a list of placeholders) with the parameters `params`, creating
+    the scores which don't exist yet. This isn't committed.
+
+    Each statement returns the scores it changed, so `user_score_count` gets
+    exactly the changes which were made to them, even if other transactions
+    change the same scores at the same time.
+    """
+    created = db.session.execute(
+        text(
+            'INSERT INTO user_score (user_id, correct_count, answered_count) '
+            f'SELECT id, 0, 0 FROM "user" WHERE id IN ({users}) '
+            'ON CONFLICT DO NOTHING RETURNING user_id'),
+        params)
+    changes = [(None, 0) for _ in created]
+
+    # The old score is worked out from the new one, since only the latter
+    # can be returned
+    changes.extend(db.session.execute(
+        text(
+            'UPDATE user_score '
+            f'SET correct_count = correct_count + ({correct}), '
+            f'answered_count = answered_count + ({answered}) '
+            f'WHERE user_id IN ({users}) '
+            f'RETURNING correct_count - ({correct}), correct_count'),
+        params))
+    update_counts(changes)
+
+
+def update_user_score(user_id, question_id, old=None, new=None):
+    """Updates a user's score for a created or changed response.
+
+    `old` and `new` are the `Response.response` before and after the change
+    (None for no response before). The question's correct answer is read in
+    the same statement, and like `update_question_stats()`, the update is done
+    in SQL and isn't committed.
+    """
+    if old == new:
+        return
+
+    correct_answer = \
+        '(SELECT correct_answer FROM question WHERE id = :question_id)'
+    update_scores(
+        ':user_id',
+        {
+            'user_id': user_id,
+            'question_id': question_id,
+            'old': old,
+            'new': new,
+            'answered': int(new is not None) - int(old is not None),
+        },
+        f'{matches(correct_answer, "new")} - {matches(correct_answer, "old")}',
+        f'CASE WHEN {correct_answer} IS NOT NULL THEN :answered ELSE 0 END')
+
+
+def update_user_scores(changes):
+    """Updates the scores for many created or changed responses at once.
+
+    `changes` is a list of `(user_id, question_id, old, new)`, like the
+    arguments of `update_user_score()`. The correct answers are read with one
+    query and the scores are updated with one UPDATE, instead of a statement
+    for each response.
+    """
+    changes = [c for c in changes if c[2] != c[3]]
+    if not changes:
+        return
+
+    correct_answers = dict(
+        db.session.query(Question.id, Question.correct_answer)
+        .filter(Question.id.in_({c[1] for c in changes})))
+
+    # Mapping from user ID to [correct_count, answered_count] changes
+    deltas = {}
+    for user_id, question_id, old, new in changes:
+        correct_answer = correct_answers.get(question_id)
+        if correct_answer is None:
+            continue
+        delta = deltas.setdefault(user_id, [0, 0])
+        delta[0] += int(new == correct_answer) - int(old == correct_answer)
+        delta[1] += int(new is not None) - int(old is not None)
+
+    deltas = [
+        (user_id, correct, answered)
+        for user_id, (correct, answered) in deltas.items()
+        if correct or answered
+    ]
+    if not deltas:
+        return
+
+    params = {}
+    for i, (user_id, correct, answered) in enumerate(deltas):
+        params.update({
+            f'user_id_{i}': user_id,
+            f'correct_{i}': correct,
+            f'answered_{i}': answered,
+        })
+
+    def by_user(name):
+        cases = ' '.join(
+            f'WHEN :user_id_{i} THEN :{name}_{i}' for i in range(len(deltas)))
+        return f'CASE user_id {cases} END'
+
+    update_scores(
+        ', '.join(f':user_id_{i}' for i in range(len(deltas))), params,
+        by_user('correct'), by_user('answered'))
+
+
+def update_scores_for_answer(question_id, old, new):
+    """Updates the score of every user who responded to a question after its
+    correct answer changed from `old` to `new`.
+
+    This is done with a few statements no matter how many users responded,
+    and isn't committed.
+    """
+    if old == new:
+        return
+
+    # Each user's own response to the question
+    answer = (
+        '(SELECT response FROM response '
+        'WHERE response.user_id = user_score.user_id '
+        'AND response.question_id = :question_id)')
+    update_scores(
+        'SELECT user_id FROM response '
+        'WHERE question_id = :question_id AND response IS NOT NULL',
+        {
+            'question_id': question_id,
+            'old': old,
+            'new': new,
+            'answered': int(new is not None) - int(old is not None),
+        },
+        f'{matches(answer, "new")} - {matches(answer, "old")}',
+        ':answered')
+
+
+def delete_user_score(user_id):
+    """Deletes a user's score, for deleting the user. This isn't committed.
+    """
+    deleted = db.session.execute(
+        text(
+            'DELETE FROM user_score WHERE user_id = :user_id '
+            'RETURNING correct_count'),
+        {'user_id': user_id})
+    update_counts([(correct_count, None) for correct_count, in deleted])
+
+
+def user_rank(correct_count):
+    """Gets the rank of a score. Users with the same score share a rank.
+
+    This adds up the numbers of users with each score above it, so it reads
+    at most one row for each higher score (of which there are no more than
+    there are questions) instead of one for each user ranked higher.
+    """
+    above = db.session \
+        .query(func.coalesce(func.sum(UserScoreCount.user_count), 0)) \
+        .filter(UserScoreCount.correct_count > correct_count) \
+        .scalar()
+    return above + 1
+
+
+def query_user_score(user_id):
+    """Gets a user's score and rank, as for a leaderboard entry.
+    """
+    score = UserScore.query.get(user_id)
+    if score is None:
+        # Not added to the session; users without any responses have no score
+        score = UserScore(user_id=user_id, correct_count=0, answered_count=0)
+
+    data = user_score_schema.dump(score)
+    data['rank'] = user_rank(score.correct_count)
+    return data
+
+
+@class_route('/leaderboard', 'leaderboard')
+class Leaderboard(MethodView):
+    """Users with the most correct responses.
+    """
+
+    def get(self):
+        args = leaderboard_args_schema.load(request.args)
+        # Read straight from the index
+        scores = UserScore.query \
+            .order_by(UserScore.correct_count.desc(), UserScore.user_id) \
+            .limit(args['limit']) \
+            .all()
+
+        data = []
+        for i, score in enumerate(scores):
+            entry = user_score_schema.dump(score)
+            if i > 0 and score.correct_count == scores[i - 1].correct_count:
+                entry['rank'] = data[-1]['rank']
+            else:
+                # Everyone above is on the list
+                entry['rank'] = i + 1
+            entry['links'] = {
+                'user': url_for(
+                    '.user_detail', id=score.user_id, _external=True),
+            }
+            data.append(entry)
+
+        return {
+            'data': data,
+            'links': {
+                'self': url_for(
+                    '.leaderboard', limit=args['limit'], _external=True),
+            },
+        }
+
+
+@api.cli.command('rebuild-scores')
+@click.option(
+    '--check', is_flag=True,
+    help="Only report users with wrong scores without fixing them.")
+def rebuild_scores(check):
+    """Recompute user scores from the response table."""
+    counts = ('correct_count', 'answered_count')
+    # Start every user at zero so that users with no responses are fixed too
+    expected = {
+        id: dict.fromkeys(counts, 0)
+        for id, in db.session.query(User.id)
+    }
+
+    rows = db.session \
+        .query(
+            Response.user_id,
+            func.sum(case(
+                [(Response.response == Question.correct_answer, 1)],
+                else_=0)),
+            func.count()) \
+        .join(Question, Question.id == Response.question_id) \
+        .filter(Response.response.isnot(None)) \
+        .filter(Question.correct_answer.isnot(None)) \
+        .group_by(Response.user_id)
+    for user_id, correct_count, answered_count in rows:
+        if user_id in expected:
+            expected[user_id] = {
+                'correct_count': correct_count,
+                'answered_count': answered_count,
+            }
+
+    current = {s.user_id: s for s in UserScore.query}
+
+    wrong = 0
+    for user_id, values in expected.items():
+        score = current.get(user_id)
+        if score is not None and all(
+                getattr(score, k) == v for k, v in values.items()):
+            continue
+        if score is None and not any(values.values()):
+            # Missing scores are treated as zero
+            continue
+
+        wrong += 1
+        click.echo(f"User {user_id}: expected {values}")
+        if not check:
+            if score is None:
+                db.session.add(UserScore(user_id=user_id, **values))
+            else:
+                for k, v in values.items():
+                    setattr(score, k, v)
+
+    if not check:
+        db.session.flush()
+
+    # Compared with the scores as they are (or were fixed to be) above
+    expected_counts = dict(
+        db.session
+        .query(UserScore.correct_count, func.count())
+        .group_by(UserScore.correct_count))
+    counts = {c.correct_count: c for c in UserScoreCount.query}
+
+    wrong_counts = 0
+    for correct_count in expected_counts.keys() | counts.keys():
+        user_count = expected_counts.get(correct_count, 0)
+        count = counts.get(correct_count)
+        if (count.user_count if count is not None else 0) == user_count:
+            continue
+
+        wrong_counts += 1
+        click.echo(f"Score {correct_count}: expected {user_count} users")
+        if not check:
+            if count is None:
+                db.session.add(UserScoreCount(
+                    correct_count=correct_count, user_count=user_count))
+            else:
+                count.user_count = user_count
+
+    if not check:
+        db.session.commit()
+
+    click.echo(f"{wrong} of {len(expected)} users had wrong scores")
+    click.echo(
+        f"{wrong_counts} of {len(expected_counts)} scores had wrong user "
+        "counts")
@@ -0,0 +1,346 @@
+import json
+import os
+
+import click
+
+from flask import current_app, request, url_for
+from flask.views import MethodView
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import contains_eager
+
+from prophet import api, class_route, db
+from prophet.live import Broadcaster
+from prophet.models import Question, QuestionStats, Response
+from prophet.resources import question as question_resource
+from prophet.schemas import question_stats_schema, question_stats_list_schema
+
+# Maximum number of questions in one bulk stats request
+MAX_STATS_IDS = 100
+
+# Seconds between comments sent on idle live streams, which keep proxies from
+# closing them and detect clients which went away
+LIVE_HEARTBEAT = float(os.environ.get('LIVE_HEARTBEAT', 15))
+
+# Responses read at a time when removing a user's responses from the tallies
+REMOVE_CHUNK_SIZE = 1000
+
+COUNTERS = (
+    'true_count',
+    'false_count',
+    'skip_count',
+    'view_time_total',
+    'view_time_count',
+)
+
+
+def view_time_micros(view_time):
+    """Converts a `Response.view_time` to a number of microseconds.
+    """
+    if view_time is None:
+        return 0
+    return (((view_time.hour * 60 + view_time.minute) * 60
+             + view_time.second) * 1000000 + view_time.microsecond)
+
+
+def response_counts(answer, view_time):
+    """Gets how much a single response adds to each of the counters.
+    """
+    return {
+        'true_count': int(answer is True),
+        'false_count': int(answer is False),
+        'skip_count': int(answer is None),
+        'view_time_total': view_time_micros(view_time),
+        'view_time_count': int(view_time is not None),
+    }
+
+
+def stats_delta(old=None, new=None):
+    """Gets how much each counter changes for a created or changed response.
+
+    `old` and `new` are `(response, view_time)` tuples for the response before
+    and after the change, or None if there was no response before.
+    """
+    delta = dict.fromkeys(COUNTERS, 0)
+    if old is not None:
+        for k, v in response_counts(*old).items():
+            delta[k] -= v
+    if new is not None:
+        for k, v in response_counts(*new).items():
+            delta[k] += v
+    return delta
+
+
+def apply_stats_delta(question_id, delta):
+    """Adds a `stats_delta()` (or the sum of several) to a question's tallies.
+
+    The update is done in SQL (`count = count + delta`) so that concurrent
+    requests don't overwrite each other, and it isn't committed so that it
+    ends up in the same transaction as the responses themselves.
+    """
+    delta = {k: v for k, v in delta.items() if v != 0}
+    if not delta:
+        return
+
+    updated = QuestionStats.query \
+        .filter_by(question_id=question_id) \
+        .update(
+            {
+                getattr(QuestionStats, k): getattr(QuestionStats, k) + v
+                for k, v in delta.items()
+            },
+            synchronize_session=False)
+    if updated == 0:
+        # Only happens for questions created before the tallies existed
+        # which haven't been rebuilt yet
+        db.session.add(QuestionStats(question_id=question_id, **delta))
+
+
+def apply_stats_deltas(deltas):
+    """Adds the deltas of many questions (a mapping from question ID to the
+    sum of their `stats_delta()`s) to their tallies with a single statement.
+
+    Like `apply_stats_delta()`, the update is done in SQL and isn't committed.
+    Tallies which don't exist yet are created.
+    """
+    deltas = [
+        (question_id, delta) for question_id, delta in deltas.items()
+        if any(delta.values())
+    ]
+    if not deltas:
+        return
+
+    values = []
+    params = {}
+    for i, (question_id, delta) in enumerate(deltas):
+        values.append(
+            f'(:question_id_{i}, '
+            + ', '.join(f':{k}_{i}' for k in COUNTERS) + ')')
+        params[f'question_id_{i}'] = question_id
+        params.update({f'{k}_{i}': delta[k] for k in COUNTERS})
+
+    assignments = ', '.join(
+        f'{k} = question_stats.{k} + excluded.{k}' for k in COUNTERS)
+    db.session.execute(text(f"""
+        INSERT INTO question_stats (question_id, {', '.join(COUNTERS)})
+        VALUES {', '.join(values)}
+        ON CONFLICT (question_id) DO UPDATE SET {assignments}
+    """), params)
+
+
+def remove_user_stats(user_id):
+    """Subtracts a user's responses from the tallies of the questions they
+    responded to, before the responses are deleted.
+
+    A user has at most one response per question. The responses are read in
+    chunks of `REMOVE_CHUNK_SIZE` in question order (from the primary key),
+    and each chunk's tallies are updated with one executemany UPDATE, so
+    memory doesn't grow with the number of responses. Like
+    `apply_stats_delta()`, this isn't committed.
+    """
+    table = QuestionStats.__table__
+    update = table.update() \
+        .where(table.c.question_id == bindparam('b_question_id')) \
+        .values({k: table.c[k] + bindparam(f'b_{k}') for k in COUNTERS})
+
+    last_question_id = None
+    while True:
+        query = db.session \
+            .query(
+                Response.question_id, Response.response, Response.view_time) \
+            .filter(Response.user_id == user_id)
+        if last_question_id is not None:
+            query = query.filter(Response.question_id > last_question_id)
+        responses = query \
+            .order_by(Response.question_id) \
+            .limit(REMOVE_CHUNK_SIZE) \
+            .all()
+        if not responses:
+            return
+
+        db.session.execute(update, [
+            dict(
+                {
+                    f'b_{k}': v
+                    for k, v in stats_delta(old=(answer, view_time)).items()
+                },
+                b_question_id=question_id)
+            for question_id, answer, view_time in responses
+        ])
+        if len(responses) < REMOVE_CHUNK_SIZE:
+            return
+        last_question_id = responses[-1].question_id
+
+
+def update_question_stats(question_id, old=None, new=None):
+    """Updates the tallies of a question for a created or changed response
+    (see `stats_delta()` and `apply_stats_delta()`).
+    """
+    apply_stats_delta(question_id, stats_delta(old, new))
+
+
+def query_stats(question_ids):
+    """Gets the stats for a list of questions, along with the questions
+    themselves (which are needed for the correct answer ratio).
+    """
+    return QuestionStats.query \
+        .join(QuestionStats.question) \
+        .options(contains_eager(QuestionStats.question)) \
+        .filter(QuestionStats.question_id.in_(question_ids)) \
+        .all()
+
+
+@class_route('/questions/<question_id>/stats', 'question_stats')
+class QuestionStatsDetail(MethodView):
+    def get(self, question_id):
+        q = question_resource.query_question(question_id)
+        stats = q.stats
+        if stats is None:
+            # Not set as `q.stats` so that it doesn't get saved by a GET
+            stats = QuestionStats(
+                question_id=q.id, **dict.fromkeys(COUNTERS, 0))
+
+        return {
+            'data': question_stats_schema.dump(stats),
+            'links': {
+                'self': url_for(
+                    '.question_stats', question_id=q.id, _external=True),
+                'question': url_for(
+                    '.question_detail', id=q.id, _external=True),
+            },
+        }
+
+
+@class_route('/questions/stats', 'question_stats_list')
+class QuestionStatsList(MethodView):
+    def get(self):
+        ids = question_resource.parse_ids(
+            request.args.get('ids'), MAX_STATS_IDS)
+        stats = {s.question_id: s for s in query_stats(ids)}
+
+        return {
+            # Keep the requested order and leave out unknown questions
+            'data': question_stats_list_schema.dump(
+                [stats[id] for id in dict.fromkeys(ids) if id in stats]),
+            'links': {
+                'self': url_for(
+                    '.question_stats_list',
+                    ids=request.args.get('ids'),
+                    _external=True),
+            },
+        }
+
+
+def load_live_stats(question_ids):
+    """Gets the serialized stats of the questions which still exist.
+    """
+    stats = {
+        s.question_id: question_stats_schema.dump(s)
+        for s in query_stats(question_ids)
+    }
+    missing = [id for id in question_ids if id not in stats]
+    if missing:
+        # Questions from before the tallies existed
+        for id, in db.session.query(Question.id).filter(Question.id.in_(missing)):
+            stats[id] = question_stats_schema.dump(
+                QuestionStats(question_id=id, **dict.fromkeys(COUNTERS, 0)))
+
+    return stats
+
+
+# Stats of the questions with open live streams, keyed by question ID
+live_stats = Broadcaster(load_live_stats)
+
+
+def live_stats_events(app, question_id):
+    """Yields Server-Sent Events with the stats of a question whenever they
+    change, until the question is deleted or the client goes away.
+    """
+    live_stats.subscribe(app, question_id)
+    try:
+        # Reconnect after a few seconds if the connection is lost
+        yield 'retry: 3000\n\n'
+
+        version = None
+        while True:
+            entry = live_stats.wait(question_id, version, LIVE_HEARTBEAT)
+            if entry is None or entry[0] == version:
+                yield ': keepalive\n\n'
+                continue
+
+            version, data = entry
+            if data is None:
+                yield 'event: deleted\ndata: {}\n\n'
+                return
+            yield f'event: stats\ndata: {json.dumps(data)}\n\n'
+    finally:
+        live_stats.unsubscribe(question_id)
+
+
+@class_route('/questions/<question_id>/live', 'question_live')
+class QuestionStatsLive(MethodView):
+    """Streams the stats of a question as Server-Sent Events.
+
+    Every connection stays open, so this should be served by a cooperative
+    server (see `prophet.live`).
+    """
+
+    def get(self, question_id):
+        q = question_resource.query_question(question_id)
+        return current_app.response_class(
+            live_stats_events(current_app._get_current_object(), q.id),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                # Don't let nginx buffer the events
+                'X-Accel-Buffering': 'no',
+            })
+
+
+@api.cli.command('rebuild-stats')
+@click.option(
+    '--check', is_flag=True,
+    help="Only report questions with wrong tallies without fixing them.")
+def rebuild_stats(check):
+    """Recompute question tallies from the response table."""
+    # Start every question at zero so that questions with no responses are
+    # fixed too
+    expected = {
+        id: dict.fromkeys(COUNTERS, 0)
+        for id, in db.session.query(Question.id)
+    }
+
+    responses = db.session \
+        .query(Response.question_id, Response.response, Response.view_time) \
+        .yield_per(1000)
+    for question_id, answer, view_time in responses:
+        counts = expected.get(question_id)
+        # Skip responses left over from deleted questions
+        if counts is None:
+            continue
+
+        for k, v in response_counts(answer, view_time).items():
+            counts[k] += v
+
+    current = {s.question_id: s for s in QuestionStats.query}
+
+    wrong = 0
+    for question_id, counts in expected.items():
+        stats = current.get(question_id)
+        if stats is not None and all(
+                getattr(stats, k) == v for k, v in counts.items()):
+            continue
+
+        wrong += 1
+        click.echo(f"Question {question_id}: expected {counts}")
+        if not check:
+            if stats is None:
+                db.session.add(QuestionStats(question_id=question_id, **counts))
+            else:
+                for k, v in counts.items():
+                    setattr(stats, k, v)
+
+    if not check:
+        db.session.commit()
+
+    click.echo(f"{wrong} of {len(expected)} questions had wrong tallies")
@@ -1,12 +1,41 @@
+import os
+import threading
+
+from datetime import datetime
 from http import HTTPStatus
 
 from flask import g, request, url_for
 from flask.views import MethodView
+from sqlalchemy.exc import IntegrityError
+
+from prophet import api, class_route, db
+from prophet.auth import AuthError, get_msal_app, requires_auth
+from prophet.cache import LocalCache
+from prophet.metrics import registry
+from prophet.models import User, Question, Response
+from prophet.pagination import paginate
+from prophet.resources import (
+    question as question_resource,
+    score as score_resource,
+    stats as stats_resource,
+)
+from prophet.routing import use_primary
+from prophet.schemas import (
+    UserSchema,
+    user_schema,
+    users_schema,
+    responses_schema,
+    user_question_args_schema,
+    user_create_args_schema,
+)
+from prophet.serializers import (
+    question_serializer, requested_fields, select_fields, user_serializer)
 
-from prophet import app, class_route, db
-from prophet.auth import msal_app, requires_auth
-from prophet.models import User, Response
-from prophet.schemas import UserSchema, user_schema, users_schema, responses_schema
+USER_ID_CACHE_SIZE = int(os.environ.get('USER_ID_CACHE_SIZE', 10000))
+# Seconds before a user ID is looked up again. Deleting a user only removes its
+# entry in the worker which handled the request, but other workers check the
+# subject identifier whenever they use a cached ID.
+USER_ID_CACHE_TTL = float(os.environ.get('USER_ID_CACHE_TTL', 300))
 
 
 class UserNotFound(Exception):
@@ -14,7 +43,7 @@ class UserNotFound(Exception):
         self.id = id
 
 
-@app.errorhandler(UserNotFound)
+@api.app_errorhandler(UserNotFound)
 def handle_user_not_found(e):
     return {
         'error': {
@@ -24,20 +53,121 @@ def handle_user_not_found(e):
     }, HTTPStatus.NOT_FOUND
 
 
+class UserIdCache:
+    """Bounded mapping from subject identifiers to user IDs, so that "me" can
+    be resolved by primary key (see `query_current_user()`).
+
+    A lookup which started before a user was deleted could otherwise put the
+    deleted ID back after `invalidate()` removed it. To prevent this, callers
+    get a `token()` before querying the database and pass it to `fill()`,
+    which ignores the ID if anything was invalidated in the meantime.
+    """
+
+    def __init__(self, max_size=USER_ID_CACHE_SIZE, ttl=USER_ID_CACHE_TTL):
+        self._cache = LocalCache(max_size, ttl)
+        self._lock = threading.Lock()
+        self._invalidations = 0
+
+    def get(self, sub):
+        return self._cache.get(sub)
+
+    def token(self):
+        return self._invalidations
+
+    def fill(self, sub, id, token):
+        with self._lock:
+            if token == self._invalidations:
+                self._cache.set(sub, id)
+
+    def invalidate(self, sub):
+        with self._lock:
+            self._invalidations += 1
+            self._cache.delete(sub)
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+user_id_cache = UserIdCache()
+registry.register_cache('user_ids', user_id_cache)
+
+
 def create_user(sub, commit=True):
     """Creates a new user entry in the database from the subject identifier.
 
     By default, a database transaction will be committed immediately. If the
     session will be committed later anyway, `commit` can be set to False.
+
+    When committing, a user created by a concurrent request for the same
+    subject identifier (such as two requests made right after signing in for
+    the first time) is returned instead of failing.
     """
+    token = user_id_cache.token()
     user = User(subject_identifier=sub)
     db.session.add(user)
     if commit:
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            user = User.query.filter_by(subject_identifier=sub).first()
+            if user is None:
+                raise
+        user_id_cache.fill(sub, user.id, token)
 
     return user
 
 
+def query_current_user(query, create=False):
+    """Runs `query` (of `User` or some of its columns) for the signed in user,
+    and returns the row, or the new user if it had to be created.
+
+    The cached ID (see `UserIdCache`) is only used together with the subject
+    identifier, in the same query, since another worker may have deleted the
+    user. The entry is dropped if it doesn't match.
+
+    If `create` is True, the user entry will be created if it does not already
+    exist.
+    """
+    if not hasattr(g, 'current_user'):
+        raise AuthError("User must be logged in to access `/users/me`")
+
+    sub = g.current_user['sub']
+    id = user_id_cache.get(sub)
+    if id is not None:
+        row = query \
+            .filter(User.id == id, User.subject_identifier == sub) \
+            .first()
+        if row is not None:
+            return row
+
+        # Deleted by another worker, or not on the replica yet
+        user_id_cache.invalidate(sub)
+        use_primary()
+
+    token = user_id_cache.token()
+    row = query.filter(User.subject_identifier == sub).first()
+    if row is None:
+        if create:
+            return create_user(sub)
+        raise UserNotFound('me')
+
+    user_id_cache.fill(sub, row.id, token)
+    return row
+
+
+def current_user_id(create=False):
+    """Gets the ID of the signed in user, which only needs a lookup by primary
+    key once the user has been seen (see `query_current_user()`).
+    """
+    return query_current_user(db.session.query(User.id), create).id
+
+
 def query_user(id, create=False):
     """Gets a user from the database, creating it if necessary.
     Accepts the user ID (local to this database) or the string "me" to indicate
@@ -52,18 +182,7 @@ def query_user(id, create=False):
     """
     # TODO Accept user IDs, SUBs, or both?
     if id == 'me':
-        if not hasattr(g, 'current_user'):
-            raise AuthError("User must be logged in to access `/users/me`")
-
-        sub = g.current_user.sub
-        user = User.query.filter_by(subject_identifier=sub).first()
-        if user is None:
-            if create:
-                return create_user(sub)
-            else:
-                raise UserNotFound(id)
-
-        return user
+        return query_current_user(User.query, create)
     else:
         user = User.query.get(id)
         if user is None:
@@ -71,6 +190,32 @@ def query_user(id, create=False):
         return user
 
 
+def resolve_user_id(id):
+    """Gets the numeric ID of a user from a user ID in a URL, which may be
+    "me". This doesn't check that numeric IDs exist, but "me" is always
+    checked against the signed in user's subject identifier.
+    """
+    if id == 'me':
+        return current_user_id()
+
+    try:
+        return int(id)
+    except ValueError:
+        raise UserNotFound(id)
+
+
+def query_user_id(id):
+    """Like `resolve_user_id()`, but also checks that numeric IDs exist.
+    """
+    if id == 'me':
+        return current_user_id()
+
+    row = db.session.query(User.id).filter_by(id=id).first()
+    if row is None:
+        raise UserNotFound(id)
+    return row.id
+
+
 def user_with_links(user):
     # TODO Should this use "me" in URLS when possible, or always use explicit
     # IDs so that the links will work for others (probably not an actual use
@@ -80,15 +225,15 @@ def user_with_links(user):
     #
     # TODO This complains about the scope being invalid. Using on-behalf-of
     # works fine, though
-    # auth_result = msal_app.acquire_token_for_client(["User.Read.All"])
-    # auth_result = msal_app.acquire_token_on_behalf_of(
+    # auth_result = get_msal_app().acquire_token_for_client(["User.Read.All"])
+    # auth_result = get_msal_app().acquire_token_on_behalf_of(
     #     g.user_access_token, ["User.ReadBasic.All"])
     return {
         'data': user_schema.dump(user),
         'links': {
-            'self': url_for('user_detail', id=user.id, _external=True),
+            'self': url_for('.user_detail', id=user.id, _external=True),
             'responses': url_for(
-                'user_responses', user_id=user.id, _external=True),
+                '.user_responses', user_id=user.id, _external=True),
         },
     }
 
@@ -96,15 +241,31 @@ def user_with_links(user):
 @class_route('/users/<id>', 'user_detail')
 class UserDetail(MethodView):
     def get(self, id):
+        names = requested_fields(user_serializer.names + ('score',))
         user = query_user(id, True)
-        return user_with_links(user)
+        result = user_with_links(user)
+        # Skip the score's queries unless it's needed
+        if names is None or 'score' in names:
+            result['data']['score'] = score_resource.query_user_score(user.id)
+        result['data'] = select_fields(result['data'], names)
+        return result
 
     def delete(self, id):
         # Don't create the user since it will be deleted immediately
         user = query_user(id)
-        # TODO Delete the user's responses? Does this happend automatically?
+        sub = user.subject_identifier
+        # The user's responses are deleted too, with single statements instead
+        # of loading them into the session, and removed from the tallies first
+        stats_resource.remove_user_stats(user.id)
+        Response.query \
+            .filter_by(user_id=user.id) \
+            .delete(synchronize_session=False)
+        score_resource.delete_user_score(user.id)
         db.session.delete(user)
         db.session.commit()
+        # Only after committing, so that a concurrent lookup can't cache the ID
+        # again (see `UserIdCache`)
+        user_id_cache.invalidate(sub)
         return {
             'data': {}
         }
@@ -113,21 +274,89 @@ class UserDetail(MethodView):
 @class_route('/users', 'user_list')
 class UserList(MethodView):
     def get(self):
+        if 'ids' in request.args:
+            return self.get_many()
+
+        serializer = user_serializer.requested()
+        users, next_url = paginate(
+            serializer.query(User.id), (User.id,), '.user_list')
+
+        links = {
+            'self': url_for('.user_list', _external=True),
+        }
+        if next_url is not None:
+            links['next'] = next_url
+
+        return {
+            'data': serializer.dump(users),
+            'links': links,
+        }
+
+    def get_many(self):
+        """Gets the users with the IDs in `ids`, in the same order, and lists
+        the ones which don't exist in `missing`.
+        """
+        ids = list(dict.fromkeys(question_resource.parse_ids(
+            request.args.get('ids'), question_resource.MAX_MULTI_GET_IDS)))
+        serializer = user_serializer.requested()
+        users = {
+            row.id: serializer.dump_row(row)
+            for row in serializer.query(User.id).filter(User.id.in_(ids))
+        }
+
         return {
-            'data': users_schema.dump(User.query.all()),
+            'data': [users[id] for id in ids if id in users],
+            'missing': [id for id in ids if id not in users],
             'links': {
-                'self': url_for('user_list', _external=True),
+                'self': url_for(
+                    '.user_list', ids=request.args.get('ids'), _external=True),
             },
         }
 
     def post(self):
-        data = user_create_args.load(request.get_json())
+        data = user_create_args_schema.load(request.get_json())
         user = create_user(data['subject_identifier'])
         return user_with_links(user)
 
 
-# @class_route('/users/<id>/questions', 'user_question_list')
-# class UserQuestions(MethodView):
-#     """Route for a user's unanswered questions."""
+@class_route('/users/<id>/questions', 'user_question_list')
+class UserQuestions(MethodView):
+    """Route for a user's active questions, optionally only the ones which the
+    user has or hasn't responded to.
+    """
 
-#     def get(self, id):
+    def get(self, id):
+        args = user_question_args_schema.load(request.args)
+        serializer = question_serializer.requested()
+        id = query_user_id(id)
+
+        query = serializer.query(Question.id) \
+            .filter(question_resource.is_active(datetime.utcnow()))
+        if 'unanswered' in args:
+            # Checked for each question with a primary key lookup, so this
+            # doesn't get slower as the user (or anyone else) responds to more
+            # questions
+            answered = db.session.query(Response.question_id) \
+                .filter(Response.user_id == id) \
+                .filter(Response.question_id == Question.id) \
+                .exists()
+            query = query.filter(~answered if args['unanswered'] else answered)
+
+        url_args = {}
+        if 'unanswered' in args:
+            url_args['unanswered'] = str(args['unanswered']).lower()
+        questions, next_url = paginate(
+            query, (Question.id,), '.user_question_list', id=id, **url_args)
+
+        links = {
+            'self': url_for(
+                '.user_question_list', id=id, _external=True, **url_args),
+            'user': url_for('.user_detail', id=id, _external=True),
+        }
+        if next_url is not None:
+            links['next'] = next_url
+
+        return {
+            'data': serializer.dump(questions),
+            'links': links,
+        }
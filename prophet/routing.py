@@ -0,0 +1,127 @@
+"""Routing of reads to database replicas.
+
+Replicas are extra binds (see `SQLALCHEMY_BINDS`) whose keys are listed in the
+`DATABASE_REPLICAS` setting. During `GET`, `HEAD` and `OPTIONS` requests, plain
+SELECT statements go to one of the replicas, picked once per request.
+Everything else goes to the primary database, and so does every statement
+after the first write of a request, so that a request always reads what it
+wrote.
+
+Replicas lag behind the primary, so a client which just wrote something might
+not see it in its next request. With `DATABASE_STICKINESS` set to a number of
+seconds, a request which wrote to the database sets a cookie which sends that
+client's reads to the primary for that long.
+
+Engine options for each bind (including the primary, with the key None) can be
+set in `SQLALCHEMY_BIND_ENGINE_OPTIONS`, which override
+`SQLALCHEMY_ENGINE_OPTIONS`. For example, replicas can have a bigger pool and
+check connections with `pool_pre_ping` before using them.
+"""
+import random
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, _EngineConnector
+from sqlalchemy import orm
+from sqlalchemy.sql.selectable import SelectBase
+
+READ_ONLY_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+# Holds the time until which the client reads from the primary
+STICKINESS_COOKIE = 'read_primary_until'
+
+
+def is_read(clause):
+    """Whether a statement only reads, so that it can go to a replica.
+    """
+    return isinstance(clause, SelectBase) and \
+        getattr(clause, '_for_update_arg', None) is None
+
+
+def replica_bind():
+    """Gets the replica bind key to read from in this request, or None to use
+    the primary.
+    """
+    if not has_request_context():
+        return None
+    if 'database_bind' not in g:
+        g.database_bind = None
+        replicas = current_app.config['DATABASE_REPLICAS']
+        if replicas and request.method in READ_ONLY_METHODS and \
+                not is_sticky():
+            g.database_bind = random.choice(replicas)
+    return g.database_bind
+
+
+def is_sticky():
+    try:
+        until = float(request.cookies.get(STICKINESS_COOKIE, 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+def use_primary():
+    """Sends the rest of the current request's statements to the primary.
+    """
+    if has_request_context():
+        g.database_bind = None
+
+
+def record_write():
+    if has_request_context():
+        g.database_bind = None
+        g.database_wrote = True
+
+
+class RoutingSession(SignallingSession):
+    """Session which sends reads to a replica when `replica_bind()` picks one.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or (clause is not None and not is_read(clause)):
+            record_write()
+        elif clause is not None:
+            bind = replica_bind()
+            if bind is not None:
+                return self.db.get_engine(self.app, bind=bind)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingEngineConnector(_EngineConnector):
+    def get_options(self, sa_url, echo):
+        options = super().get_options(sa_url, echo)
+        bind_options = self._app.config['SQLALCHEMY_BIND_ENGINE_OPTIONS']
+        options.update(bind_options.get(self._bind, {}))
+        return options
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """`SQLAlchemy` with read replicas and engine options for each bind.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault('DATABASE_REPLICAS', [])
+        app.config.setdefault('DATABASE_STICKINESS', 0)
+        app.config.setdefault('SQLALCHEMY_BIND_ENGINE_OPTIONS', {})
+        super().init_app(app)
+
+        @app.after_request
+        def set_stickiness_cookie(response):
+            stickiness = app.config['DATABASE_STICKINESS']
+            if stickiness and app.config['DATABASE_REPLICAS'] and \
+                    g.get('database_wrote'):
+                response.set_cookie(
+                    STICKINESS_COOKIE, str(time.time() + stickiness),
+                    max_age=stickiness, httponly=True)
+            return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def make_connector(self, app=None, bind=None):
+        return RoutingEngineConnector(self, self.get_app(app), bind)
@@ -1,8 +1,22 @@
+from datetime import datetime, timedelta
+
+from marshmallow import EXCLUDE, fields, validate
+
 from prophet import ma
-from prophet.models import User, Question, Response
+from prophet.metrics import timed
+from prophet.models import User, Question, Response, QuestionStats, UserScore
+
+
+class TimedDumpMixin:
+    """Counts the time spent dumping towards the request's serialization time.
+    """
 
+    def dump(self, obj, *, many=None):
+        with timed('dump'):
+            return super().dump(obj, many=many)
 
-class UserSchema(ma.SQLAlchemySchema):
+
+class UserSchema(TimedDumpMixin, ma.SQLAlchemySchema):
     class Meta:
         model = User
         load_instance = True
@@ -15,7 +29,7 @@ user_schema = UserSchema()
 users_schema = UserSchema(many=True)
 
 
-class QuestionSchema(ma.SQLAlchemySchema):
+class QuestionSchema(TimedDumpMixin, ma.SQLAlchemySchema):
     class Meta:
         model = Question
         load_instance = True
@@ -33,7 +47,7 @@ question_schema = QuestionSchema()
 questions_schema = QuestionSchema(many=True)
 
 
-class ResponseSchema(ma.SQLAlchemySchema):
+class ResponseSchema(TimedDumpMixin, ma.SQLAlchemySchema):
     class Meta:
         model = Response
         load_instance = True
@@ -47,3 +61,128 @@ class ResponseSchema(ma.SQLAlchemySchema):
 
 response_schema = ResponseSchema()
 responses_schema = ResponseSchema(many=True)
+
+
+class ResponseDataSchema(ma.Schema):
+    """Fields of a response which are set by the user (the IDs come from the
+    URL).
+    """
+    class Meta:
+        unknown = EXCLUDE
+
+    response = fields.Boolean(allow_none=True)
+    view_time = fields.Time(allow_none=True)
+
+
+response_data_schema = ResponseDataSchema()
+
+
+class ResponseBatchItemSchema(ResponseDataSchema):
+    """A single response in a batch submission (the user ID comes from the
+    URL).
+    """
+    question_id = fields.Integer(required=True)
+    response = fields.Boolean(required=True, allow_none=True)
+
+
+response_batch_item_schema = ResponseBatchItemSchema()
+
+
+class ResponseExportArgsSchema(ma.Schema):
+    """Query parameters for exporting responses.
+    """
+    format = fields.String(
+        missing='ndjson', validate=validate.OneOf(('ndjson', 'csv')))
+    question_id = fields.Integer()
+    user_id = fields.Integer()
+    # Range of `answered_at`, inclusive at the start and exclusive at the end
+    answered_since = fields.DateTime()
+    answered_before = fields.DateTime()
+    # `<question_id>,<user_id>` of the last response which was received, to
+    # resume an interrupted export
+    after = fields.String(validate=validate.Regexp(r'^\d+,\d+$'))
+
+
+response_export_args_schema = ResponseExportArgsSchema()
+
+
+class UserQuestionArgsSchema(ma.Schema):
+    """Query parameters for listing a user's questions.
+    """
+    class Meta:
+        # Pagination parameters are handled separately
+        unknown = EXCLUDE
+
+    # Only questions the user has (false) or hasn't (true) responded to
+    unanswered = fields.Boolean()
+
+
+user_question_args_schema = UserQuestionArgsSchema()
+
+
+class QuestionStatsSchema(TimedDumpMixin, ma.SQLAlchemySchema):
+    class Meta:
+        model = QuestionStats
+
+    question_id = ma.auto_field(dump_only=True)
+    true_count = ma.auto_field(dump_only=True)
+    false_count = ma.auto_field(dump_only=True)
+    skip_count = ma.auto_field(dump_only=True)
+    correct_ratio = fields.Method('get_correct_ratio')
+    mean_view_time = fields.Method('get_mean_view_time')
+
+    def get_correct_ratio(self, stats):
+        """Fraction of answers (not counting skips) which were correct, or
+        None if the question has no correct answer or no answers.
+        """
+        answered = stats.true_count + stats.false_count
+        if answered == 0:
+            return None
+
+        correct_answer = stats.question.correct_answer
+        if correct_answer is None:
+            return None
+
+        correct = stats.true_count if correct_answer else stats.false_count
+        return correct / answered
+
+    def get_mean_view_time(self, stats):
+        if stats.view_time_count == 0:
+            return None
+
+        mean = timedelta(
+            microseconds=stats.view_time_total // stats.view_time_count)
+        return (datetime.min + mean).time().isoformat()
+
+
+question_stats_schema = QuestionStatsSchema()
+question_stats_list_schema = QuestionStatsSchema(many=True)
+
+
+class UserScoreSchema(TimedDumpMixin, ma.SQLAlchemySchema):
+    class Meta:
+        model = UserScore
+
+    user_id = ma.auto_field(dump_only=True)
+    correct_count = ma.auto_field(dump_only=True)
+    answered_count = ma.auto_field(dump_only=True)
+
+
+user_score_schema = UserScoreSchema()
+
+
+class LeaderboardArgsSchema(ma.Schema):
+    """Query parameters for the leaderboard.
+    """
+    limit = fields.Integer(missing=10, validate=validate.Range(1, 100))
+
+
+leaderboard_args_schema = LeaderboardArgsSchema()
+
+
+class UserCreateArgsSchema(ma.Schema):
+    subject_identifier = fields.String(
+        required=True, validate=validate.Length(min=1))
+
+
+user_create_args_schema = UserCreateArgsSchema()
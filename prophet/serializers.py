@@ -0,0 +1,151 @@
+from flask import request
+from marshmallow import ValidationError, fields
+
+from prophet import db
+from prophet.metrics import timed
+from prophet.schemas import question_schema, response_schema, user_schema
+
+# Fields whose values are returned as-is by marshmallow when they already have
+# the right type, which is always the case for values read from the matching
+# SQLAlchemy columns
+PASSTHROUGH_FIELDS = (fields.Integer, fields.Boolean, fields.String)
+
+
+def _field_function(field):
+    """Gets a function which serializes a non-null value the same way as
+    `field`, or None if the value can be used as-is.
+    """
+    if isinstance(field, PASSTHROUGH_FIELDS) and \
+            not getattr(field, 'as_string', False):
+        return None
+
+    if type(field) is fields.DateTime:
+        format_func = field.SERIALIZATION_FUNCS.get(
+            field.format or field.DEFAULT_FORMAT)
+        if format_func is not None:
+            return format_func
+
+    def serialize(value):
+        return field._serialize(value, None, None)
+
+    return serialize
+
+
+class Serializer:
+    """Fast serializer generated from a marshmallow schema.
+
+    Instead of hydrating ORM objects and walking the schema's fields for each
+    one, rows are read with a query of just the needed columns (`query()`)
+    and converted by a function compiled for the schema, which produces the
+    same output as `schema.dump()`.
+
+    Only fields which map directly to columns of the schema's model are
+    supported. `only` limits the output (and the query) to a subset of the
+    fields.
+    """
+
+    def __init__(self, schema, only=None):
+        self.schema = schema
+        model = schema.opts.model
+        # Keep the order the fields were declared in (`dump_fields` has no
+        # stable order), which is also used for CSV columns
+        dump_fields = [
+            (name, schema.dump_fields[name])
+            for name in schema.declared_fields
+            if name in schema.dump_fields and (only is None or name in only)
+        ]
+        self.names = tuple(name for name, _ in dump_fields)
+        self.columns = tuple(
+            getattr(model, field.attribute or name)
+            for name, field in dump_fields)
+
+        namespace = {}
+        variables = [f'v{i}' for i in range(len(self.names))]
+        items = []
+        for i, (_, field) in enumerate(dump_fields):
+            function = _field_function(field)
+            if function is None:
+                items.append(f'{self.names[i]!r}: v{i}')
+            else:
+                namespace[f'f{i}'] = function
+                items.append(
+                    f'{self.names[i]!r}: '
+                    f'None if v{i} is None else f{i}(v{i})')
+
+        # Rows may have extra columns at the end (see `query()`)
+        source = (
+            'def serialize(row):\n'
+            f'    {", ".join(variables)}, *_ = row\n'
+            f'    return {{{", ".join(items)}}}\n'
+        )
+        exec(source, namespace)
+        self.dump_row = namespace['serialize']
+
+        # Mapping from sets of field names to serializers for them
+        self._subsets = {}
+
+    def only(self, names):
+        """Gets a serializer for a subset of the fields. These are made once
+        for each set of fields.
+        """
+        names = frozenset(names)
+        if names == frozenset(self.names):
+            return self
+
+        serializer = self._subsets.get(names)
+        if serializer is None:
+            serializer = Serializer(self.schema, names)
+            self._subsets[names] = serializer
+        return serializer
+
+    def requested(self):
+        """Gets the serializer for the fields requested with the `fields`
+        query parameter (see `requested_fields()`).
+        """
+        names = requested_fields(self.names)
+        return self if names is None else self.only(names)
+
+    def query(self, *columns):
+        """Starts a query for the columns needed by the serializer, followed
+        by any of `columns` (such as the sort key for pagination) which aren't
+        already selected. Those aren't included in the output.
+        """
+        extra = [
+            c for c in columns
+            if not any(c is selected for selected in self.columns)
+        ]
+        return db.session.query(*self.columns, *extra)
+
+    def dump(self, rows):
+        dump_row = self.dump_row
+        with timed('dump'):
+            return [dump_row(row) for row in rows]
+
+
+def requested_fields(names):
+    """Gets the fields requested with the `fields` query parameter, which is
+    a comma-separated list of some of `names`, or None to include all of them.
+    """
+    value = request.args.get('fields')
+    if value is None:
+        return None
+
+    requested = [name for name in value.split(',') if name]
+    if not requested or any(name not in names for name in requested):
+        raise ValidationError(
+            f"Fields must be some of {', '.join(names)}", field_name='fields')
+    return requested
+
+
+def select_fields(data, names):
+    """Limits serialized data to the fields in `names`, or returns it as-is if
+    `names` is None.
+    """
+    if names is None:
+        return data
+    return {k: v for k, v in data.items() if k in names}
+
+
+user_serializer = Serializer(user_schema)
+question_serializer = Serializer(question_schema)
+response_serializer = Serializer(response_schema)
@@ -0,0 +1,192 @@
+"""Bounded in-process queue which saves changes in batches from a background
+thread (write-behind).
+
+Requests add changes with `put()` and return without waiting for the
+database. The writer thread calls the queue's `flush` function with up to
+`batch_size` changes at a time, either as soon as that many are waiting or
+every `interval` seconds. Changes stay visible through `get()` until they
+have been saved, so the process which accepted a change can read it back
+right away.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from http import HTTPStatus
+
+from prophet import api
+
+WRITE_BEHIND_MAX_SIZE = int(os.environ.get('WRITE_BEHIND_MAX_SIZE', 10000))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', 500))
+# Maximum number of seconds a change waits before being saved
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.05))
+# Seconds `put()` waits for room in a full queue before giving up
+WRITE_BEHIND_PUT_TIMEOUT = float(
+    os.environ.get('WRITE_BEHIND_PUT_TIMEOUT', 0.1))
+# Seconds to keep saving changes when the process exits
+WRITE_BEHIND_DRAIN_TIMEOUT = float(
+    os.environ.get('WRITE_BEHIND_DRAIN_TIMEOUT', 10))
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a change can't be queued because the writer is behind (or
+    the queue was closed).
+    """
+
+
+@api.app_errorhandler(QueueFull)
+def handle_queue_full(e):
+    return {
+        'error': {
+            'code': 'too_busy',
+            'description': "Too many changes are waiting to be saved",
+        },
+    }, HTTPStatus.SERVICE_UNAVAILABLE, {'Retry-After': '1'}
+
+
+class WriteBehindQueue:
+    """Changes waiting to be saved, keyed by what they change.
+
+    A change to a key which is already waiting is merged into it with
+    `merge(old, new)` and doesn't take up more room, so repeated changes to
+    the same row are only written once.
+
+    `flush(changes)` gets an ordered dict from keys to changes and must save
+    all of them (or log the ones which can't be saved). It runs in the writer
+    thread, within an application context of the application which queued the
+    first change.
+    """
+
+    def __init__(self, flush, merge=None,
+                 max_size=WRITE_BEHIND_MAX_SIZE,
+                 batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 interval=WRITE_BEHIND_INTERVAL,
+                 put_timeout=WRITE_BEHIND_PUT_TIMEOUT):
+        self.flush = flush
+        self.merge = merge
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self.put_timeout = put_timeout
+
+        # Mapping from key to (sequence number, change). Changes which are
+        # being saved stay here until they're committed.
+        self._pending = OrderedDict()
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._app = None
+        self._closed = False
+
+        self.flushes = 0
+        self.saved = 0
+        self.rejected = 0
+
+    def put(self, app, key, change):
+        """Queues a change, waiting up to `put_timeout` for room. Raises
+        `QueueFull` if there still isn't any.
+        """
+        with self._condition:
+            deadline = time.monotonic() + self.put_timeout
+            while not self._closed and key not in self._pending and \
+                    len(self._pending) >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            if self._closed or (key not in self._pending and
+                                len(self._pending) >= self.max_size):
+                self.rejected += 1
+                raise QueueFull()
+
+            entry = self._pending.get(key)
+            if entry is not None and self.merge is not None:
+                change = self.merge(entry[1], change)
+            self._sequence += 1
+            self._pending[key] = (self._sequence, change)
+
+            if self._thread is None:
+                self._start(app)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    def get(self, key):
+        """Gets the change waiting to be saved for a key, or None.
+        """
+        with self._condition:
+            entry = self._pending.get(key)
+        return entry[1] if entry is not None else None
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'flushes': self.flushes,
+                'saved': self.saved,
+                'rejected': self.rejected,
+            }
+
+    def _start(self, app):
+        # Started on first use rather than when the application is created, so
+        # that servers which fork workers get a thread in each one
+        self._app = app
+        self._thread = threading.Thread(
+            target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._condition.wait(self.interval)
+                if not self._pending:
+                    if self._closed:
+                        return
+                    continue
+
+                batch = OrderedDict()
+                for key, entry in self._pending.items():
+                    batch[key] = entry
+                    if len(batch) >= self.batch_size:
+                        break
+
+            saved = False
+            try:
+                with self._app.app_context():
+                    self.flush(
+                        OrderedDict((k, v) for k, (_, v) in batch.items()))
+                saved = True
+            except Exception:
+                logger.exception(
+                    "Failed to save %d queued changes", len(batch))
+
+            with self._condition:
+                for key, (sequence, _) in batch.items():
+                    # Keep changes which were queued again while saving
+                    if self._pending.get(key, (None,))[0] == sequence:
+                        del self._pending[key]
+                self.flushes += 1
+                if saved:
+                    self.saved += len(batch)
+                # Wake up requests waiting for room
+                self._condition.notify_all()
+
+    def close(self, timeout=WRITE_BEHIND_DRAIN_TIMEOUT):
+        """Stops accepting changes and waits for the queued ones to be saved.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error(
+                    "Exiting with %d queued changes not saved",
+                    len(self._pending))
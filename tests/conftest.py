@@ -0,0 +1,100 @@
+"""Shared fixtures for the test suite.
+
+Run from the root of the project with `python -m pytest`.
+
+The authentication settings are read when `prophet` is imported, so a local
+JWKS server (standing in for the authority server) is started and the
+environment is pointed at it before anything imports `prophet`.
+"""
+import os
+
+import pytest
+
+from tests.keys import JwksServer, SigningKey
+
+TENANT_ID = 'test-tenant'
+AUDIENCE = 'api://test'
+ISSUER_BASE_URL = 'https://issuer.invalid'
+ISSUER = f'{ISSUER_BASE_URL}/{TENANT_ID}/'
+
+signing_key = SigningKey('test-key', AUDIENCE, ISSUER)
+# Only served by tests which rotate the keys
+next_signing_key = SigningKey('next-key', AUDIENCE, ISSUER)
+jwks_server = JwksServer([signing_key])
+
+os.environ.update({
+    'TENANT_ID': TENANT_ID,
+    'CLIENT_ID': 'test-client',
+    'CLIENT_SECRET': '',
+    'API_AUDIENCE': AUDIENCE,
+    'AUTHORITY_BASE_URL': jwks_server.url,
+    'ISSUER_BASE_URL': ISSUER_BASE_URL,
+})
+
+from flask import request  # noqa: E402
+
+import prophet  # noqa: E402
+from prophet import auth, cache, db  # noqa: E402
+from prophet.resources import user as user_resource  # noqa: E402
+
+
+@pytest.fixture
+def jwks():
+    """The local JWKS server, serving only `signing_key`, with empty key and
+    token caches.
+    """
+    jwks_server.reset([signing_key])
+    auth.jwks_cache.clear()
+    auth.token_cache.clear()
+    return jwks_server
+
+
+@pytest.fixture
+def keys():
+    """The key which `jwks` serves and one which it doesn't, as `(current,
+    next)`.
+    """
+    return signing_key, next_signing_key
+
+
+@pytest.fixture
+def app(tmp_path, jwks):
+    """Application with a new SQLite database and empty caches.
+    """
+    app = prophet.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'METRICS_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+
+    # The routes don't require a token yet, so verify one when it's given,
+    # like `requires_auth()` would, so that "me" can be used
+    @app.before_request
+    def sign_in():
+        if 'Authorization' in request.headers:
+            auth.requires_auth(lambda: None)()
+
+    cache.cache.clear()
+    user_resource.user_id_cache.clear()
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(jwks):
+    """Builds the headers for a request signed in as a subject identifier.
+    """
+    def auth_headers(sub, scopes=()):
+        return {'Authorization': f'Bearer {signing_key.token(sub, scopes)}'}
+
+    return auth_headers
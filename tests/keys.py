@@ -0,0 +1,109 @@
+"""Signing keys for access tokens and a local stand-in for the authority
+server's key list (JWKS), shared by the tests and the benchmarks.
+
+This doesn't import `prophet`, since the authentication settings are read when
+it's imported and have to point at the server first.
+"""
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+
+class SigningKey:
+    """RSA key pair for signing access tokens for `audience`, as if they were
+    issued by `issuer`.
+    """
+
+    def __init__(self, kid, audience, issuer):
+        self.kid = kid
+        self.audience = audience
+        self.issuer = issuer
+        private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048)
+        self.pem = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()).decode()
+
+    def public_jwk(self):
+        public = jwk.construct(self.pem, 'RS256').public_key().to_dict()
+        # python-jose returns the modulus and exponent as bytes
+        public = {
+            k: v.decode() if isinstance(v, bytes) else v
+            for k, v in public.items()
+        }
+        public.update(kid=self.kid, use='sig')
+        return public
+
+    def token(self, sub, scopes=(), kid=None, **claims):
+        now = int(time.time())
+        payload = {
+            'sub': sub,
+            'aud': self.audience,
+            'iss': self.issuer,
+            'iat': now,
+            'exp': now + 3600,
+            'scp': ' '.join(scopes),
+        }
+        payload.update(claims)
+        return jwt.encode(
+            payload, self.pem, algorithm='RS256',
+            headers={'kid': kid or self.kid})
+
+
+class JwksServer:
+    """Local stand-in for the authority server's key list.
+
+    `keys` are the signing keys it serves. Setting `failing` makes it answer
+    with `503 Service Unavailable` and `delay` makes every answer that many
+    seconds late. `fetches` counts the requests it got.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.failing = False
+        self.delay = 0
+        self.max_age = 86400
+        self.fetches = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.fetches += 1
+                time.sleep(server.delay)
+                if server.failing:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+
+                body = json.dumps(
+                    {'keys': [k.public_jwk() for k in server.keys]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Cache-Control', f'max-age={server.max_age}')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(
+            target=self._server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def reset(self, keys):
+        self.keys = keys
+        self.failing = False
+        self.delay = 0
+        self.max_age = 86400
+        self.fetches = 0
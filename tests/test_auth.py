@@ -0,0 +1,138 @@
+import threading
+import time
+
+from prophet import auth
+
+
+def teapot(client, token):
+    return client.get('/teapot', headers={'Authorization': f'Bearer {token}'})
+
+
+def test_keys_are_fetched_once(client, jwks, keys):
+    for i in range(5):
+        assert teapot(client, keys[0].token(f'user-{i}')).status_code == 418
+
+    assert jwks.fetches == 1
+    assert auth.jwks_cache.stats() == {'hits': 4, 'misses': 1, 'refreshes': 1}
+
+
+def test_concurrent_first_requests_share_one_fetch(app, jwks, keys):
+    jwks.delay = 0.2
+    statuses = []
+
+    def request(i):
+        response = teapot(app.test_client(), keys[0].token(f'user-{i}'))
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [418] * 8
+    assert jwks.fetches == 1
+
+
+def test_unknown_key_id_refreshes_for_rotated_keys(
+        client, jwks, keys, monkeypatch):
+    monkeypatch.setattr(auth.jwks_cache, 'min_refresh_interval', 0)
+    assert teapot(client, keys[0].token('user')).status_code == 418
+
+    jwks.keys = list(keys)
+    assert teapot(client, keys[1].token('user')).status_code == 418
+    assert jwks.fetches == 2
+
+
+def test_unknown_key_id_refreshes_are_rate_limited(client, jwks, keys):
+    assert teapot(client, keys[0].token('user')).status_code == 418
+
+    for i in range(5):
+        response = teapot(client, keys[0].token('user', kid=f'made-up-{i}'))
+        assert response.status_code == 401
+    assert jwks.fetches == 1
+
+
+def test_failed_refreshes_are_rate_limited(
+        client, jwks, keys, monkeypatch):
+    monkeypatch.setattr(auth.jwks_cache, 'min_refresh_interval', 0.2)
+    assert teapot(client, keys[0].token('user')).status_code == 418
+    time.sleep(0.2)
+
+    # While the authority server is down, only the first unknown key ID waits
+    # on it, and known keys keep working
+    jwks.failing = True
+    for i in range(5):
+        response = teapot(client, keys[0].token('user', kid=f'made-up-{i}'))
+        assert response.status_code == 401
+    assert teapot(client, keys[0].token('other')).status_code == 418
+    assert jwks.fetches == 2
+
+    # Tried again once the interval has passed since the failed attempt
+    time.sleep(0.2)
+    jwks.failing = False
+    jwks.keys = list(keys)
+    assert teapot(client, keys[1].token('user')).status_code == 418
+    assert jwks.fetches == 3
+
+
+def test_expired_keys_are_used_while_refreshing(client, jwks, keys):
+    jwks.max_age = 0
+    assert teapot(client, keys[0].token('first')).status_code == 418
+
+    assert teapot(client, keys[0].token('second')).status_code == 418
+    for _ in range(50):
+        if auth.jwks_cache.stats()['refreshes'] == 2:
+            break
+        time.sleep(0.01)
+    assert jwks.fetches == 2
+
+
+def test_unavailable_keys(client, jwks, keys):
+    jwks.failing = True
+    response = teapot(client, keys[0].token('user'))
+    assert response.status_code == 503
+    assert response.json['error']['code'] == 'auth_error'
+
+
+def test_verified_tokens_are_cached(client, jwks, keys, monkeypatch):
+    verified = []
+    verify_token = auth.verify_token
+    monkeypatch.setattr(
+        auth, 'verify_token',
+        lambda token: verified.append(token) or verify_token(token))
+
+    token = keys[0].token('user')
+    for _ in range(3):
+        assert teapot(client, token).status_code == 418
+    assert verified == [token]
+
+    # Another token is verified on its own
+    other = keys[0].token('other')
+    assert teapot(client, other).status_code == 418
+    assert verified == [token, other]
+
+
+def test_expired_tokens_are_not_cached(client, jwks, keys):
+    token = keys[0].token('user', exp=int(time.time()) - 1)
+    # As if it had been verified while it was still valid
+    auth.token_cache.put(token, {'sub': 'user', 'exp': time.time() - 1})
+
+    assert auth.token_cache.get(token) is None
+    response = teapot(client, token)
+    assert response.status_code == 401
+    assert response.json['error']['description'] == "JWT token expired"
+
+
+def test_token_cache_is_bounded():
+    cache = auth.VerifiedTokenCache(max_size=2)
+    payload = {'sub': 'user', 'exp': time.time() + 60}
+    for token in ('a', 'b', 'c'):
+        cache.put(token, payload)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == payload
+    assert cache.get('c') == payload
+    # Tokens without an expiration aren't kept
+    cache.put('d', {'sub': 'user'})
+    assert cache.get('d') is None
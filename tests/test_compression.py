@@ -0,0 +1,47 @@
+import gzip
+import json
+
+import pytest
+
+
+@pytest.fixture
+def question(client):
+    # Long enough to be compressed
+    client.post(
+        '/questions', json={'prompt': "x" * 2000, 'correct_answer': True})
+
+
+def get(client, encoding=None, **headers):
+    if encoding is not None:
+        headers['Accept-Encoding'] = encoding
+    return client.get('/questions/1', headers=headers)
+
+
+def test_compressed_response_has_encoded_etag(client, question):
+    plain = get(client)
+    assert 'Content-Encoding' not in plain.headers
+
+    compressed = get(client, 'gzip')
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    assert json.loads(gzip.decompress(compressed.data)) == plain.json
+
+
+@pytest.mark.parametrize('encoding', [None, 'gzip'])
+def test_if_none_match_accepts_either_etag(client, question, encoding):
+    etag = get(client, encoding).headers['ETag']
+    for accepted in (None, 'gzip'):
+        response = get(client, accepted, **{'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+
+
+def test_if_match_accepts_encoded_etag(client, question):
+    etag = get(client, 'gzip').headers['ETag']
+    response = client.put(
+        '/questions/1', json={'prompt': "Changed"}, headers={'If-Match': etag})
+    assert response.status_code == 200
+
+    response = client.put(
+        '/questions/1', json={'prompt': "Again"}, headers={'If-Match': etag})
+    assert response.status_code == 412
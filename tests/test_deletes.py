@@ -0,0 +1,82 @@
+import pytest
+
+from sqlalchemy import event
+
+from prophet import db
+from prophet.models import Question, QuestionStats, Response, User
+from prophet.resources import stats as stats_resource
+
+USER_COUNT = 20
+QUESTION_COUNT = 30
+
+
+@pytest.fixture
+def responses(app):
+    """Every user has responded to every question.
+    """
+    with app.app_context():
+        db.session.execute(User.__table__.insert(), [
+            {'subject_identifier': f'user-{i}'} for i in range(USER_COUNT)
+        ])
+        for i in range(QUESTION_COUNT):
+            db.session.add(Question(
+                prompt=f"Question {i}", correct_answer=True,
+                stats=QuestionStats()))
+        db.session.commit()
+
+    client = app.test_client()
+    for user_id in range(1, USER_COUNT + 1):
+        response = client.post(f'/users/{user_id}/responses:batch', json=[
+            {
+                'question_id': question_id,
+                'response': (True, False, None)[question_id % 3],
+                'view_time': f'00:00:{question_id:02}.5',
+            }
+            for question_id in range(1, QUESTION_COUNT + 1)
+        ])
+        assert response.status_code == 200
+
+
+@pytest.fixture
+def loaded_responses():
+    """Counts the `Response` objects loaded into sessions.
+    """
+    loaded = []
+
+    def on_load(target, context):
+        loaded.append(target)
+
+    event.listen(Response, 'load', on_load)
+    yield loaded
+    event.remove(Response, 'load', on_load)
+
+
+def assert_derived_tables_correct(app):
+    runner = app.test_cli_runner()
+    stats = runner.invoke(args=['rebuild-stats', '--check']).output
+    assert stats.splitlines()[-1].startswith("0 of ")
+    scores = runner.invoke(args=['rebuild-scores', '--check']).output
+    assert all(
+        line.startswith("0 of ") for line in scores.splitlines()[-2:])
+
+
+def test_delete_question_with_responses(
+        app, client, responses, loaded_responses):
+    assert client.delete('/questions/1').status_code == 200
+
+    assert loaded_responses == []
+    with app.app_context():
+        assert Response.query.filter_by(question_id=1).count() == 0
+    assert_derived_tables_correct(app)
+
+
+def test_delete_user_with_responses(
+        app, client, responses, loaded_responses, monkeypatch):
+    # Several chunks of responses
+    monkeypatch.setattr(stats_resource, 'REMOVE_CHUNK_SIZE', 7)
+    assert client.delete('/users/1').status_code == 200
+
+    assert loaded_responses == []
+    with app.app_context():
+        assert Response.query.filter_by(user_id=1).count() == 0
+    assert_derived_tables_correct(app)
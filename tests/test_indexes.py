@@ -0,0 +1,81 @@
+"""Checks with EXPLAIN QUERY PLAN that the hot lookups use the indexes added
+by the migrations.
+"""
+import os
+
+from datetime import datetime
+
+import flask_migrate
+import pytest
+
+from prophet import db
+from prophet.models import Question, Response, User
+from prophet.resources.question import is_active
+
+MIGRATIONS = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+@pytest.fixture
+def migrated_app(app, tmp_path):
+    """Like `app`, but with the schema made by the migrations instead of the
+    models.
+    """
+    app.config['SQLALCHEMY_DATABASE_URI'] = \
+        f"sqlite:///{tmp_path / 'migrated.db'}"
+    with app.app_context():
+        flask_migrate.upgrade(directory=MIGRATIONS)
+        yield app
+
+
+def query_plan(query):
+    """Gets the details of each step of SQLite's plan for a query.
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    rows = db.session.connection().execute(
+        'EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[-1] for row in rows]
+
+
+def assert_uses_index(query, index):
+    plan = query_plan(query)
+    assert any(f'INDEX {index} ' in step for step in plan), plan
+    assert not any(step.startswith('SCAN') for step in plan), plan
+
+
+def test_user_by_subject_identifier(migrated_app):
+    assert_uses_index(
+        db.session.query(User.id).filter_by(subject_identifier='sub'),
+        'ix_user_subject_identifier')
+
+
+def test_responses_by_question_and_time(migrated_app):
+    assert_uses_index(
+        Response.query
+        .filter(Response.question_id == 1)
+        .filter(Response.answered_at >= datetime(2020, 1, 1)),
+        'ix_response_question_id_answered_at')
+
+
+def test_responses_by_question_in_user_order(migrated_app):
+    assert_uses_index(
+        Response.query
+        .filter(Response.question_id == 1)
+        .order_by(Response.question_id, Response.user_id),
+        'ix_response_question_id_user_id')
+
+
+def test_active_questions(migrated_app):
+    assert_uses_index(
+        Question.query.filter(is_active(datetime.utcnow())),
+        'ix_question_available_at_expires_at')
+
+
+def test_subject_identifier_is_unique(migrated_app):
+    db.session.add(User(subject_identifier='sub'))
+    db.session.commit()
+    db.session.add(User(subject_identifier='sub'))
+    with pytest.raises(Exception, match='UNIQUE'):
+        db.session.commit()
+    db.session.rollback()
@@ -0,0 +1,71 @@
+import time
+
+from prophet.live import Broadcaster
+
+
+def wait_for_polls(broadcaster, count):
+    start = broadcaster.stats()['polls']
+    while broadcaster.stats()['polls'] < start + count:
+        time.sleep(0.005)
+
+
+def count_notifications(broadcaster, key):
+    """Counts how many times the subscribers of `key` are woken up.
+    """
+    condition = broadcaster._topics[key].changed
+    notify_all = condition.notify_all
+    counter = {'count': 0}
+
+    def counting():
+        counter['count'] += 1
+        notify_all()
+
+    condition.notify_all = counting
+    return counter
+
+
+def test_only_changed_keys_wake_subscribers(app):
+    values = {'a': 1, 'b': 1}
+    broadcaster = Broadcaster(lambda keys: dict(values), interval=0.01)
+    broadcaster.subscribe(app, 'a')
+    broadcaster.subscribe(app, 'b')
+    try:
+        a_version, value = broadcaster.wait('a', None, 1)
+        assert value == 1
+        b_version, _ = broadcaster.wait('b', None, 1)
+        a_woken = count_notifications(broadcaster, 'a')
+
+        # Polls which don't change anything don't wake anyone
+        wait_for_polls(broadcaster, 5)
+        assert broadcaster.stats()['updates'] == 2
+
+        # Neither does a new subscriber
+        broadcaster.subscribe(app, 'c')
+        broadcaster.unsubscribe('c')
+
+        values['b'] = 2
+        assert broadcaster.wait('b', b_version, 1)[1] == 2
+        wait_for_polls(broadcaster, 2)
+        assert broadcaster.wait('a', a_version, 0.01) == (a_version, 1)
+        assert a_woken['count'] == 0
+    finally:
+        broadcaster.unsubscribe('a')
+        broadcaster.unsubscribe('b')
+
+
+def test_deleted_keys_and_poller_stops(app):
+    values = {'a': 1}
+    broadcaster = Broadcaster(lambda keys: dict(values), interval=0.01)
+    broadcaster.subscribe(app, 'a')
+    version, _ = broadcaster.wait('a', None, 1)
+
+    del values['a']
+    assert broadcaster.wait('a', version, 1)[1] is None
+
+    broadcaster.unsubscribe('a')
+    for _ in range(100):
+        if broadcaster._thread is None:
+            break
+        time.sleep(0.01)
+    assert broadcaster._thread is None
+    assert broadcaster.stats()['keys'] == 0
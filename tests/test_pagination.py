@@ -0,0 +1,51 @@
+import base64
+import json
+
+import pytest
+
+
+def make_cursor(values):
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+@pytest.fixture
+def questions(client):
+    for i in range(5):
+        client.post('/questions', json={'prompt': f"Question {i}"})
+
+
+def test_pages(client, questions):
+    response = client.get('/questions?limit=2')
+    ids = [q['id'] for q in response.json['data']]
+    while 'next' in response.json['links']:
+        response = client.get(response.json['links']['next'])
+        ids += [q['id'] for q in response.json['data']]
+
+    assert ids == [1, 2, 3, 4, 5]
+
+
+def test_composite_cursor(client, questions):
+    for id in (1, 2, 3):
+        client.post('/users', json={'subject_identifier': f'user-{id}'})
+        client.put(f'/users/{id}/responses/1', json={'response': True})
+    cursor = make_cursor([1, 1])
+    response = client.get(f'/questions/1/responses?cursor={cursor}')
+    assert [r['user_id'] for r in response.json['data']] == [2, 3]
+
+
+@pytest.mark.parametrize('cursor', [
+    'W3t9XQ',  # [{}]
+    make_cursor([[1]]),
+    make_cursor(['1']),
+    make_cursor([True]),
+    make_cursor([1.5]),
+    make_cursor([None]),
+    make_cursor([1, 2]),
+    make_cursor({'id': 1}),
+    'not a cursor',
+])
+def test_invalid_cursor(client, questions, cursor):
+    response = client.get(f'/questions?cursor={cursor}')
+    assert response.status_code == 400
+    assert response.json['error']['code'] == 'invalid_pagination'
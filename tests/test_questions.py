@@ -0,0 +1,296 @@
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+from prophet import db
+from prophet.cache import cache
+from prophet.metrics import registry
+from prophet.models import Question
+from prophet.resources import question as question_resource
+from prophet.resources import score as score_resource
+
+
+def test_concurrent_changes_without_precondition(app, client):
+    client.post('/questions', json={'prompt': "Question"})
+    statuses = {}
+    barrier = threading.Barrier(8)
+
+    def change(i):
+        client = app.test_client()
+        barrier.wait()
+        for j in range(5):
+            link = f'/{i}/{j}'
+            response = client.put(
+                '/questions/1', json={'more_info_link': link})
+            statuses[link] = response.status_code
+
+    threads = [threading.Thread(target=change, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Changes are retried a few times, and only give up if they keep losing
+    assert len(statuses) == 40
+    assert set(statuses.values()) <= {200, 409}
+    applied = {link for link, status in statuses.items() if status == 200}
+    link = client.get('/questions/1').json['data']['more_info_link']
+    assert link in applied
+
+
+def test_change_with_stale_precondition(client):
+    response = client.post('/questions', json={'prompt': "Question"})
+    etag = client.get('/questions/1').headers['ETag']
+    client.put('/questions/1', json={'prompt': "Changed"})
+
+    response = client.put(
+        '/questions/1', json={'prompt': "Mine"}, headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert response.json['error']['code'] == 'precondition_failed'
+    assert client.get('/questions/1').json['data']['prompt'] == "Changed"
+
+
+def test_change_with_current_precondition(client):
+    client.post('/questions', json={'prompt': "Question"})
+    etag = client.get('/questions/1').headers['ETag']
+
+    response = client.put(
+        '/questions/1', json={'prompt': "Mine"}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def cache_lookups(before):
+    stats = cache.stats()
+    return {k: stats[k] - before[k] for k in ('hits', 'misses')}
+
+
+def test_changing_a_question_keeps_other_cached_questions(client):
+    for i in range(2):
+        client.post('/questions', json={'prompt': f"Question {i}"})
+    client.get('/questions/1')
+    client.get('/questions/2')
+
+    before = cache.stats()
+    client.get('/questions/2')
+    assert cache_lookups(before) == {'hits': 1, 'misses': 0}
+
+    client.put('/questions/1', json={'prompt': "Changed"})
+    before = cache.stats()
+    client.get('/questions/2')
+    response = client.get('/questions/1')
+    assert response.json['data']['prompt'] == "Changed"
+    assert cache_lookups(before) == {'hits': 1, 'misses': 1}
+
+
+def test_list_cache_is_invalidated_by_changes(client):
+    client.post('/questions', json={'prompt': "Question"})
+    client.get('/questions')
+    before = cache.stats()
+    client.get('/questions')
+    assert cache_lookups(before) == {'hits': 1, 'misses': 0}
+
+    client.put('/questions/1', json={'prompt': "Changed"})
+    before = cache.stats()
+    response = client.get('/questions')
+    assert response.json['data'][0]['prompt'] == "Changed"
+    assert cache_lookups(before) == {'hits': 0, 'misses': 1}
+
+
+def test_cache_stats_on_metrics(app, client):
+    app.config['METRICS_ENABLED'] = True
+    client.post('/questions', json={'prompt': "Question"})
+    client.get('/questions/1')
+    client.get('/questions/1')
+
+    lines = client.get('/metrics').data.decode().splitlines()
+    assert '# TYPE prophet_cache_hits gauge' in lines
+    stats = cache.stats()
+    for stat in ('hits', 'misses', 'evictions', 'hit_ratio'):
+        assert f'prophet_cache_{stat}{{cache="resources"}} {stats[stat]}' \
+            in lines
+
+
+def test_sparse_fields(client):
+    for i in range(3):
+        client.post('/questions', json={
+            'prompt': f"Question {i}", 'correct_answer': True})
+
+    response = client.get('/questions?fields=id,prompt&limit=2')
+    assert response.json['data'] == [
+        {'id': 1, 'prompt': "Question 0"}, {'id': 2, 'prompt': "Question 1"}]
+    # The next page has the same fields
+    response = client.get(response.json['links']['next'])
+    assert response.json['data'] == [{'id': 3, 'prompt': "Question 2"}]
+
+    full = client.get('/questions/1')
+    response = client.get('/questions/1?fields=correct_answer')
+    assert response.json['data'] == {'correct_answer': True}
+    assert response.headers['ETag'] == full.headers['ETag']
+    # The whole question is still cached for other requests
+    assert client.get('/questions/1').json == full.json
+
+    for url in ('/questions?fields=id,secret', '/questions/1?fields=',
+                '/questions/active?fields=links'):
+        response = client.get(url)
+        assert response.status_code == 400
+        assert response.json['error']['code'] == 'invalid_field'
+
+
+def test_multi_get(client):
+    for i in range(3):
+        client.post('/questions', json={'prompt': f"Question {i}"})
+
+    response = client.get('/questions?ids=3,99,1,3')
+    assert response.status_code == 200
+    # In the requested order, once each
+    assert [q['id'] for q in response.json['data']] == [3, 1]
+    assert response.json['missing'] == [99]
+
+    response = client.get('/questions?ids=2&fields=prompt')
+    assert response.json['data'] == [{'prompt': "Question 1"}]
+
+    too_many = ','.join(
+        str(id) for id in range(question_resource.MAX_MULTI_GET_IDS + 1))
+    for ids in ('', '1,a', too_many):
+        response = client.get(f'/questions?ids={ids}')
+        assert response.status_code == 400
+        assert response.json['error']['code'] == 'invalid_field'
+
+
+def active_ids(client):
+    response = client.get('/questions/active')
+    assert response.status_code == 200
+    return [q['id'] for q in response.json['data']]
+
+
+def test_active_questions(client):
+    now = datetime.utcnow()
+    for available_at, expires_at in (
+            (now - timedelta(days=1), None),
+            (now + timedelta(days=1), None),
+            (now - timedelta(days=2), now - timedelta(days=1)),
+            (now - timedelta(days=1), now + timedelta(days=1))):
+        client.post('/questions', json={
+            'prompt': "Question",
+            'available_at': available_at.isoformat(),
+            'expires_at': expires_at and expires_at.isoformat(),
+        })
+    assert active_ids(client) == [1, 4]
+
+    # Changes show up right away
+    client.put('/questions/4', json={
+        'expires_at': (now - timedelta(seconds=1)).isoformat()})
+    assert active_ids(client) == [1]
+
+
+def test_active_questions_cached_until_next_change(client):
+    now = datetime.utcnow()
+    client.post('/questions', json={'prompt': "Now"})
+    client.post('/questions', json={
+        'prompt': "Soon",
+        'available_at': (now + timedelta(seconds=1)).isoformat(),
+    })
+    assert active_ids(client) == [1]
+
+    before = cache.stats()
+    assert active_ids(client) == [1]
+    assert cache_lookups(before) == {'hits': 1, 'misses': 0}
+
+    # Without any change to the questions, the cached page runs out when the
+    # second one becomes available
+    time.sleep(max(0, (now - datetime.utcnow()).total_seconds() + 1.1))
+    assert active_ids(client) == [1, 2]
+
+
+def metric_samples(client):
+    """Gets the samples on `/metrics` as a mapping from the name with its
+    labels to the value.
+    """
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    return {
+        line.rpartition(' ')[0]: float(line.rpartition(' ')[2])
+        for line in response.data.decode().splitlines()
+        if not line.startswith('#')
+    }
+
+
+def test_request_metrics(app, client):
+    app.config['METRICS_ENABLED'] = True
+    registry.clear()
+    client.post('/questions', json={'prompt': "Question"})
+    for id in (1, 1, 99):
+        response = client.get(f'/questions/{id}')
+        timings = response.headers['Server-Timing'].split(', ')
+        assert timings[0].startswith('total;dur=')
+        assert [t.partition(';')[0] for t in timings] == [
+            'total', 'sql', 'auth', 'dump', 'compress']
+
+    samples = metric_samples(client)
+    labels = 'endpoint="api.question_detail",method="GET"'
+    assert samples[f'prophet_request_duration_seconds_count{{{labels}}}'] == 3
+    buckets = [
+        value for name, value in samples.items()
+        if name.startswith(
+            f'prophet_request_duration_seconds_bucket{{{labels},')
+    ]
+    # Cumulative, ending with every request
+    assert buckets == sorted(buckets)
+    assert buckets[-1] == 3
+    assert samples[f'prophet_requests_total{{{labels},status="200"}}'] == 2
+    assert samples[f'prophet_requests_total{{{labels},status="404"}}'] == 1
+    assert samples[f'prophet_sql_statements_total{{{labels}}}'] >= 3
+    assert samples[f'prophet_sql_duration_seconds_total{{{labels}}}'] > 0
+
+
+def test_metrics_disabled(client):
+    response = client.get('/questions')
+    assert 'Server-Timing' not in response.headers
+    assert client.get('/metrics').status_code == 404
+
+
+def change_version_elsewhere(app, times):
+    """Makes the next `times` changes to question 1 collide with a change
+    made by another worker, right before they're committed.
+    """
+    calls = []
+    update_scores_for_answer = score_resource.update_scores_for_answer
+
+    def colliding(*args):
+        calls.append(args)
+        if len(calls) <= times:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    'UPDATE question SET version = version + 1 WHERE id = 1')
+        update_scores_for_answer(*args)
+
+    return calls, colliding
+
+
+def test_change_retried_after_conflict(app, client, monkeypatch):
+    client.post('/questions', json={'prompt': "Question"})
+    calls, colliding = change_version_elsewhere(app, 1)
+    monkeypatch.setattr(
+        score_resource, 'update_scores_for_answer', colliding)
+
+    response = client.put('/questions/1', json={'prompt': "Changed"})
+    assert response.status_code == 200
+    assert response.json['data']['prompt'] == "Changed"
+    assert len(calls) == 2
+
+
+def test_change_gives_up_after_repeated_conflicts(app, client, monkeypatch):
+    client.post('/questions', json={'prompt': "Question"})
+    calls, colliding = change_version_elsewhere(app, 100)
+    monkeypatch.setattr(
+        score_resource, 'update_scores_for_answer', colliding)
+
+    response = client.put('/questions/1', json={'prompt': "Changed"})
+    assert response.status_code == 409
+    assert response.json['error']['code'] == 'conflict'
+    assert len(calls) == question_resource.MAX_UPDATE_ATTEMPTS
+    with app.app_context():
+        assert Question.query.get(1).prompt == "Question"
@@ -0,0 +1,354 @@
+import csv
+import io
+import json
+import random
+import threading
+import time
+
+import pytest
+
+import prophet
+
+from prophet.models import Response
+from prophet.resources import export
+from prophet.resources import response as response_resource
+from prophet.writebehind import WriteBehindQueue
+
+USER_COUNT = 3
+QUESTION_COUNT = 5
+
+
+@pytest.fixture
+def answers(client):
+    """Users and questions with correct answers to respond to.
+    """
+    for i in range(USER_COUNT):
+        client.post('/users', json={'subject_identifier': f'user-{i}'})
+    for i in range(QUESTION_COUNT):
+        client.post('/questions', json={
+            'prompt': f"Question {i}", 'correct_answer': i % 2 == 0})
+
+
+def hammer(app, build, threads=8, requests=20):
+    """Sends requests built by `build(rng)` as `(method, path, json)` from
+    several threads at once, and returns the status codes.
+    """
+    statuses = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        barrier.wait()
+        for _ in range(requests):
+            method, path, body = build(rng)
+            status = client.open(path, method=method, json=body).status_code
+            with lock:
+                statuses.append(status)
+
+    workers = [
+        threading.Thread(target=worker, args=(i,)) for i in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return statuses
+
+
+def assert_derived_tables_correct(app):
+    runner = app.test_cli_runner()
+    stats = runner.invoke(args=['rebuild-stats', '--check']).output
+    assert f"0 of {QUESTION_COUNT} questions had wrong tallies" in stats
+    scores = runner.invoke(args=['rebuild-scores', '--check']).output
+    assert f"0 of {USER_COUNT} users had wrong scores" in scores
+    assert scores.splitlines()[-1].startswith("0 of ")
+
+
+def put(rng):
+    return (
+        'PUT', '/users/1/responses/1',
+        {'response': rng.choice((True, False, None))})
+
+
+def batch(rng):
+    return (
+        'POST', '/users/1/responses:batch',
+        [
+            {'question_id': id, 'response': rng.choice((True, False, None))}
+            for id in range(1, QUESTION_COUNT + 1)
+        ])
+
+
+def test_concurrent_puts_to_one_response(app, answers):
+    statuses = hammer(app, put)
+    assert set(statuses) == {200}
+    assert_derived_tables_correct(app)
+
+
+def test_concurrent_batches_of_the_same_responses(app, answers):
+    statuses = hammer(app, batch)
+    assert set(statuses) == {200}
+    assert_derived_tables_correct(app)
+
+
+def test_concurrent_puts_and_batches(app, client, answers):
+    statuses = hammer(
+        app, lambda rng: put(rng) if rng.random() < 0.5 else batch(rng))
+    assert set(statuses) == {200}
+    assert_derived_tables_correct(app)
+
+    # Every item of the last batches was saved
+    response = client.get('/users/1/responses')
+    assert len(response.json['data']) == QUESTION_COUNT
+
+
+def test_concurrent_responses_and_answer_changes(app, answers):
+    # Several users' scores move between the counts of users with each score
+    def build(rng):
+        user_id = rng.randint(1, USER_COUNT)
+        kind = rng.random()
+        if kind < 0.4:
+            return (
+                'PUT',
+                f'/users/{user_id}/responses/'
+                f'{rng.randint(1, QUESTION_COUNT)}',
+                {'response': rng.choice((True, False, None))})
+        if kind < 0.7:
+            return (
+                'POST', f'/users/{user_id}/responses:batch',
+                [
+                    {
+                        'question_id': id,
+                        'response': rng.choice((True, False, None)),
+                    }
+                    for id in range(1, QUESTION_COUNT + 1)
+                ])
+        return (
+            'PUT', f'/questions/{rng.randint(1, QUESTION_COUNT)}',
+            {'correct_answer': rng.choice((True, False, None))})
+
+    statuses = hammer(app, build)
+    # Changes to a question may give up if it keeps being changed
+    assert set(statuses) <= {200, 409}
+    assert_derived_tables_correct(app)
+
+
+def test_put_to_missing_question(client, answers):
+    response = client.put('/users/1/responses/99', json={'response': True})
+    assert response.status_code == 404
+    assert response.json['error']['code'] == 'question_not_found'
+
+
+def test_put_for_missing_user(client, answers):
+    response = client.put('/users/99/responses/1', json={'response': True})
+    assert response.status_code == 404
+    assert response.json['error']['code'] == 'user_not_found'
+
+
+def test_user_responses_not_modified(client, answers):
+    client.put('/users/1/responses/1', json={'response': True})
+    etag = client.get('/users/1/responses').headers['ETag']
+
+    response = client.get(
+        '/users/1/responses', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+    # Both a new response and a changed one make a new list
+    client.put('/users/1/responses/2', json={'response': False})
+    response = client.get(
+        '/users/1/responses', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.json['data']) == 2
+    etag = response.headers['ETag']
+
+    client.put('/users/1/responses/2', json={'response': None})
+    response = client.get(
+        '/users/1/responses', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['data'][1]['response'] is None
+
+    # Each page has its own tag
+    response = client.get(
+        '/users/1/responses?limit=1',
+        headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+
+
+def test_user_responses_include_questions(client, answers):
+    for question_id in (2, 1):
+        client.put(
+            f'/users/1/responses/{question_id}', json={'response': True})
+
+    response = client.get('/users/1/responses?include=question&limit=1')
+    data = response.json['data']
+    assert [r['question']['id'] for r in data] == [1]
+    assert data[0]['question']['prompt'] == "Question 0"
+    response = client.get(response.json['links']['next'])
+    assert [r['question']['id'] for r in response.json['data']] == [2]
+
+    # Changing a question changes the responses which include it
+    etag = client.get('/users/1/responses?include=question').headers['ETag']
+    plain_etag = client.get('/users/1/responses').headers['ETag']
+    client.put('/questions/1', json={'prompt': "Changed"})
+    response = client.get(
+        '/users/1/responses?include=question',
+        headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['data'][0]['question']['prompt'] == "Changed"
+    response = client.get(
+        '/users/1/responses', headers={'If-None-Match': plain_etag})
+    assert response.status_code == 304
+
+    assert client.get('/users/1/responses?include=user').status_code == 400
+
+
+@pytest.fixture
+def export_headers(auth_headers):
+    return auth_headers('analyst', [export.EXPORT_SCOPE])
+
+
+def export_rows(client, headers, query=''):
+    response = client.get(f'/responses/export?{query}', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.data.splitlines()]
+
+
+def test_export(client, answers, export_headers, monkeypatch):
+    monkeypatch.setattr(export, 'EXPORT_CHUNK_SIZE', 2)
+    for user_id in (2, 1):
+        for question_id in (3, 1, 2):
+            client.put(
+                f'/users/{user_id}/responses/{question_id}',
+                json={'response': user_id == 1, 'view_time': '00:00:05'})
+
+    rows = export_rows(client, export_headers)
+    # Ordered by question and then user, over several chunks
+    assert [(r['question_id'], r['user_id']) for r in rows] == [
+        (1, 1), (1, 2), (2, 1), (2, 2), (3, 1), (3, 2)]
+    assert rows[0]['response'] is True
+    assert rows[0]['view_time'] == '00:00:05'
+
+    rows = export_rows(client, export_headers, 'question_id=2')
+    assert [(r['question_id'], r['user_id']) for r in rows] == [(2, 1), (2, 2)]
+    rows = export_rows(client, export_headers, 'user_id=2&after=1,2')
+    assert [(r['question_id'], r['user_id']) for r in rows] == [(2, 2), (3, 2)]
+    assert export_rows(
+        client, export_headers, 'answered_before=2000-01-01T00:00:00') == []
+    assert len(export_rows(
+        client, export_headers, 'answered_since=2000-01-01T00:00:00')) == 6
+
+
+def test_export_csv(client, answers, export_headers):
+    client.put('/users/1/responses/1', json={'response': None})
+
+    response = client.get(
+        '/responses/export?format=csv', headers=export_headers)
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.data.decode())))
+    assert rows[0] == [
+        'user_id', 'question_id', 'response', 'view_time', 'answered_at']
+    assert rows[1][:4] == ['1', '1', '', '']
+
+
+def test_export_requires_scope(client, answers, auth_headers):
+    assert client.get('/responses/export').status_code == 401
+    response = client.get(
+        '/responses/export', headers=auth_headers('student'))
+    assert response.status_code == 401
+    assert response.json['error']['code'] == 'auth_error'
+
+
+@pytest.fixture
+def write_behind(app, monkeypatch):
+    """Turns on write-behind with a queue of its own, which only saves the
+    queued responses when it's closed or has a full batch.
+    """
+    app.config['RESPONSE_WRITE_BEHIND'] = True
+
+    def make_queue(**options):
+        queue = WriteBehindQueue(
+            response_resource.flush_queued_responses,
+            merge=response_resource.merge_queued_responses,
+            **dict({'interval': 60, 'batch_size': 100}, **options))
+        monkeypatch.setattr(response_resource, 'response_queue', queue)
+        return queue
+
+    return make_queue
+
+
+def saved_response(app, user_id, question_id):
+    with app.app_context():
+        return Response.query.get((user_id, question_id))
+
+
+def test_queued_response_is_read_back(app, client, answers, write_behind):
+    queue = write_behind()
+    response = client.put('/users/1/responses/1', json={'response': True})
+    assert response.status_code == 202
+    assert response.json['data']['response'] is True
+
+    response = client.put(
+        '/users/1/responses/1',
+        json={'response': False, 'view_time': '00:00:03'})
+    assert response.status_code == 202
+    assert saved_response(app, 1, 1) is None
+    assert queue.stats()['pending'] == 1
+
+    # Seen by this worker before it's saved
+    response = client.get('/users/1/responses/1')
+    assert response.status_code == 200
+    assert response.json['data']['response'] is False
+    assert response.json['data']['view_time'] == '00:00:03'
+    assert 'ETag' not in response.headers
+
+    # Saved once, with the last change, when the queue is drained
+    queue.close()
+    assert queue.stats() == {
+        'pending': 0, 'flushes': 1, 'saved': 1, 'rejected': 0}
+    assert saved_response(app, 1, 1).response is False
+    response = client.get('/users/1/responses/1')
+    assert response.json['data']['response'] is False
+    assert 'ETag' in response.headers
+    assert_derived_tables_correct(app)
+
+
+def test_full_batch_is_saved_right_away(app, client, answers, write_behind):
+    queue = write_behind(batch_size=2)
+    for question_id in (1, 2):
+        client.put(
+            f'/users/1/responses/{question_id}', json={'response': True})
+
+    for _ in range(100):
+        if queue.stats()['saved'] == 2:
+            break
+        time.sleep(0.01)
+    assert queue.stats()['saved'] == 2
+    assert saved_response(app, 1, 2).response is True
+    queue.close()
+
+
+def test_full_queue_is_rejected(client, answers, write_behind):
+    queue = write_behind(max_size=1, put_timeout=0)
+    client.put('/users/1/responses/1', json={'response': True})
+
+    # Changes to a queued response still fit
+    response = client.put('/users/1/responses/1', json={'response': None})
+    assert response.status_code == 202
+    response = client.put('/users/1/responses/2', json={'response': True})
+    assert response.status_code == 503
+    assert response.json['error']['code'] == 'too_busy'
+    assert response.headers['Retry-After'] == '1'
+    queue.close()
+
+
+def test_write_behind_from_environment(monkeypatch):
+    monkeypatch.setenv('RESPONSE_WRITE_BEHIND', 'true')
+    assert prophet.create_app().config['RESPONSE_WRITE_BEHIND'] is True
+    monkeypatch.setenv('RESPONSE_WRITE_BEHIND', '0')
+    assert prophet.create_app().config['RESPONSE_WRITE_BEHIND'] is False
+    monkeypatch.delenv('RESPONSE_WRITE_BEHIND')
+    assert 'RESPONSE_WRITE_BEHIND' not in prophet.create_app().config
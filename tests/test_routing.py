@@ -0,0 +1,85 @@
+"""Routing of statements between the primary database and a replica, which
+are two separate SQLite files here, so that the file a row is read from shows
+where the statement went.
+"""
+import time
+
+import pytest
+
+from prophet import db
+from prophet.models import Question, User
+from prophet.routing import STICKINESS_COOKIE
+
+
+@pytest.fixture
+def replica(app, tmp_path):
+    """Adds a replica with the same tables to `app`, which isn't copied from
+    the primary, and gives its engine.
+    """
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': f"sqlite:///{tmp_path / 'replica.db'}",
+    }
+    app.config['DATABASE_REPLICAS'] = ['replica']
+    with app.app_context():
+        engine = db.get_engine(app, bind='replica')
+        db.Model.metadata.create_all(engine)
+    return engine
+
+
+def count_rows(app, model, bind=None):
+    with app.app_context():
+        engine = db.get_engine(app, bind=bind)
+        return engine.execute(
+            db.select([db.func.count()]).select_from(model.__table__)
+        ).scalar()
+
+
+def test_reads_go_to_the_replica(client, replica):
+    replica.execute(Question.__table__.insert(), prompt="On the replica")
+
+    response = client.get('/questions/1')
+    assert response.status_code == 200
+    assert response.json['data']['prompt'] == "On the replica"
+    assert len(client.get('/questions').json['data']) == 1
+
+
+def test_writes_go_to_the_primary(app, client, replica):
+    response = client.post('/questions', json={'prompt': "Question"})
+    assert response.status_code == 200
+    assert response.json['data']['prompt'] == "Question"
+
+    assert count_rows(app, Question) == 1
+    assert count_rows(app, Question, 'replica') == 0
+    # Without stickiness, the next read goes to the replica, which is behind
+    assert STICKINESS_COOKIE not in response.headers.get('Set-Cookie', '')
+    assert client.get('/questions/1').status_code == 404
+
+
+def test_reads_after_a_write_in_a_request_go_to_the_primary(
+        app, client, replica, auth_headers):
+    # Creates the user and then reads it back in the same `GET`, which would
+    # fail if the new row was looked for on the replica
+    response = client.get('/users/me', headers=auth_headers('alice'))
+    assert response.status_code == 200
+    assert response.json['data']['id'] == 1
+    assert response.json['data']['score']['user_id'] == 1
+
+    assert count_rows(app, User) == 1
+    assert count_rows(app, User, 'replica') == 0
+
+
+def test_reads_stick_to_the_primary_after_a_write(app, client, replica):
+    app.config['DATABASE_STICKINESS'] = 60
+    response = client.post('/questions', json={'prompt': "Question"})
+    assert STICKINESS_COOKIE in response.headers['Set-Cookie']
+
+    # The client which wrote sees its change, while others read the replica
+    assert client.get('/questions/1').status_code == 200
+    assert app.test_client().get('/questions/1').status_code == 404
+
+    # Reads don't extend it
+    response = client.get('/questions/1')
+    assert 'Set-Cookie' not in response.headers
+
+    client.set_cookie('localhost', STICKINESS_COOKIE, str(time.time() - 1))
+    assert client.get('/questions/1').status_code == 404
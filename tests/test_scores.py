@@ -0,0 +1,91 @@
+import pytest
+
+from prophet import db
+from prophet.models import UserScoreCount
+
+
+@pytest.fixture
+def questions(client):
+    for i in range(3):
+        client.post(
+            '/questions',
+            json={'prompt': f"Question {i}", 'correct_answer': True})
+    for i in range(4):
+        client.post('/users', json={'subject_identifier': f'user-{i}'})
+
+
+def respond(client, user_id, question_id, response):
+    response = client.put(
+        f'/users/{user_id}/responses/{question_id}',
+        json={'response': response})
+    assert response.status_code == 200
+
+
+def rank(client, user_id):
+    return client.get(f'/users/{user_id}').json['data']['score']['rank']
+
+
+def score_counts(app):
+    with app.app_context():
+        return {
+            c.correct_count: c.user_count
+            for c in UserScoreCount.query if c.user_count
+        }
+
+
+def test_ranks(app, client, questions):
+    # Users 1 and 2 have 2 correct responses, 3 has 1 and 4 has none
+    for user_id, responses in ((1, (True, True)), (2, (True, True, False)),
+                               (3, (False, True)), (4, (False,))):
+        for question_id, response in enumerate(responses, 1):
+            respond(client, user_id, question_id, response)
+
+    assert [rank(client, id) for id in (1, 2, 3, 4)] == [1, 1, 3, 4]
+    assert score_counts(app) == {2: 2, 1: 1, 0: 1}
+
+    # A changed response moves the user to another score
+    respond(client, 3, 1, True)
+    assert [rank(client, id) for id in (1, 2, 3, 4)] == [1, 1, 1, 4]
+    assert score_counts(app) == {2: 3, 0: 1}
+
+
+def test_ranks_after_correct_answer_changes(app, client, questions):
+    respond(client, 1, 1, True)
+    respond(client, 2, 1, False)
+
+    client.put('/questions/1', json={'correct_answer': False})
+    assert [rank(client, id) for id in (1, 2)] == [2, 1]
+    assert score_counts(app) == {1: 1, 0: 1}
+
+    client.delete('/questions/1')
+    assert [rank(client, id) for id in (1, 2)] == [1, 1]
+    assert score_counts(app) == {0: 2}
+
+
+def test_ranks_after_batch_and_delete(app, client, questions):
+    response = client.post('/users/1/responses:batch', json=[
+        {'question_id': id, 'response': True} for id in (1, 2, 3)
+    ])
+    assert response.status_code == 200
+    respond(client, 2, 1, True)
+    assert score_counts(app) == {3: 1, 1: 1}
+    assert rank(client, 2) == 2
+
+    client.delete('/users/1')
+    assert score_counts(app) == {1: 1}
+    assert rank(client, 2) == 1
+
+
+def test_rebuild_scores_fixes_counts(app, client, questions):
+    respond(client, 1, 1, True)
+    with app.app_context():
+        UserScoreCount.query.delete()
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    output = runner.invoke(args=['rebuild-scores', '--check']).output
+    assert "1 of 1 scores had wrong user counts" in output
+    runner.invoke(args=['rebuild-scores'])
+    assert score_counts(app) == {1: 1}
+    output = runner.invoke(args=['rebuild-scores', '--check']).output
+    assert "0 of 1 scores had wrong user counts" in output
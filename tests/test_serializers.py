@@ -0,0 +1,110 @@
+"""Checks that the routes which use the generated serializers return exactly
+the same bodies as they would by dumping the models with the marshmallow
+schemas.
+"""
+from datetime import datetime, time
+
+import pytest
+
+from flask import jsonify
+
+from prophet import db
+from prophet.models import Question, Response, User
+from prophet.schemas import (
+    question_schema, questions_schema, responses_schema, users_schema)
+
+
+@pytest.fixture
+def seeded(app):
+    """Questions, users and responses with null values and datetimes with
+    microseconds in them.
+    """
+    with app.app_context():
+        db.session.add_all([
+            User(subject_identifier='alice'),
+            User(subject_identifier='bob'),
+            Question(
+                prompt="Everything", correct_answer=True,
+                more_info_link='https://example.com/1',
+                available_at=datetime(2020, 1, 2, 3, 4, 5, 678901),
+                expires_at=datetime(2030, 1, 1)),
+            # No link, correct answer or expiration
+            Question(prompt="Nothing", available_at=datetime(2020, 1, 1)),
+            Question(
+                prompt="Ünïcode \"quoted\"", correct_answer=False,
+                available_at=datetime(2020, 6, 1, 12)),
+        ])
+        db.session.flush()
+        db.session.add_all([
+            Response(
+                user_id=1, question_id=1, response=True,
+                view_time=time(0, 1, 2, 345678),
+                answered_at=datetime(2020, 1, 3, 4, 5, 6, 789012)),
+            # Skipped, without a view time
+            Response(
+                user_id=1, question_id=2, response=None,
+                answered_at=datetime(2020, 1, 4)),
+            Response(
+                user_id=1, question_id=3, response=False,
+                view_time=time(0, 0, 5), answered_at=datetime(2020, 6, 2)),
+            Response(
+                user_id=2, question_id=1, response=False,
+                answered_at=datetime(2020, 1, 5, 0, 0, 0, 1)),
+        ])
+        db.session.commit()
+    return app
+
+
+def assert_same_body(app, response, data):
+    """Checks that a response's body is byte for byte what it would be with
+    `data`, dumped by the schemas, instead of the serializers' output.
+    """
+    assert response.status_code == 200
+    with app.test_request_context():
+        expected = jsonify(dict(response.json, data=data)).get_data()
+    assert response.get_data() == expected
+
+
+def dump_questions():
+    return questions_schema.dump(Question.query.order_by(Question.id))
+
+
+def dump_users():
+    return users_schema.dump(User.query.order_by(User.id))
+
+
+def dump_responses(**filters):
+    return responses_schema.dump(
+        Response.query
+        .filter_by(**filters)
+        .order_by(Response.user_id, Response.question_id))
+
+
+@pytest.mark.parametrize('url, dump', [
+    ('/questions', dump_questions),
+    ('/questions?ids=1,2,3', dump_questions),
+    ('/questions/active', dump_questions),
+    ('/users', dump_users),
+    ('/users?ids=1,2', dump_users),
+    ('/users/1/responses', lambda: dump_responses(user_id=1)),
+    ('/questions/1/responses', lambda: dump_responses(question_id=1)),
+])
+def test_same_as_schemas(seeded, url, dump):
+    response = seeded.test_client().get(url)
+    with seeded.app_context():
+        data = dump()
+    assert_same_body(seeded, response, data)
+
+
+def test_included_questions_same_as_schemas(seeded):
+    response = seeded.test_client().get('/users/1/responses?include=question')
+    with seeded.app_context():
+        responses = Response.query \
+            .filter_by(user_id=1) \
+            .order_by(Response.question_id) \
+            .all()
+        data = [
+            dict(item, question=question_schema.dump(r.question))
+            for item, r in zip(responses_schema.dump(responses), responses)
+        ]
+    assert_same_body(seeded, response, data)
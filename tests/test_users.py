@@ -0,0 +1,186 @@
+import threading
+
+from prophet import db
+from prophet.models import User
+from prophet.resources import user as user_resource
+
+
+def delete_user_elsewhere(app, id):
+    """Deletes a user without going through this worker's cache, like another
+    worker would.
+    """
+    with app.app_context():
+        User.query.filter_by(id=id).delete()
+        db.session.commit()
+
+
+def test_me_after_user_deleted_by_another_worker(app, client, auth_headers):
+    headers = auth_headers('alice')
+    id = client.get('/users/me', headers=headers).json['data']['id']
+
+    delete_user_elsewhere(app, id)
+    response = client.get('/users/me', headers=headers)
+    assert response.status_code == 200
+    with app.app_context():
+        user = User.query.get(response.json['data']['id'])
+        assert user.subject_identifier == 'alice'
+
+
+def test_delete_me_after_user_deleted_by_another_worker(
+        app, client, auth_headers):
+    headers = auth_headers('alice')
+    id = client.get('/users/me', headers=headers).json['data']['id']
+
+    delete_user_elsewhere(app, id)
+    response = client.delete('/users/me', headers=headers)
+    assert response.status_code == 404
+    assert response.json['error']['code'] == 'user_not_found'
+
+
+def test_delete_and_recreate_me(app, client, auth_headers):
+    headers = auth_headers('alice')
+    client.post(
+        '/questions', json={'prompt': "Question", 'correct_answer': True})
+    old_id = client.get('/users/me', headers=headers).json['data']['id']
+    response = client.put(
+        '/users/me/responses/1', json={'response': True}, headers=headers)
+    assert response.status_code == 200
+
+    assert client.delete('/users/me', headers=headers).status_code == 200
+    assert user_resource.user_id_cache.get('alice') is None
+    # Only looking up "me" doesn't create the user again
+    response = client.get('/users/me/responses', headers=headers)
+    assert response.status_code == 404
+    assert response.json['error']['code'] == 'user_not_found'
+
+    # IDs of deleted users aren't reused
+    new_id = client.get('/users/me', headers=headers).json['data']['id']
+    assert new_id != old_id
+    assert user_resource.user_id_cache.get('alice') == new_id
+    # None of the deleted user's responses carry over
+    response = client.get('/users/me/responses', headers=headers)
+    assert response.status_code == 200
+    assert response.json['data'] == []
+
+
+def test_cached_id_given_to_another_user(app, client, auth_headers):
+    alice = auth_headers('alice')
+    id = client.get('/users/me', headers=alice).json['data']['id']
+    client.post('/questions', json={'prompt': "Question"})
+
+    # Another worker deletes alice and bob gets the same ID, which only
+    # happens if IDs are reused (like SQLite did without AUTOINCREMENT)
+    delete_user_elsewhere(app, id)
+    with app.app_context():
+        db.session.add(User(id=id, subject_identifier='bob'))
+        db.session.commit()
+
+    response = client.put(
+        '/users/me/responses/1', json={'response': True}, headers=alice)
+    assert response.status_code == 404
+    assert response.json['error']['code'] == 'user_not_found'
+    assert user_resource.user_id_cache.get('alice') is None
+
+    response = client.get('/users/me', headers=alice)
+    assert response.status_code == 200
+    new_id = response.json['data']['id']
+    assert new_id != id
+    with app.app_context():
+        assert User.query.get(new_id).subject_identifier == 'alice'
+        assert User.query.get(id).subject_identifier == 'bob'
+
+
+def test_lookup_started_before_delete_is_not_cached():
+    cache = user_resource.UserIdCache()
+    token = cache.token()
+    cache.invalidate('alice')
+    cache.fill('alice', 1, token)
+    assert cache.get('alice') is None
+
+    cache.fill('alice', 2, cache.token())
+    assert cache.get('alice') == 2
+
+
+def test_concurrent_first_requests_create_one_user(app, auth_headers):
+    headers = auth_headers('alice')
+    ids = []
+    barrier = threading.Barrier(8)
+
+    def request():
+        client = app.test_client()
+        barrier.wait()
+        response = client.get('/users/me', headers=headers)
+        assert response.status_code == 200
+        ids.append(response.json['data']['id'])
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(ids) == 8
+    assert len(set(ids)) == 1
+    with app.app_context():
+        assert User.query.filter_by(subject_identifier='alice').count() == 1
+    assert user_resource.user_id_cache.get('alice') == ids[0]
+
+
+def test_unanswered_questions(client, auth_headers):
+    headers = auth_headers('alice')
+    client.get('/users/me', headers=headers)
+    client.post('/users', json={'subject_identifier': 'bob'})
+    for i in range(5):
+        client.post('/questions', json={'prompt': f"Question {i}"})
+    client.post('/questions', json={
+        'prompt': "Later", 'available_at': '2999-01-01T00:00:00'})
+    client.put('/users/1/responses/2', json={'response': True})
+    # Skipped questions count as answered
+    client.put('/users/1/responses/4', json={'response': None})
+    client.put('/users/2/responses/1', json={'response': True})
+
+    def ids(query, headers=None):
+        response = client.get(f'/users/{query}', headers=headers)
+        assert response.status_code == 200
+        return [q['id'] for q in response.json['data']]
+
+    assert ids('1/questions') == [1, 2, 3, 4, 5]
+    assert ids('1/questions?unanswered=true') == [1, 3, 5]
+    assert ids('1/questions?unanswered=false') == [2, 4]
+    assert ids('me/questions?unanswered=true', headers) == [1, 3, 5]
+
+    # Paged like the other lists
+    response = client.get('/users/1/questions?unanswered=true&limit=2')
+    assert [q['id'] for q in response.json['data']] == [1, 3]
+    response = client.get(response.json['links']['next'])
+    assert [q['id'] for q in response.json['data']] == [5]
+    assert 'next' not in response.json['links']
+
+    assert client.get('/users/99/questions').status_code == 404
+
+
+def test_sparse_fields(client):
+    client.post('/users', json={'subject_identifier': 'alice'})
+    client.post('/questions', json={'prompt': "Question"})
+    client.put('/users/1/responses/1', json={'response': None})
+
+    assert client.get('/users?fields=id').json['data'] == [{'id': 1}]
+    response = client.get('/users/1?fields=score')
+    assert list(response.json['data']) == ['score']
+    assert response.json['data']['score']['rank'] == 1
+    assert client.get('/users/1?fields=id').json['data'] == {'id': 1}
+
+    response = client.get('/users/1/responses?fields=question_id,response')
+    assert response.json['data'] == [{'question_id': 1, 'response': None}]
+    response = client.get('/users/1/responses/1?fields=response')
+    assert response.json['data'] == {'response': None}
+    assert client.get('/users?fields=score').status_code == 400
+
+
+def test_multi_get(client):
+    for sub in ('alice', 'bob'):
+        client.post('/users', json={'subject_identifier': sub})
+
+    response = client.get('/users?ids=2,5,1')
+    assert [u['id'] for u in response.json['data']] == [2, 1]
+    assert response.json['missing'] == [5]